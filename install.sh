@@ -15,7 +15,7 @@ echo "==> Installing OS packages"
 apt-get update
 apt-get install -y \
   python3 python3-venv python3-pip \
-  wireguard-tools iproute2 iptables natpmpc \
+  wireguard-tools iproute2 iptables \
   iputils-ping curl ca-certificates >/tmp/apt.log && tail -n 20 /tmp/apt.log
 
 mkdir -p "$INSTALL_DIR"
@@ -0,0 +1,273 @@
+# pvpn/catalog.py
+
+"""
+Indexed catalog of the WireGuard configs in ``wireguard/``:
+- Server: compact record of one config (addresses, DNS, endpoint, keys, tags)
+- parse_file: parse a single .conf into a Server
+- read_wg / wg_config: the ``wg setconf`` subset of a .conf (IPv6 route added)
+- load_catalog: return all Servers, re-parsing only files whose
+  mtime/size changed since the persisted index was written
+
+Private keys are never copied into the index; they are read from the
+source file only when the interface is brought up. Source configs are
+never modified.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import json
+import logging
+import tempfile
+
+CATALOG_FILE = "catalog.json"
+CATALOG_VERSION = 1
+
+_NAME_PREFIXES = ("wg", "protonvpn", "proton")
+_SC_ENTRY_COUNTRIES = ("ch", "is", "se")
+# Keys understood by ``wg setconf``; everything else is wg-quick only
+_WG_INTERFACE_KEYS = {"privatekey": "PrivateKey", "listenport": "ListenPort", "fwmark": "FwMark"}
+_WG_PEER_KEYS = {
+    "publickey": "PublicKey",
+    "presharedkey": "PresharedKey",
+    "allowedips": "AllowedIPs",
+    "endpoint": "Endpoint",
+    "persistentkeepalive": "PersistentKeepalive",
+}
+_LIST_KEYS = ("address", "dns", "allowedips")
+
+
+class Server:
+    """A WireGuard config file and the tags derived from its name/contents."""
+
+    __slots__ = (
+        "path", "name", "mtime", "size", "addresses", "dns", "endpoint",
+        "public_key", "allowed_ips", "country", "p2p", "secure_core",
+    )
+
+    def __init__(self, path: str, endpoint: str = "", country: str = "",
+                 p2p: bool = False, secure_core: bool = False, addresses=(),
+                 dns=(), public_key: str = "", allowed_ips=(), mtime: int = 0, size: int = 0):
+        self.path = path
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        self.endpoint = endpoint
+        self.country = country
+        self.p2p = p2p
+        self.secure_core = secure_core
+        self.addresses = tuple(addresses)
+        self.dns = tuple(dns)
+        self.public_key = public_key
+        self.allowed_ips = tuple(allowed_ips)
+        self.mtime = mtime
+        self.size = size
+
+    @property
+    def host(self) -> str:
+        """Return the endpoint host without port or IPv6 brackets."""
+        if self.endpoint.startswith("["):
+            return self.endpoint[1:].split("]", 1)[0]
+        return self.endpoint.rsplit(":", 1)[0]
+
+    def to_dict(self) -> dict:
+        return {k: getattr(self, k) for k in self.__slots__ if k not in ("path", "name")}
+
+    @classmethod
+    def from_dict(cls, path: str, data: dict) -> "Server":
+        return cls(path, **data)
+
+    def __repr__(self) -> str:
+        return f"Server({self.name!r})"
+
+
+def parse_name_tags(name: str) -> tuple[str, bool, bool]:
+    """Return ``(country, p2p, secure_core)`` guessed from a config name.
+
+    Understands ``wgp<cc>...`` interface-style names as well as Proton's
+    download names such as ``US-NY-12``, ``CH-US-1`` (SecureCore via
+    Switzerland) and ``NL-FREE-P2P-3``.
+    """
+    tokens = [t.lower() for t in re.split(r"[^A-Za-z0-9]+", name) if t]
+    tokens = [t for t in tokens if t not in _NAME_PREFIXES]
+    if tokens:
+        m = re.fullmatch(r"wgp([a-z]{2})[0-9a-z]*", tokens[0])
+        if m:
+            tokens[0] = m.group(1)
+
+    countries = []
+    for tok in tokens:
+        if len(tok) == 2 and tok.isalpha():
+            countries.append(tok)
+        else:
+            break
+
+    # SecureCore names lead with the entry country: CH-US, IS-DE, SE-FR ...
+    secure_core = len(countries) >= 2 and countries[0] in _SC_ENTRY_COUNTRIES
+    secure_core = secure_core or "sc" in tokens or "securecore" in tokens
+    exit_idx = 1 if secure_core and len(countries) >= 2 else 0
+    country = countries[exit_idx].upper() if countries else ""
+    p2p = "p2p" in tokens
+    return country, p2p, secure_core
+
+
+def _parse(text: str) -> tuple[dict, list[dict], bool]:
+    """Split a .conf into ``(interface, peers, natpmp_flag)``.
+
+    Keys are lower-cased; list-valued keys are split on commas. ``Address``
+    and ``DNS`` are also accepted when commented out, as is common for
+    configs fed straight to ``wg setconf``.
+    """
+    interface: dict = {}
+    peers: list[dict] = []
+    section = None
+    natpmp = False
+    for raw in text.splitlines():
+        line = raw.strip()
+        if not line:
+            continue
+        if re.match(r"#\s*NAT-PMP.*=\s*on", line, re.IGNORECASE):
+            natpmp = True
+            continue
+        if line.startswith("["):
+            name = line.strip("[]").strip().lower()
+            if name == "peer":
+                peers.append({})
+                section = peers[-1]
+            else:
+                section = interface
+            continue
+        m = re.match(r"#?\s*([A-Za-z]+)\s*=\s*(.+)", line)
+        if not m or section is None:
+            continue
+        key, value = m.group(1).lower(), m.group(2).strip()
+        if line.startswith("#") and key not in ("address", "dns"):
+            continue
+        if key in _LIST_KEYS:
+            section.setdefault(key, []).extend(v.strip() for v in value.split(",") if v.strip())
+        else:
+            section[key] = value
+    return interface, peers, natpmp
+
+
+def parse_file(path: str) -> Server:
+    """Parse ``path`` into a :class:`Server` record."""
+    st = os.stat(path)
+    with open(path, "r") as f:
+        interface, peers, natpmp = _parse(f.read())
+    peer = peers[0] if peers else {}
+    country, p2p, secure_core = parse_name_tags(os.path.splitext(os.path.basename(path))[0])
+    return Server(
+        path,
+        endpoint=peer.get("endpoint", ""),
+        country=country,
+        p2p=p2p or natpmp,
+        secure_core=secure_core,
+        addresses=interface.get("address", []),
+        dns=interface.get("dns", []),
+        public_key=peer.get("publickey", ""),
+        allowed_ips=peer.get("allowedips", []),
+        mtime=st.st_mtime_ns,
+        size=st.st_size,
+    )
+
+
+def with_ipv6(allowed_ips) -> list[str]:
+    """Return ``allowed_ips`` with ``::/0`` appended if missing."""
+    ips = list(allowed_ips)
+    if "::/0" not in ips:
+        ips.append("::/0")
+    return ips
+
+
+def read_wg(path: str) -> tuple[dict, list[dict]]:
+    """Return the parsed ``(interface, peers)`` sections of ``path``.
+
+    Keys are lower-cased; every peer's AllowedIPs includes ``::/0`` so IPv6
+    is routed through the tunnel instead of leaking.
+    """
+    with open(path, "r") as f:
+        interface, peers, _ = _parse(f.read())
+    for peer in peers:
+        peer["allowedips"] = with_ipv6(peer.get("allowedips", []))
+    return interface, peers
+
+
+def wg_config(path: str) -> str:
+    """Render the ``wg setconf`` subset of ``path`` (wg-quick keys dropped).
+
+    ``::/0`` is added to every peer's AllowedIPs (see :func:`read_wg`); the
+    source file is left untouched.
+    """
+    interface, peers = read_wg(path)
+    lines = ["[Interface]"]
+    for key, out in _WG_INTERFACE_KEYS.items():
+        if key in interface:
+            lines.append(f"{out} = {interface[key]}")
+    for peer in peers:
+        lines.append("[Peer]")
+        for key, out in _WG_PEER_KEYS.items():
+            if key == "allowedips":
+                lines.append(f"{out} = {', '.join(peer[key])}")
+            elif key in peer:
+                lines.append(f"{out} = {peer[key]}")
+    return "\n".join(lines) + "\n"
+
+
+def _read_index(index_path: str) -> dict:
+    try:
+        with open(index_path) as f:
+            data = json.load(f)
+        if data.get("version") == CATALOG_VERSION:
+            return data.get("entries", {})
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logging.debug(f"Ignoring unreadable catalog index {index_path}: {e}")
+    return {}
+
+
+def _write_index(index_path: str, entries: dict):
+    try:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(index_path) or ".", prefix=".catalog.")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"version": CATALOG_VERSION, "entries": entries}, f, separators=(",", ":"))
+        os.replace(tmp, index_path)
+    except Exception as e:
+        logging.warning(f"Cannot write catalog index {index_path}: {e}")
+
+
+def load_catalog(wg_path: str, index_path: str | None = None) -> list[Server]:
+    """Return a :class:`Server` for every ``.conf`` in ``wg_path`` (sorted by name).
+
+    Entries are reused from ``index_path`` when the file's path, mtime and
+    size are unchanged; new or modified files are re-parsed and the index
+    is rewritten only if anything changed.
+    """
+    cached = _read_index(index_path) if index_path else {}
+    entries: dict = {}
+    servers: list[Server] = []
+    changed = False
+    with os.scandir(wg_path) as it:
+        files = sorted((e for e in it if e.name.endswith(".conf") and e.is_file()), key=lambda e: e.name)
+    for entry in files:
+        st = entry.stat()
+        hit = cached.get(entry.path)
+        if hit and hit.get("mtime") == st.st_mtime_ns and hit.get("size") == st.st_size:
+            server = Server.from_dict(entry.path, hit)
+        else:
+            try:
+                server = parse_file(entry.path)
+            except Exception as e:
+                logging.warning(f"Failed to read {entry.path}: {e}")
+                continue
+            changed = True
+        entries[entry.path] = server.to_dict()
+        servers.append(server)
+    if index_path and (changed or len(entries) != len(cached)):
+        _write_index(index_path, entries)
+    return servers
+
+
+def find(servers: list[Server], name: str) -> Server | None:
+    """Return the server called ``name`` (config stem) or ``None``."""
+    return next((s for s in servers if s.name == name), None)
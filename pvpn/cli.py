@@ -2,17 +2,20 @@
 # pvpn/cli.py
 
 import argparse
+import json
 import sys
 import shutil
 import logging
 from pvpn.config import Config
-from pvpn import protonvpn
+from pvpn import protonvpn, daemon
 
 
 def check_dependencies():
     """Warn if required system tools are missing."""
-    required = ["wg", "ip", "iptables", "natpmpc", "ping", "curl"]
+    required = ["wg", "ip", "ping", "curl"]
     missing = [tool for tool in required if shutil.which(tool) is None]
+    if not (shutil.which("nft") or shutil.which("iptables")):
+        missing.append("nft (or iptables)")
     if missing:
         print(f"Warning: Missing system tools: {', '.join(missing)}. Some features may not work.")
 
@@ -41,6 +44,9 @@ def build_parser() -> argparse.ArgumentParser:
     conn = sub.add_parser("connect", aliases=["c"], help="Establish VPN connection")
     conn.set_defaults(cmd="connect")
     conn.add_argument("--config", help="Path to WireGuard .conf file")
+    conn.add_argument("--cc", help="Two-letter country code filter")
+    conn.add_argument("--sc", action="store_true", help="SecureCore servers only")
+    conn.add_argument("--p2p", action="store_true", help="P2P (port-forwarding) servers only")
     conn.add_argument("--dns", choices=["true", "false"], default=None, help="Switch DNS (true|false)")
     conn.add_argument("--ks", choices=["true", "false"], default=None, help="Enable kill-switch (true|false)")
 
@@ -52,10 +58,46 @@ def build_parser() -> argparse.ArgumentParser:
     # status
     stat = sub.add_parser("status", aliases=["s"], help="Show VPN & qBittorrent status")
     stat.set_defaults(cmd="status")
+    stat.add_argument("--live", action="store_true", help="Probe components instead of reading cached state")
+    stat.add_argument("--json", action="store_true", help="Print machine-readable JSON")
+
+    # list
+    lst = sub.add_parser("list", aliases=["l"], help="List available WireGuard servers")
+    lst.set_defaults(cmd="list")
+    lst.add_argument("--cc", help="Two-letter country code filter")
+    lst.add_argument("--sc", action="store_true", help="SecureCore servers only")
+    lst.add_argument("--p2p", action="store_true", help="P2P (port-forwarding) servers only")
+    lst.add_argument("--fastest", action="store_true", help="Probe all servers and sort by latency")
+
+    # daemon
+    dmn = sub.add_parser("daemon", help="Run resident service with a control socket")
+    dmn.set_defaults(cmd="daemon")
+    dmn.add_argument("--no-connect", action="store_true", help="Start idle instead of connecting")
+
+    # switch
+    sw = sub.add_parser("switch", help="Move to another server now (hot standby if ready; needs daemon)")
+    sw.set_defaults(cmd="switch")
+
+    # events
+    ev = sub.add_parser("events", help="Stream connection, port and health events (needs daemon)")
+    ev.set_defaults(cmd="events")
+    ev.add_argument("--replay", type=int, default=0, metavar="N", help="Replay the last N events first")
+    ev.add_argument("--type", action="append", dest="types", metavar="TYPE", help="Only this event type (repeatable)")
 
     return p
 
 
+def _via_daemon(cmd: str, timeout: float = daemon.CLIENT_TIMEOUT, **kwargs):
+    """Forward ``cmd`` to a running daemon; ``None`` if none is listening."""
+    try:
+        return {"result": daemon.request(cmd, timeout=timeout, **kwargs)}
+    except daemon.DaemonUnavailable:
+        return None
+    except daemon.DaemonError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
 def main() -> None:
     check_dependencies()
     parser = build_parser()
@@ -70,11 +112,45 @@ def main() -> None:
     if cmd == "init":
         cfg.interactive_setup(proton=args.proton, qb=args.qb, network=args.network)
     elif cmd == "connect":
-        protonvpn.connect(cfg, args)
+        reply = _via_daemon(
+            "connect", timeout=daemon.CONNECT_TIMEOUT, config=args.config, cc=args.cc,
+            sc=args.sc, p2p=args.p2p, dns=args.dns, ks=args.ks,
+        )
+        if reply is None:
+            protonvpn.connect(cfg, args)
+        else:
+            print(protonvpn.connected_message(reply["result"]))
     elif cmd == "disconnect":
-        protonvpn.disconnect(cfg, args)
+        reply = _via_daemon("disconnect", timeout=daemon.CONNECT_TIMEOUT, ks=args.ks)
+        if reply is None:
+            protonvpn.disconnect(cfg, args)
+        else:
+            print("✅ Disconnected")
     elif cmd == "status":
-        protonvpn.status(cfg)
+        reply = _via_daemon("status", live=args.live)
+        if reply is None:
+            protonvpn.status(cfg, live=args.live, as_json=args.json)
+        else:
+            protonvpn.show_status(reply["result"], as_json=args.json)
+    elif cmd == "switch":
+        reply = _via_daemon("switch", timeout=daemon.CONNECT_TIMEOUT)
+        if reply is None:
+            print("Error: pvpn switch needs a running pvpn daemon", file=sys.stderr)
+            sys.exit(1)
+        print(protonvpn.connected_message(reply["result"]))
+    elif cmd == "daemon":
+        daemon.serve(cfg, connect=not args.no_connect)
+    elif cmd == "events":
+        try:
+            for event in daemon.subscribe(args.replay, args.types):
+                print(json.dumps(event, sort_keys=True), flush=True)
+        except daemon.DaemonUnavailable as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        except KeyboardInterrupt:
+            pass
+    elif cmd == "list":
+        protonvpn.list_servers(cfg, args)
     else:
         parser.print_help()
         sys.exit(1)
@@ -9,6 +9,12 @@ import hashlib
 from urllib.parse import urlparse
 from pathlib import Path
 
+
+def _split_list(value: str) -> list[str]:
+    """Split a comma-separated ini value into its non-empty entries."""
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
 class Config:
     """
     Manages loading, saving, and interactive setup of pvpn configuration.
@@ -39,15 +45,32 @@ class Config:
         self.qb_user = "pipi"
         self.qb_pass = ""
         self.qb_port = 6881
+        self.qb_pause_on_rotate = False
 
         self.network_ks_default = False
         self.network_dns_default = True
         self.network_threshold_default = 60
+        # Kill-switch exceptions: LAN CIDRs, optionally limited to ports/services
+        self.network_allow_lan: list[str] = []
+        self.network_allow_ports: list[str] = []
+        # Route only qbittorrent-nox through the tunnel (by its cgroup, or by
+        # split_user if set)
+        self.network_split_tunnel = False
+        self.network_split_user = ""
 
         # Monitoring defaults
         self.monitor_interval = 60
         self.monitor_failures = 3
         self.monitor_latency_threshold = 500
+        self.monitor_loss_threshold = 0.2
+        self.monitor_window = 20
+        self.monitor_min_interval = 10
+        self.monitor_max_interval = 300
+        self.monitor_standby = False
+
+        # NAT-PMP lease defaults
+        self.natpmp_lifetime = 60
+        self.natpmp_refresh_fraction = 0.5
 
         # Load existing config if available
 
@@ -85,6 +108,7 @@ class Config:
                     cfg.qb_user = sec.get('user', cfg.qb_user)
                     cfg.qb_pass = sec.get('pass', cfg.qb_pass)
                     cfg.qb_port = sec.getint('port', cfg.qb_port)
+                    cfg.qb_pause_on_rotate = sec.getboolean('pause_on_rotate', cfg.qb_pause_on_rotate)
 
                 # Network defaults
                 if 'network' in cfg.parser:
@@ -92,12 +116,26 @@ class Config:
                     cfg.network_ks_default = sec.getboolean('ks_default', cfg.network_ks_default)
                     cfg.network_dns_default = sec.getboolean('dns_default', cfg.network_dns_default)
                     cfg.network_threshold_default = sec.getint('threshold_default', cfg.network_threshold_default)
+                    cfg.network_allow_lan = _split_list(sec.get('allow_lan', ''))
+                    cfg.network_allow_ports = _split_list(sec.get('allow_ports', ''))
+                    cfg.network_split_tunnel = sec.getboolean('split_tunnel', cfg.network_split_tunnel)
+                    cfg.network_split_user = sec.get('split_user', cfg.network_split_user)
                 # Monitor defaults
                 if 'monitor' in cfg.parser:
                     sec = cfg.parser['monitor']
                     cfg.monitor_interval = sec.getint('interval', cfg.monitor_interval)
                     cfg.monitor_failures = sec.getint('failures', cfg.monitor_failures)
                     cfg.monitor_latency_threshold = sec.getint('latency_threshold', cfg.monitor_latency_threshold)
+                    cfg.monitor_loss_threshold = sec.getfloat('loss_threshold', cfg.monitor_loss_threshold)
+                    cfg.monitor_window = sec.getint('window', cfg.monitor_window)
+                    cfg.monitor_min_interval = sec.getint('min_interval', cfg.monitor_min_interval)
+                    cfg.monitor_max_interval = sec.getint('max_interval', cfg.monitor_max_interval)
+                    cfg.monitor_standby = sec.getboolean('standby', cfg.monitor_standby)
+                # NAT-PMP lease settings
+                if 'natpmp' in cfg.parser:
+                    sec = cfg.parser['natpmp']
+                    cfg.natpmp_lifetime = sec.getint('lifetime', cfg.natpmp_lifetime)
+                    cfg.natpmp_refresh_fraction = sec.getfloat('refresh_fraction', cfg.natpmp_refresh_fraction)
             except Exception as e:
                 logging.warning(f"Could not load existing config: {e}")
         # Environment variable overrides for sensitive values
@@ -131,19 +169,34 @@ class Config:
             'url': self.qb_url,
             'user': self.qb_user,
             'pass': self.qb_pass if 'PVPN_QB_PASS' not in os.environ else '',
-            'port': str(self.qb_port)
+            'port': str(self.qb_port),
+            'pause_on_rotate': str(self.qb_pause_on_rotate)
         }
 
         self.parser['network'] = {
             'ks_default': str(self.network_ks_default),
             'dns_default': str(self.network_dns_default),
-            'threshold_default': str(self.network_threshold_default)
+            'threshold_default': str(self.network_threshold_default),
+            'allow_lan': ', '.join(self.network_allow_lan),
+            'allow_ports': ', '.join(self.network_allow_ports),
+            'split_tunnel': str(self.network_split_tunnel),
+            'split_user': self.network_split_user
         }
 
         self.parser['monitor'] = {
             'interval': str(self.monitor_interval),
             'failures': str(self.monitor_failures),
-            'latency_threshold': str(self.monitor_latency_threshold)
+            'latency_threshold': str(self.monitor_latency_threshold),
+            'loss_threshold': str(self.monitor_loss_threshold),
+            'window': str(self.monitor_window),
+            'min_interval': str(self.monitor_min_interval),
+            'max_interval': str(self.monitor_max_interval),
+            'standby': str(self.monitor_standby)
+        }
+
+        self.parser['natpmp'] = {
+            'lifetime': str(self.natpmp_lifetime),
+            'refresh_fraction': str(self.natpmp_refresh_fraction)
         }
 
         # Write file
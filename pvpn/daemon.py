@@ -0,0 +1,275 @@
+# pvpn/daemon.py
+
+"""
+Resident pvpn process and its Unix-socket control API:
+- serve: run the daemon (optionally connecting first) until SIGTERM/SIGINT
+- request: send one command to a running daemon and return its result
+- subscribe: stream events (pvpn.events) from a running daemon
+
+The daemon owns the tunnel, NAT-PMP forwarder, monitor and qBittorrent
+state, so CLI invocations become thin clients answered from memory. The
+protocol is one JSON object per line in each direction::
+
+    -> {"cmd": "status", "args": {"live": false}}
+    <- {"ok": true, "result": {...}}
+    <- {"ok": false, "error": "..."}
+
+``subscribe`` (args ``replay``, ``types``) is acknowledged like any other
+command, after which the daemon writes one event per line until the
+client disconnects.
+
+Read-only commands are open to any local user; commands that change the
+tunnel require the peer to be root (checked with ``SO_PEERCRED``).
+"""
+
+from __future__ import annotations
+
+import os
+import json
+import time
+import signal
+import socket
+import struct
+import asyncio
+import logging
+import functools
+import threading
+from types import SimpleNamespace
+
+from pvpn import state
+from pvpn.config import Config
+
+SOCKET_FILE = "pvpn.sock"
+# Seconds a client waits for a reply (connect may probe servers first)
+CLIENT_TIMEOUT = 5
+CONNECT_TIMEOUT = 120
+# Longest accepted request line
+MAX_REQUEST = 64 * 1024
+READ_ONLY = ("ping", "status", "subscribe")
+
+
+class DaemonUnavailable(OSError):
+    """No daemon is listening on the control socket."""
+
+
+class DaemonError(RuntimeError):
+    """The daemon received the request but could not carry it out."""
+
+
+def socket_path() -> str:
+    return os.path.join(state.STATE_DIR, SOCKET_FILE)
+
+
+def _peer_uid(sock: socket.socket) -> int:
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    return struct.unpack("3i", creds)[1]
+
+
+class Daemon:
+    """In-memory owner of the connection; one command runs at a time."""
+
+    def __init__(self, cfg: Config):
+        self.cfg = cfg
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def handle(self, cmd: str, args: dict):
+        handler = getattr(self, f"cmd_{cmd}", None)
+        if handler is None:
+            raise DaemonError(f"unknown command {cmd!r}")
+        if cmd in READ_ONLY:
+            return handler(**args)
+        with self._lock:
+            return handler(**args)
+
+    def cmd_ping(self) -> dict:
+        return {"pid": os.getpid(), "uptime": time.time() - self.started}
+
+    def cmd_status(self, live: bool = False) -> dict:
+        from pvpn import protonvpn
+
+        return protonvpn._live_status(self.cfg) if live else protonvpn._cached_status()
+
+    def cmd_connect(self, config=None, cc=None, sc=False, p2p=False, dns=None, ks=None) -> dict:
+        from pvpn import protonvpn
+
+        if state.read_state().get("interface"):
+            protonvpn.disconnect(self.cfg, SimpleNamespace(ks=None, reason="user"))
+        args = SimpleNamespace(config=config, cc=cc, sc=sc, p2p=p2p, dns=dns, ks=ks)
+        protonvpn.connect(self.cfg, args, wait=False)
+        return state.read_state()
+
+    def cmd_switch(self) -> dict:
+        from pvpn import protonvpn
+
+        return protonvpn.switch(self.cfg, SimpleNamespace(reason="user"))
+
+    def cmd_disconnect(self, ks=None) -> dict:
+        from pvpn import protonvpn
+
+        protonvpn.disconnect(self.cfg, SimpleNamespace(ks=ks, reason="user"))
+        return {}
+
+
+async def _client(daemon: Daemon, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Serve one control connection on the supervisor loop."""
+    try:
+        while line := await reader.readline():
+            try:
+                req = json.loads(line)
+                cmd = req["cmd"]
+                args = req.get("args") or {}
+                if cmd not in READ_ONLY and _peer_uid(writer.get_extra_info("socket")) != 0:
+                    raise DaemonError(f"{cmd} requires root")
+                if cmd == "subscribe":
+                    await _stream(reader, writer, **args)
+                    return
+                reply = {"ok": True, "result": await asyncio.to_thread(daemon.handle, cmd, args)}
+            except SystemExit:
+                reply = {"ok": False, "error": "command failed; see daemon log"}
+            except Exception as e:
+                logging.debug(f"daemon: request failed: {e}")
+                reply = {"ok": False, "error": str(e) or type(e).__name__}
+            writer.write(json.dumps(reply, default=str).encode() + b"\n")
+            await writer.drain()
+    except (OSError, ValueError) as e:
+        logging.debug(f"daemon: client dropped: {e}")
+    finally:
+        writer.close()
+
+
+async def _stream(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, replay: int = 0, types=None):
+    """Write events to ``writer`` until the client hangs up or falls behind."""
+    from pvpn import events
+
+    loop = asyncio.get_running_loop()
+    wake = asyncio.Event()
+    sub = events.subscribe(int(replay), types, notify=lambda: loop.call_soon_threadsafe(wake.set))
+    hangup = asyncio.ensure_future(reader.read(1))
+    try:
+        writer.write(b'{"ok": true, "result": null}\n')
+        while not sub.closed and not hangup.done():
+            wake.clear()
+            while (event := sub.get(0)) is not None:
+                writer.write(json.dumps(event, default=str).encode() + b"\n")
+            await writer.drain()
+            waiter = asyncio.ensure_future(wake.wait())
+            await asyncio.wait([hangup, waiter], return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+    finally:
+        hangup.cancel()
+        events.unsubscribe(sub)
+
+
+class ControlServer:
+    """The listening control socket, served by the supervisor loop."""
+
+    def __init__(self, server: asyncio.AbstractServer, supervisor, path: str):
+        self.server = server
+        self.supervisor = supervisor
+        self.path = path
+
+    def close(self):
+        self.supervisor.call(self.server.close)
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+def start_server(daemon: Daemon, path: str | None = None) -> ControlServer:
+    """Bind the control socket and serve it from the supervisor loop."""
+    from pvpn.supervisor import get_supervisor
+
+    path = path or socket_path()
+    os.makedirs(os.path.dirname(path), mode=0o755, exist_ok=True)
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    supervisor = get_supervisor()
+    server = supervisor.run(asyncio.start_unix_server(
+        functools.partial(_client, daemon), path=path, limit=MAX_REQUEST
+    ))
+    os.chmod(path, 0o666)
+    logging.info(f"Control socket listening on {path}")
+    return ControlServer(server, supervisor, path)
+
+
+def serve(cfg: Config, connect: bool = True):
+    """Run the daemon in the foreground until SIGTERM or SIGINT.
+
+    With ``connect`` the best server is brought up first, as the
+    ``pvpn connect`` service used to do; the tunnel is torn down on exit.
+    """
+    daemon = Daemon(cfg)
+    stop = threading.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: stop.set())
+
+    server = start_server(daemon)
+    try:
+        if connect:
+            try:
+                daemon.handle("connect", {})
+            except (Exception, SystemExit) as e:
+                logging.error(f"daemon: initial connect failed: {e}")
+        stop.wait()
+    finally:
+        server.close()
+        if state.read_state().get("interface"):
+            daemon.handle("disconnect", {})
+        server.supervisor.shutdown()
+
+
+def request(cmd: str, timeout: float = CLIENT_TIMEOUT, **args):
+    """Send ``cmd`` to the running daemon and return its result.
+
+    Raises :class:`DaemonUnavailable` if no daemon is listening and
+    :class:`DaemonError` if it reports a failure or does not answer
+    within ``timeout`` seconds.
+    """
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(socket_path())
+    except OSError as e:
+        raise DaemonUnavailable(e.errno, f"pvpn daemon not reachable: {e.strerror or e}") from None
+    with sock:
+        try:
+            sock.sendall(json.dumps({"cmd": cmd, "args": args}).encode() + b"\n")
+            with sock.makefile("rb") as f:
+                line = f.readline()
+        except TimeoutError:
+            raise DaemonError(f"no reply to {cmd!r} within {timeout}s; the daemon may still be working") from None
+        except OSError as e:
+            raise DaemonError(f"daemon connection failed: {e}") from None
+    if not line:
+        raise DaemonError("daemon closed the connection")
+    reply = json.loads(line)
+    if not reply.get("ok"):
+        raise DaemonError(reply.get("error", "unknown error"))
+    return reply.get("result")
+
+
+def subscribe(replay: int = 0, types=None, timeout: float = CLIENT_TIMEOUT):
+    """Yield events from the running daemon until the connection closes.
+
+    Raises :class:`DaemonUnavailable` if no daemon is listening.
+    """
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(socket_path())
+    except OSError as e:
+        raise DaemonUnavailable(e.errno, f"pvpn daemon not reachable: {e.strerror or e}") from None
+    with sock:
+        args = {"replay": replay, "types": list(types) if types else None}
+        sock.sendall(json.dumps({"cmd": "subscribe", "args": args}).encode() + b"\n")
+        with sock.makefile("rb") as f:
+            reply = json.loads(f.readline() or b"{}")
+            if not reply.get("ok"):
+                raise DaemonError(reply.get("error", "daemon closed the connection"))
+            sock.settimeout(None)
+            for line in f:
+                yield json.loads(line)
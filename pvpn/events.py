@@ -0,0 +1,124 @@
+# pvpn/events.py
+
+"""
+In-process event bus for connection, port and health changes:
+- emit: publish a typed event to every subscriber
+- subscribe / unsubscribe: receive events (optionally replaying recent ones)
+
+The daemon streams these to ``pvpn events`` and other clients over its
+control socket, so consumers react to changes instead of polling status.
+Every event is a flat dict with ``type``, ``seq`` (monotonic per process)
+and ``at`` (UNIX time) plus type-specific fields.
+"""
+
+from __future__ import annotations
+
+import time
+import queue
+import logging
+import threading
+from collections import deque
+
+TUNNEL_UP = "tunnel_up"                # interface, server, endpoint
+TUNNEL_DOWN = "tunnel_down"            # interface, reason
+HANDSHAKE_STALE = "handshake_stale"    # interface, handshake
+PORT_MAPPED = "port_mapped"            # port, expires (UNIX time)
+PORT_CHANGED = "port_changed"          # old, port
+PORT_LOST = "port_lost"                # old
+KILLSWITCH = "killswitch"              # enabled, interface
+SERVER_ROTATED = "server_rotated"      # old, new, reason, mode (swap/standby; absent on reconnect)
+QB_PORT_APPLIED = "qb_port_applied"    # port
+EVENT_TYPES = (
+    TUNNEL_UP, TUNNEL_DOWN, HANDSHAKE_STALE, PORT_MAPPED, PORT_CHANGED,
+    PORT_LOST, KILLSWITCH, SERVER_ROTATED, QB_PORT_APPLIED,
+)
+
+# Recent events kept for replay to new subscribers
+REPLAY_SIZE = 100
+# Undelivered events buffered per subscriber before it is dropped
+SUBSCRIBER_QUEUE = 256
+
+
+class Subscription:
+    """A subscriber's queue; ``closed`` is set if it fell too far behind.
+
+    ``notify`` (if given) is called from the emitting thread after every
+    delivery and on close, e.g. to wake an asyncio consumer.
+    """
+
+    def __init__(self, types=None, notify=None):
+        self.types = set(types) if types else None
+        self.queue: queue.Queue = queue.Queue(SUBSCRIBER_QUEUE)
+        self.notify = notify
+        self.closed = False
+
+    def get(self, timeout: float | None = None) -> dict | None:
+        """Return the next event, or ``None`` on timeout."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventBus:
+    """Fan events out to subscriber queues and keep a replay buffer."""
+
+    def __init__(self, replay_size: int = REPLAY_SIZE):
+        self._recent: deque = deque(maxlen=replay_size)
+        self._subs: list[Subscription] = []
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def emit(self, kind: str, **data) -> dict:
+        with self._lock:
+            self._seq += 1
+            event = {"type": kind, "seq": self._seq, "at": time.time(), **data}
+            self._recent.append(event)
+            for sub in list(self._subs):
+                if sub.types and kind not in sub.types:
+                    continue
+                try:
+                    sub.queue.put_nowait(event)
+                except queue.Full:
+                    logging.warning("events: dropping subscriber that stopped reading")
+                    sub.closed = True
+                    self._subs.remove(sub)
+                if sub.notify:
+                    sub.notify()
+        logging.debug(f"event {kind}: {data}")
+        return event
+
+    def subscribe(self, replay: int = 0, types=None, notify=None) -> Subscription:
+        """Return a new :class:`Subscription`, primed with up to ``replay`` past events."""
+        sub = Subscription(types, notify)
+        with self._lock:
+            past = [e for e in self._recent if not sub.types or e["type"] in sub.types]
+            for event in past[-replay:] if replay > 0 else ():
+                sub.queue.put_nowait(event)
+            self._subs.append(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            if sub in self._subs:
+                self._subs.remove(sub)
+
+    def recent(self) -> list[dict]:
+        with self._lock:
+            return list(self._recent)
+
+
+bus = EventBus()
+
+
+def emit(kind: str, **data) -> dict:
+    """Publish an event on the process-wide bus."""
+    return bus.emit(kind, **data)
+
+
+def subscribe(replay: int = 0, types=None, notify=None) -> Subscription:
+    return bus.subscribe(replay, types, notify)
+
+
+def unsubscribe(sub: Subscription):
+    bus.unsubscribe(sub)
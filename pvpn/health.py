@@ -0,0 +1,216 @@
+# pvpn/health.py
+
+"""
+Passive tunnel health from the counters WireGuard already keeps:
+- read_counters: latest handshake and rx/tx byte totals of an interface
+- HealthTracker: classify successive samples as healthy, idle or stalled
+- probe: one active ping through the tunnel, for when the counters
+  cannot tell (idle) or look wrong (stalled)
+- RttWindow: sliding window of probe results (RTT percentiles, jitter, loss)
+- Cadence: probe interval that stretches while healthy, tightens on trouble
+
+Received bytes only grow when the peer sends authenticated packets, and a
+WireGuard peer that receives data always answers within KEEPALIVE_TIMEOUT
+(a keepalive if it has nothing else to send). So rx advancing proves the
+tunnel works, and tx advancing without rx for longer than that (or past
+an expired session) means it is dead, without sending any probe traffic.
+"""
+
+from __future__ import annotations
+
+import time
+import logging
+import subprocess
+from collections import deque
+from typing import NamedTuple
+
+HEALTHY = "healthy"   # rx advanced since the last sample
+IDLE = "idle"         # no traffic either way; counters say nothing
+STALLED = "stalled"   # sending but nothing received back
+
+# WireGuard protocol timers (seconds, from the whitepaper)
+KEEPALIVE_TIMEOUT = 10
+REKEY_AFTER_TIME = 120
+REJECT_AFTER_TIME = 180
+# A session older than this is expired; a new handshake is overdue
+HANDSHAKE_TIMEOUT = REJECT_AFTER_TIME
+# Seconds of tx without rx before the tunnel counts as stalled
+STALL_AFTER = KEEPALIVE_TIMEOUT + 5
+# Seconds between counter reads; cheap, so much shorter than the probe interval
+CHECK_INTERVAL = 10
+# Probe results needed before judging a window (capped at its size)
+MIN_SAMPLES = 10
+# Factor the probe interval grows by after each good probe
+RELAX_FACTOR = 1.5
+
+
+class Counters(NamedTuple):
+    """One reading of an interface's peer counters."""
+    at: float          # time.monotonic() of the reading
+    handshake: int     # UNIX time of the latest handshake (0 if none)
+    rx: int
+    tx: int
+
+
+def read_counters(iface: str) -> Counters | None:
+    """Return summed counters for the peers on ``iface``, or ``None`` if it has none."""
+    from pvpn.wireguard import get_peers
+
+    peers = get_peers(iface)
+    if not peers:
+        return None
+    return Counters(
+        time.monotonic(),
+        max(p["last_handshake"] for p in peers),
+        sum(p["rx_bytes"] for p in peers),
+        sum(p["tx_bytes"] for p in peers),
+    )
+
+
+def handshake_fresh(handshake: int, now: float | None = None) -> bool:
+    now = time.time() if now is None else now
+    return bool(handshake) and now - handshake < HANDSHAKE_TIMEOUT
+
+
+class HealthTracker:
+    """Turn successive :class:`Counters` into a verdict for one tunnel."""
+
+    def __init__(self, stall_after: float = STALL_AFTER):
+        self.stall_after = stall_after
+        self.last: Counters | None = None
+        self._tx_since: float | None = None
+        self.verdict = IDLE
+
+    def update(self, sample: Counters, now: float | None = None) -> str:
+        """Record ``sample`` and return :data:`HEALTHY`, :data:`IDLE` or :data:`STALLED`."""
+        prev, self.last = self.last, sample
+        if prev is None or sample.rx < prev.rx or sample.tx < prev.tx:
+            # First sample, or the peer was replaced and counters reset
+            self._tx_since = None
+            self.verdict = IDLE
+            return self.verdict
+        if sample.rx > prev.rx:
+            self._tx_since = None
+            self.verdict = HEALTHY
+        elif sample.tx > prev.tx:
+            if self._tx_since is None:
+                self._tx_since = prev.at
+            waited = sample.at - self._tx_since
+            if waited >= self.stall_after or not handshake_fresh(sample.handshake, now):
+                self.verdict = STALLED
+        else:
+            self._tx_since = None
+            self.verdict = IDLE
+        return self.verdict
+
+
+class RttWindow:
+    """The last ``size`` probe results of one tunnel; ``None`` marks a lost probe."""
+
+    def __init__(self, size: int):
+        self.samples: deque = deque(maxlen=size)
+
+    def add(self, rtt: float | None):
+        self.samples.append(rtt)
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def percentile(self, p: float) -> float | None:
+        """Return the ``p``-th percentile (0-100) of the answered probes.
+
+        Uses the lower nearest rank, so a single spike in a small window
+        does not set the 95th percentile on its own.
+        """
+        rtts = sorted(r for r in self.samples if r is not None)
+        if not rtts:
+            return None
+        return rtts[int(p / 100 * (len(rtts) - 1))]
+
+    def jitter(self) -> float | None:
+        """Mean absolute RTT difference between consecutive answered probes."""
+        rtts = [r for r in self.samples if r is not None]
+        if len(rtts) < 2:
+            return None
+        return sum(abs(b - a) for a, b in zip(rtts, rtts[1:])) / (len(rtts) - 1)
+
+    def loss(self) -> float | None:
+        if not self.samples:
+            return None
+        return sum(r is None for r in self.samples) / len(self.samples)
+
+    def stats(self) -> dict:
+        return {
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "jitter": self.jitter(),
+            "loss": self.loss(),
+            "samples": len(self.samples),
+        }
+
+    def degraded(self, p95_limit: float, loss_limit: float, min_samples: int = MIN_SAMPLES) -> str | None:
+        """Return ``"loss"`` or ``"latency"`` if the window breaks a limit, else ``None``."""
+        if len(self.samples) < min(min_samples, self.samples.maxlen):
+            return None
+        if self.loss() > loss_limit:
+            return "loss"
+        p95 = self.percentile(95)
+        if p95 is not None and p95 > p95_limit:
+            return "latency"
+        return None
+
+
+class Cadence:
+    """Adaptive probe interval between ``minimum`` and ``maximum`` seconds."""
+
+    def __init__(self, start: float, minimum: float, maximum: float, factor: float = RELAX_FACTOR):
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.factor = factor
+        self.interval = min(max(start, self.minimum), self.maximum)
+
+    def relax(self) -> float:
+        """Stretch the interval after a good probe."""
+        self.interval = min(self.interval * self.factor, self.maximum)
+        return self.interval
+
+    def tighten(self) -> float:
+        """Drop to the minimum interval after a bad probe or window."""
+        self.interval = self.minimum
+        return self.interval
+
+
+def _tunnel_gateway(iface: str) -> str | None:
+    """Return the in-tunnel gateway of ``iface`` (first IPv4 address, last octet .1)."""
+    try:
+        from pvpn import netlink
+
+        for cidr in netlink.route().addresses(iface):
+            if ":" not in cidr:
+                return f"{cidr.split('/')[0].rsplit('.', 1)[0]}.1"
+    except Exception as e:
+        logging.debug(f"netlink address lookup for {iface} failed: {e}")
+    try:
+        from pvpn.natpmp import _get_vpn_gateway
+
+        return _get_vpn_gateway(iface)
+    except Exception:
+        return None
+
+
+def probe(iface: str) -> float | None:
+    """Ping the gateway through ``iface`` once; return the RTT in ms or ``None``."""
+    gateway = _tunnel_gateway(iface)
+    if not gateway:
+        return None
+    try:
+        out = subprocess.check_output(
+            ["ping", "-c", "1", "-W", "2", "-I", iface, gateway],
+            stderr=subprocess.DEVNULL,
+            timeout=5,
+            text=True,
+        )
+        stats = next((line for line in out.splitlines() if "rtt min/avg" in line), "")
+        return float(stats.split("/")[4]) if stats else None
+    except Exception:  # noqa: BLE001
+        return None
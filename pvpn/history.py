@@ -0,0 +1,202 @@
+# pvpn/history.py
+
+"""
+Persistent per-server performance history:
+- record_*: fold connect time, RTT/loss, handshake and NAT-PMP outcomes
+  into exponentially weighted moving averages (EWMA)
+- score: lower-is-better ranking value used by server selection
+- penalty / record_stable: per-server circuit breaker; every failure puts a
+  server in a penalty box for an exponentially growing cooldown
+- reconnect_delay / record_reconnect: global reconnect rate limit
+- save: compact (evict stale/excess entries) and atomically rewrite the store
+
+The store is a single small JSON file under ``Config.config_dir`` holding
+only aggregated values, so it never grows with the number of samples.
+Penalties and recent reconnect times live in the same file and therefore
+survive restarts of pvpn.
+"""
+
+from __future__ import annotations
+
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+
+HISTORY_FILE = "history.json"
+# Weight of the newest sample in every moving average
+EWMA_ALPHA = 0.3
+# Scores older than this (seconds) are ignored and the server is re-probed
+SCORE_TTL = 6 * 3600
+# Compaction limits
+MAX_SERVERS = 500
+MAX_AGE = 30 * 24 * 3600
+# Disconnect reasons that count against a server
+FAILURE_REASONS = ("latency", "loss", "unreachable", "handshake", "natpmp")
+# Penalty box: cooldown after the first failure, doubling per further strike
+PENALTY_BASE = 60
+PENALTY_MAX = 3600
+# Seconds a server must stay healthy before its strikes are forgiven
+STABLE_AFTER = 600
+# At most RECONNECT_BURST reconnects in any RECONNECT_WINDOW seconds
+RECONNECT_BURST = 3
+RECONNECT_WINDOW = 300
+
+_instances: dict[str, "History"] = {}
+_instances_lock = threading.Lock()
+
+
+def _ewma(old: float | None, sample: float) -> float:
+    return sample if old is None else EWMA_ALPHA * sample + (1 - EWMA_ALPHA) * old
+
+
+class History:
+    """EWMA-aggregated server statistics backed by a JSON file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.servers: dict[str, dict] = {}
+        self.reconnects: list[float] = []
+        self._lock = threading.Lock()
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                self.servers = data.get("servers", {})
+                self.reconnects = data.get("reconnects", [])
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable history {path}: {e}")
+
+    def _update(self, name: str, **samples):
+        with self._lock:
+            entry = self.servers.setdefault(name, {})
+            for key, value in samples.items():
+                entry[key] = _ewma(entry.get(key), float(value))
+            entry["updated"] = time.time()
+            if "rtt" in samples:
+                # Only an RTT sample makes the score fresh again
+                entry["rtt_at"] = entry["updated"]
+            return entry
+
+    def record_connect(self, name: str, seconds: float):
+        """Record how long bringing up ``name`` took."""
+        self._update(name, connect_time=seconds)
+
+    def record_rtt(self, name: str, rtt: float | None):
+        """Record one RTT sample in ms (``None`` counts as a lost probe)."""
+        if rtt is None:
+            self._update(name, loss=1.0)
+        else:
+            self._update(name, rtt=rtt, loss=0.0)
+
+    def record_probe(self, name: str, rtt: float | None, loss: float):
+        """Record an aggregated probe result (median RTT and loss ratio)."""
+        if rtt is None:
+            self._update(name, loss=loss)
+        else:
+            self._update(name, rtt=rtt, loss=loss)
+
+    def record_handshake(self, name: str, ok: bool):
+        self._update(name, handshake=1.0 if ok else 0.0)
+
+    def record_natpmp(self, name: str, ok: bool):
+        self._update(name, natpmp=1.0 if ok else 0.0)
+
+    def record_disconnect(self, name: str, reason: str):
+        """Record why ``name`` was left; failure reasons raise its penalty."""
+        failed = reason in FAILURE_REASONS
+        entry = self._update(name, fail=1.0 if failed else 0.0)
+        with self._lock:
+            entry["last_reason"] = reason
+            if failed:
+                strikes = entry["strikes"] = entry.get("strikes", 0) + 1
+                cooldown = min(PENALTY_BASE * 2 ** (strikes - 1), PENALTY_MAX)
+                entry["penalty_until"] = time.time() + cooldown
+                logging.info(f"history: {name} penalised for {cooldown}s ({reason}, strike {strikes})")
+
+    def record_stable(self, name: str):
+        """Forgive ``name``'s strikes after it stayed healthy for STABLE_AFTER."""
+        with self._lock:
+            entry = self.servers.get(name)
+            if entry and entry.pop("strikes", None):
+                entry.pop("penalty_until", None)
+
+    def penalty(self, name: str, now: float | None = None) -> float:
+        """Return the seconds left in ``name``'s penalty box (0 if none)."""
+        now = time.time() if now is None else now
+        entry = self.servers.get(name) or {}
+        return max(0.0, entry.get("penalty_until", 0) - now)
+
+    def reconnect_delay(self, now: float | None = None) -> float:
+        """Seconds to wait before the next reconnect is within the rate limit."""
+        now = time.time() if now is None else now
+        with self._lock:
+            recent = sorted(t for t in self.reconnects if now - t < RECONNECT_WINDOW)
+        if len(recent) < RECONNECT_BURST:
+            return 0.0
+        return recent[-RECONNECT_BURST] + RECONNECT_WINDOW - now
+
+    def record_reconnect(self, now: float | None = None):
+        now = time.time() if now is None else now
+        with self._lock:
+            self.reconnects = [t for t in self.reconnects if now - t < RECONNECT_WINDOW] + [now]
+
+    def score(self, name: str, now: float | None = None) -> float | None:
+        """Return a lower-is-better score, or ``None`` if unknown or stale."""
+        entry = self.servers.get(name)
+        if not entry or entry.get("rtt") is None:
+            return None
+        now = time.time() if now is None else now
+        if now - entry.get("rtt_at", 0) > SCORE_TTL:
+            return None
+        score = entry["rtt"] * (1 + 3 * entry.get("loss", 0.0))
+        score += 1000 * (1 - entry.get("handshake", 1.0))
+        score += 1000 * entry.get("fail", 0.0)
+        score += 200 * (1 - entry.get("natpmp", 1.0))
+        score += 10 * entry.get("connect_time", 0.0)
+        return score
+
+    def compact(self, now: float | None = None):
+        """Drop entries older than MAX_AGE and keep the MAX_SERVERS newest."""
+        now = time.time() if now is None else now
+        with self._lock:
+            fresh = {
+                k: v for k, v in self.servers.items()
+                if now - v.get("updated", 0) <= MAX_AGE
+            }
+            if len(fresh) > MAX_SERVERS:
+                keep = sorted(fresh, key=lambda k: fresh[k].get("updated", 0), reverse=True)
+                fresh = {k: fresh[k] for k in keep[:MAX_SERVERS]}
+            self.servers = fresh
+
+    def save(self):
+        """Compact and atomically replace the history file."""
+        self.compact()
+        with self._lock:
+            data = json.dumps({"servers": self.servers, "reconnects": self.reconnects}, separators=(",", ":"))
+        try:
+            d = os.path.dirname(self.path) or "."
+            fd, tmp = tempfile.mkstemp(dir=d, prefix=".history.")
+        except Exception as e:
+            logging.warning(f"Cannot write history {self.path}: {e}")
+            return
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(data)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            os.unlink(tmp)
+            logging.warning(f"Cannot write history {self.path}: {e}")
+
+
+def get_history(cfg) -> History:
+    """Return the shared :class:`History` for ``cfg.config_dir``."""
+    path = os.path.join(cfg.config_dir, HISTORY_FILE)
+    with _instances_lock:
+        if path not in _instances:
+            _instances[path] = History(path)
+        return _instances[path]
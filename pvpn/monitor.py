@@ -2,137 +2,228 @@
 
 """Background connection monitoring for pvpn.
 
-This module spawns a daemon thread that periodically pings the current
-WireGuard peer. If the ping fails or exceeds a latency threshold a number
-of consecutive times, the VPN connection is cycled by invoking
-``protonvpn.disconnect`` followed by ``protonvpn.connect``.
+:func:`monitor` runs as a task on the supervisor loop
+(:mod:`pvpn.supervisor`) and judges the tunnel from its WireGuard
+handshake and byte counters (:mod:`pvpn.health`), pinging through it only
+when those look stalled, or at an interval that stretches while the
+tunnel is idle and answering. Probe RTTs are kept in a sliding window; if probes
+are lost, or the window's p95 latency or loss exceeds its limit, a number
+of consecutive times, :func:`rotate` moves the tunnel to another server: it promotes a
+ready hot standby (``monitor_standby``), else swaps only the WireGuard peer
+in place (``protonvpn.swap``), falling back to
+``protonvpn.disconnect`` followed by ``protonvpn.connect``. Either path
+cancels the old session's tasks, so nothing is left running against the
+abandoned server. Every sample is
+folded into the persistent server history (:mod:`pvpn.history`), so the
+reconnect ranks the remaining servers from what is already known instead
+of re-probing them all and skips the server that just failed.
 
 Configuration is sourced from :class:`pvpn.config.Config` via the following
 fields (with defaults shown)::
 
-    monitor_interval = 60           # seconds between checks
-    monitor_failures = 3            # consecutive bad pings before reconnect
-    monitor_latency_threshold = 500 # milliseconds considered too slow
+    monitor_interval = 60           # initial seconds between probes
+    monitor_min_interval = 10       # probe interval while degraded
+    monitor_max_interval = 300      # longest probe interval while healthy
+    monitor_failures = 3            # consecutive failed probes before reconnect
+    monitor_latency_threshold = 500 # p95 RTT limit over the window (ms)
+    monitor_loss_threshold = 0.2    # probe loss limit over the window
+    monitor_window = 20             # probe results kept per tunnel
+    monitor_standby = False         # keep a second tunnel ready to switch to
 
 """
 
 from __future__ import annotations
 
+import asyncio
 import logging
-import subprocess
-import threading
 import time
 from types import SimpleNamespace
 
 from pvpn.config import Config
-from pvpn import protonvpn
-
-
-def _get_endpoint_ip(iface: str) -> str | None:
-    """Return the endpoint IP for the first peer on ``iface``.
-
-    Uses ``wg show <iface> endpoints`` and parses the first line to obtain the
-    peer IP. Returns ``None`` if it cannot be determined.
-    """
-
-    try:
-        out = subprocess.check_output(
-            ["wg", "show", iface, "endpoints"], text=True, timeout=5
-        ).strip()
-        if not out:
-            return None
-        parts = out.split()
-        if len(parts) >= 2:
-            return parts[1].split(":")[0]
-    except Exception as exc:  # noqa: BLE001
-        logging.debug(f"monitor: failed to get endpoint for {iface}: {exc}")
-    return None
-
-
-def _ping(ip: str) -> float | None:
-    """Ping ``ip`` once and return the average RTT in ms.
-
-    Returns ``None`` on timeout or other error.
+from pvpn import protonvpn, qbittorrent, standby
+from pvpn.history import get_history, STABLE_AFTER
+from pvpn.health import (
+    CHECK_INTERVAL, HEALTHY, STALLED, Cadence, HealthTracker, RttWindow, handshake_fresh, probe, read_counters,
+)
+from pvpn.state import update_state
+from pvpn.events import emit, HANDSHAKE_STALE
+
+
+async def monitor(cfg: Config, iface: str, supervisor, server: str | None = None) -> None:
+    """Supervisor task watching ``iface``; hands off to :func:`rotate` on failure.
+
+    Reads the WireGuard counters every ``CHECK_INTERVAL`` seconds and pings
+    through the tunnel when they look stalled, or when the adaptive probe
+    interval (``Cadence``) is due. Probe results go into a sliding window
+    (``RttWindow``); the tunnel is rotated once ``monitor_failures``
+    consecutive probes are lost or find the window over the p95 latency or
+    loss limit.
+
+    Samples are recorded in the history under ``server`` (the interface
+    name unless the peer was swapped to another server in place).
     """
 
-    try:
-        out = subprocess.check_output(
-            ["ping", "-c", "1", "-W", "2", ip],
-            stderr=subprocess.DEVNULL,
-            timeout=5,
-            text=True,
-        )
-        stats = next((l for l in out.splitlines() if "rtt min/avg" in l), "")
-        return float(stats.split("/")[4]) if stats else None
-    except Exception:  # noqa: BLE001
-        return None
-
-
-def _monitor_loop(cfg: Config, iface: str) -> None:
-    """Worker loop run in a background thread."""
-
-    interval = cfg.monitor_interval
     failure_limit = cfg.monitor_failures
     latency_limit = cfg.monitor_latency_threshold
+    loss_limit = cfg.monitor_loss_threshold
+    cadence = Cadence(cfg.monitor_interval, cfg.monitor_min_interval, cfg.monitor_max_interval)
+    window = RttWindow(cfg.monitor_window)
     failures = 0
+    reason = "latency"
+    stale = False
+    latency = None
+    history = get_history(cfg)
+    tracker = HealthTracker()
+    name = server or iface
+    last_probe = last_record = started = time.monotonic()
+    stable = False
 
     logging.info(
-        "Starting monitor on %s (interval=%ss, failures=%s, latency=%sms)",
+        "Starting monitor on %s (interval=%ss, failures=%s, p95=%sms, loss=%s)",
         iface,
-        interval,
+        cadence.interval,
         failure_limit,
         latency_limit,
+        loss_limit,
     )
 
     while True:
-        time.sleep(interval)
-        ip = _get_endpoint_ip(iface)
-        if not ip:
-            logging.warning("monitor: could not determine peer endpoint")
+        await asyncio.sleep(min(cadence.interval, CHECK_INTERVAL))
+        counters = await asyncio.to_thread(read_counters, iface)
+        now = time.monotonic()
+        if counters is None:
+            logging.warning("monitor: no WireGuard peer on %s", iface)
             failures += 1
+            reason = "unreachable"
+            verdict = STALLED
+            cadence.tighten()
         else:
-            latency = _ping(ip)
-            if latency is None or latency > latency_limit:
-                logging.warning(
-                    "monitor: ping failed or high latency (%s ms) to %s", latency, ip
-                )
-                failures += 1
-            else:
-                logging.debug("monitor: latency %sms to %s", latency, ip)
-                failures = 0
+            verdict = tracker.update(counters)
+            failed = False
+            if verdict == HEALTHY:
+                # rx advancing proves the tunnel works; no probe needed
+                if not window.degraded(latency_limit, loss_limit):
+                    failures = 0
+            elif verdict == STALLED or now - last_probe >= cadence.interval:
+                last_probe = now
+                latency = await asyncio.to_thread(probe, iface)
+                window.add(latency)
+                history.record_rtt(name, latency)
+                degraded = window.degraded(latency_limit, loss_limit)
+                if latency is None or degraded:
+                    failed = True
+                    failures += 1
+                    reason = "unreachable" if latency is None else degraded
+                    cadence.tighten()
+                    logging.warning(
+                        "monitor: %s tunnel, probe %s ms on %s (%s)", verdict, latency, iface, window.stats()
+                    )
+                else:
+                    failures = 0
+                    if verdict == STALLED:
+                        cadence.tighten()
+                    else:
+                        cadence.relax()
+                    logging.debug("monitor: %s tunnel, probe %s ms on %s", verdict, latency, iface)
+            # Without keepalives an idle tunnel stops rekeying, so an old
+            # handshake only counts against a stalled tunnel or a failed probe
+            fresh = handshake_fresh(counters.handshake) or not (verdict == STALLED or failed)
+            if not fresh and not stale:
+                emit(HANDSHAKE_STALE, interface=iface, handshake=counters.handshake)
+            stale = not fresh
+            if now - last_record >= cfg.monitor_interval:
+                last_record = now
+                history.record_handshake(name, fresh)
+                if not stable and not failures and now - started >= STABLE_AFTER:
+                    stable = True
+                    history.record_stable(name)
+                await asyncio.to_thread(history.save)
+        update_state(health={
+            "at": time.time(),
+            "state": verdict,
+            "rtt": latency,
+            **window.stats(),
+            "interval": cadence.interval,
+            "handshake": counters.handshake if counters else 0,
+            "rx": counters.rx if counters else None,
+            "tx": counters.tx if counters else None,
+            "failures": failures,
+        })
 
         if failures >= failure_limit:
-            logging.warning("monitor: threshold reached, rotating server")
-            # minimal args for disconnect/connect
-            disc_args = SimpleNamespace(ks=None)
-            conn_args = SimpleNamespace(
-                cc=None,
-                sc=False,
-                p2p=False,
-                threshold=None,
-                fastest=None,
-                latency_cutoff=None,
-                dns=None,
-                ks=None,
-            )
-            try:
-                protonvpn.disconnect(cfg, disc_args)
-            except Exception as exc:  # noqa: BLE001
-                logging.error(f"monitor: disconnect failed: {exc}")
-            try:
-                protonvpn.connect(cfg, conn_args)
-            except Exception as exc:  # noqa: BLE001
-                logging.error(f"monitor: reconnect failed: {exc}")
+            logging.warning("monitor: threshold reached (%s), rotating server", reason)
+            await asyncio.to_thread(history.save)
+            supervisor.spawn("rotate", rotate(cfg, iface, reason, name))
             return
 
 
-def start_monitor(cfg: Config, iface: str) -> threading.Thread:
-    """Spawn the monitoring thread and return it."""
-
-    thread = threading.Thread(target=_monitor_loop, args=(cfg, iface), daemon=True)
-    thread.start()
-    return thread
-
+async def rotate(cfg: Config, iface: str, reason: str, server: str | None = None) -> None:
+    """Replace the server behind ``iface`` with the best other one.
+
+    Promotes the hot standby (:mod:`pvpn.standby`) if one is ready, else
+    tries :func:`protonvpn.swap`, which changes only the WireGuard peer and
+    keeps the interface, kill-switch, DNS and qBittorrent up. If that
+    fails, falls back to a full disconnect/connect. The abandoned server
+    lands in the history's penalty box, so every path skips it (and any
+    other recently failed server) until its cooldown ends. At most
+    ``RECONNECT_BURST`` rotations run per ``RECONNECT_WINDOW``; further
+    ones wait. With ``qb_pause_on_rotate`` set, torrents are paused for
+    the switch and resumed once the new port is applied. Runs as its own
+    task so that either path can cancel the old session's monitor and
+    refresher before starting a fresh session.
+    """
+    name = server or iface
+    history = get_history(cfg)
+    delay = history.reconnect_delay()
+    if delay > 0:
+        logging.warning(f"monitor: reconnect rate limit reached; waiting {delay:.0f}s")
+        await asyncio.sleep(delay)
+    history.record_reconnect()
+    await asyncio.to_thread(history.save)
+    paused = 0
+    if cfg.qb_enable and cfg.qb_pause_on_rotate:
+        paused = await asyncio.to_thread(qbittorrent.pause_transfers, cfg)
+    result = await _replace(cfg, name, reason)
+    if paused and not (result or {}).get("forwarded_port"):
+        # No new port will be applied, so nothing else resumes them
+        await asyncio.to_thread(qbittorrent.resume_transfers, cfg)
+
+
+async def _replace(cfg: Config, name: str, reason: str) -> dict | None:
+    """Run the standby, swap, reconnect ladder; return the new connection or ``None``."""
+    conn_args = SimpleNamespace(
+        exclude=[name],
+        rotated_from=name,
+        reason=reason,
+        cc=None,
+        sc=False,
+        p2p=False,
+        threshold=None,
+        fastest=None,
+        latency_cutoff=None,
+        dns=None,
+        ks=None,
+    )
+    if standby.current():
+        try:
+            return await asyncio.to_thread(standby.promote, cfg, reason)
+        except Exception as exc:  # noqa: BLE001
+            logging.warning(f"monitor: standby promotion failed ({exc}); swapping")
+    # connect/disconnect report fatal errors with sys.exit; keep the loop alive
+    try:
+        return await asyncio.to_thread(protonvpn.swap, cfg, conn_args)
+    except (Exception, SystemExit) as exc:  # noqa: BLE001
+        logging.warning(f"monitor: in-place swap failed ({exc}); reconnecting")
+    disc_args = SimpleNamespace(ks=None, reason=reason)
+    try:
+        await asyncio.to_thread(protonvpn.disconnect, cfg, disc_args)
+    except (Exception, SystemExit) as exc:  # noqa: BLE001
+        logging.error(f"monitor: disconnect failed: {exc}")
+    try:
+        return await asyncio.to_thread(protonvpn.connect, cfg, conn_args, False)
+    except (Exception, SystemExit) as exc:  # noqa: BLE001
+        logging.error(f"monitor: reconnect failed: {exc}")
+    return None
 
-__all__ = ["start_monitor"]
 
+__all__ = ["monitor", "rotate"]
@@ -1,29 +1,84 @@
 # pvpn/natpmp.py
 
 """
-Handle NAT-PMP port forwarding via `natpmpc` for a given WireGuard interface.
-Requests a mapping from the VPN gateway to the local qBittorrent port,
+Handle NAT-PMP (RFC 6886) port forwarding for a given WireGuard interface.
+Requests a mapping from the VPN gateway over a single UDP socket,
 then periodically refreshes the lease.
 """
 
-import subprocess
+import random
+import asyncio
+import socket
+import struct
 import threading
 import time
 import logging
+from typing import NamedTuple
 
 from pvpn.config import Config
 from pvpn.utils import run_cmd, check_root
+from pvpn.state import update_state
+from pvpn.events import emit, PORT_MAPPED, PORT_CHANGED, PORT_LOST
 
-# Interval (in seconds) to refresh the NAT-PMP lease
-REFRESH_INTERVAL = 50
+# Lease lifetime (seconds) requested from the gateway
+LEASE_LIFETIME = 60
+# Renewal time is randomised by this fraction to avoid synchronised refreshes
+REFRESH_JITTER = 0.1
+# Backoff (seconds) between renewals the gateway did not answer
+RETRY_INITIAL = 1
+RETRY_MAX = 16
+
+NATPMP_PORT = 5351
+# RFC 6886 3.1: first retry after 250 ms, doubling, at most 9 attempts
+INITIAL_TIMEOUT = 0.25
+MAX_ATTEMPTS = 9
+# Overall budget (seconds) for one mapping request
+REQUEST_DEADLINE = 10
+
+OPCODES = {"udp": 1, "tcp": 2}
+RESULT_CODES = {
+    1: "unsupported version",
+    2: "not authorized/refused",
+    3: "network failure",
+    4: "out of resources",
+    5: "unsupported opcode",
+}
+
+
+class MappingError(ValueError):
+    """The gateway answered a request for ``proto`` with a failure result code."""
+
+    def __init__(self, proto: str, message: str):
+        super().__init__(message)
+        self.proto = proto
+
+
+class Mapping(NamedTuple):
+    """A port mapping granted by the gateway."""
+    proto: str
+    internal_port: int
+    public_port: int
+    lifetime: int
+    epoch: int
+
 
 def _get_vpn_gateway(iface: str) -> str:
     """
-    Determine the VPN gateway IP for the given interface by parsing:
-      ip route show dev <iface> | grep default
+    Determine the VPN gateway IP for the given interface: the via address of
+    its default route in any table, normally the policy routing table (read
+    over netlink, else ``ip route show table all dev <iface>``).
     """
     try:
-        out = run_cmd(["ip", "route", "show", "dev", iface])
+        from pvpn import netlink
+        rt = netlink.route()
+        index = rt.link_index(iface)
+        for route in rt.routes():
+            if route["oif"] == index and route["dst"] == "default" and route["gateway"]:
+                return route["gateway"]
+    except Exception as e:
+        logging.debug(f"netlink route lookup for {iface} failed: {e}")
+    try:
+        out = run_cmd(["ip", "route", "show", "table", "all", "dev", iface])
         for line in out.splitlines():
             if line.startswith("default"):
                 parts = line.split()
@@ -33,46 +88,246 @@ def _get_vpn_gateway(iface: str) -> str:
         logging.error(f"Failed to get VPN gateway for interface {iface}: {e}")
         raise
 
+
+def pack_request(proto: str, internal_port: int, public_port: int, lifetime: int) -> bytes:
+    """Encode a mapping request (RFC 6886 3.3)."""
+    return struct.pack("!BBHHHI", 0, OPCODES[proto], 0, internal_port, public_port, lifetime)
+
+
+def parse_response(data: bytes) -> Mapping:
+    """Decode a mapping response.
+
+    Raises ``ValueError`` for malformed datagrams and :class:`MappingError`
+    when the gateway reports a non-zero result code.
+    """
+    if len(data) < 16:
+        raise ValueError(f"short NAT-PMP response ({len(data)} bytes)")
+    version, op, result, epoch, internal, public, lifetime = struct.unpack("!BBHIHHI", data[:16])
+    protos = {128 + v: k for k, v in OPCODES.items()}
+    if version != 0 or op not in protos:
+        raise ValueError(f"unexpected NAT-PMP response version={version} opcode={op}")
+    if result:
+        raise MappingError(protos[op], f"NAT-PMP {protos[op]} mapping failed: {RESULT_CODES.get(result, result)}")
+    return Mapping(protos[op], internal, public, lifetime, epoch)
+
+
+def request_mappings(
+    gateway: str,
+    lifetime: int = LEASE_LIFETIME,
+    internal_port: int = 1,
+    protos=("udp", "tcp"),
+    port: int = NATPMP_PORT,
+    deadline: float = REQUEST_DEADLINE,
+    iface: str | None = None,
+    quiet: bool = False,
+) -> dict:
+    """Request mappings for every protocol in ``protos`` in parallel.
+
+    All requests share one UDP socket and are retransmitted together with
+    RFC 6886 backoff (250 ms, doubling) until answered, ``MAX_ATTEMPTS`` is
+    reached or ``deadline`` seconds pass. ``iface`` pins the socket to one
+    interface (``SO_BINDTODEVICE``), e.g. a standby tunnel that does not
+    carry the routes. ``quiet`` logs timeouts and socket errors at debug.
+    Returns ``{proto: Mapping}`` for the successful ones.
+    """
+    results: dict = {}
+    pending = {p: pack_request(p, internal_port, 0, lifetime) for p in protos}
+    start = time.monotonic()
+    timeout = INITIAL_TIMEOUT
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        if iface:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BINDTODEVICE, iface.encode())
+        # connect() makes the kernel drop replies from anyone but the gateway
+        sock.connect((gateway, port))
+        for _ in range(MAX_ATTEMPTS):
+            for pkt in pending.values():
+                sock.send(pkt)
+            wait_until = min(time.monotonic() + timeout, start + deadline)
+            while pending:
+                remaining = wait_until - time.monotonic()
+                if remaining <= 0:
+                    break
+                sock.settimeout(remaining)
+                try:
+                    data = sock.recv(64)
+                except socket.timeout:
+                    break
+                try:
+                    mapping = parse_response(data)
+                except MappingError as e:
+                    # A definite refusal; retrying will not help
+                    logging.error(str(e))
+                    pending.pop(e.proto, None)
+                    continue
+                except ValueError as e:
+                    logging.debug(f"Ignoring NAT-PMP datagram: {e}")
+                    continue
+                if pending.pop(mapping.proto, None) is not None:
+                    results[mapping.proto] = mapping
+            if not pending or time.monotonic() >= start + deadline:
+                break
+            timeout *= 2
+    except OSError as e:
+        (logging.debug if quiet else logging.error)(f"NAT-PMP request to {gateway} failed: {e}")
+    finally:
+        sock.close()
+    if pending:
+        (logging.debug if quiet else logging.error)(f"NAT-PMP request timed out for {', '.join(pending)}")
+    return results
+
+
 def _request_mapping(gateway: str) -> int:
     """
-    Request a NAT-PMP port mapping from the given gateway using ``natpmpc``.
+    Request a NAT-PMP port mapping from the given gateway.
 
     ProtonVPN assigns the public port automatically; we request a placeholder
     mapping (internal port ``1`` and external ``0``) for both UDP and TCP and
     return the chosen public port. On any failure, return ``0``.
     """
-    port = 0
+    mappings = request_mappings(gateway)
     for proto in ("udp", "tcp"):
-        cmd = ["natpmpc", "-a", "1", "0", proto, "60", "-g", gateway]
-        try:
-            out = subprocess.check_output(
-                cmd, stderr=subprocess.STDOUT, timeout=10
-            ).decode()
-            for line in out.splitlines():
-                if "Mapped public port" in line:
-                    port = int(line.strip().split()[3])
-                    break
-            if not port:
-                logging.error(f"No mapping found in natpmpc output:\n{out}")
-        except subprocess.TimeoutExpired:
-            logging.error("natpmpc request timed out")
-        except subprocess.CalledProcessError as e:
-            logging.error(f"natpmpc failed: {e.output.decode().strip()}")
-        except Exception as e:
-            logging.error(f"Unexpected error calling natpmpc: {e}")
-    return port
+        if proto in mappings:
+            return mappings[proto].public_port
+    return 0
 
 
 def probe_server(ip: str) -> bool:
     """Return ``True`` if the server responds to a NAT-PMP mapping request."""
     return _request_mapping(ip) != 0
 
+def next_refresh(lifetime: int, fraction: float, jitter: float = REFRESH_JITTER) -> float:
+    """Seconds until the next renewal: ``fraction`` of ``lifetime`` +/- ``jitter``."""
+    base = max(lifetime, 1) * fraction
+    return max(1.0, base * random.uniform(1 - jitter, 1 + jitter))
+
+
+def gateway_restarted(prev_epoch: int, prev_at: float, epoch: int, now: float) -> bool:
+    """Return ``True`` if ``epoch`` shows the gateway lost its state (RFC 6886 3.6).
+
+    The gateway's seconds-since-start counter must advance at least 7/8 as
+    fast as our own clock (minus 2 s of slack); anything less means it
+    rebooted and every mapping it held is gone.
+    """
+    return epoch < prev_epoch + (now - prev_at) * 7 / 8 - 2
+
+
+class Forwarder:
+    """Keep a NAT-PMP lease alive and report public port changes.
+
+    The lease is renewed at ``refresh_fraction`` of the lifetime actually
+    granted (with jitter). Unanswered renewals are retried with exponential
+    backoff; a gateway restart (epoch went backwards) triggers an immediate
+    remap. ``on_change(old_port, new_port)`` is called whenever the public
+    port changes, including to ``0`` once an unrenewed lease has expired;
+    ``on_lease(public_port, expires)`` after every renewal or loss.
+    """
+
+    def __init__(self, gateway: str, lifetime: int = LEASE_LIFETIME,
+                 refresh_fraction: float = 0.5, on_change=None, port: int = NATPMP_PORT,
+                 on_lease=None):
+        self.gateway = gateway
+        self.lifetime = lifetime
+        self.refresh_fraction = refresh_fraction
+        self.on_change = on_change
+        self.on_lease = on_lease
+        self.port = port
+        self.public_port = 0
+        self.expires = 0.0
+        # Lifetime of the current lease; the gateway may grant less than asked
+        self.granted = 0
+        self._epoch = None
+        self._stop = threading.Event()
+
+    def _map(self) -> Mapping | None:
+        mappings = request_mappings(
+            self.gateway, lifetime=self.lifetime, port=self.port, deadline=REQUEST_DEADLINE
+        )
+        return mappings.get("udp") or mappings.get("tcp")
+
+    def _accept(self, mapping: Mapping) -> bool:
+        """Record ``mapping``; return ``False`` if the gateway restarted meanwhile."""
+        now = time.monotonic()
+        restarted = self._epoch is not None and gateway_restarted(*self._epoch, mapping.epoch, now)
+        self._epoch = (mapping.epoch, now)
+        self.granted = mapping.lifetime
+        self.expires = time.time() + mapping.lifetime
+        self._set_port(mapping.public_port)
+        return not restarted
+
+    def _set_port(self, new_port: int):
+        old, self.public_port = self.public_port, new_port
+        if self.on_lease:
+            self.on_lease(new_port, self.expires if new_port else 0)
+        if old != new_port:
+            if new_port:
+                logging.info(f"NAT-PMP port changed {old} -> {new_port}")
+            if not new_port:
+                emit(PORT_LOST, old=old)
+            elif old:
+                emit(PORT_CHANGED, old=old, port=new_port)
+            else:
+                emit(PORT_MAPPED, port=new_port, expires=self.expires)
+            if self.on_change:
+                try:
+                    self.on_change(old, new_port)
+                except Exception as e:
+                    logging.error(f"NAT-PMP port change handler failed: {e}")
+
+    def start(self) -> int:
+        """Obtain the initial mapping; return the public port (0 on failure).
+
+        Renewal is done by :meth:`run`, which the supervisor schedules.
+        """
+        mapping = self._map()
+        if not mapping:
+            return 0
+        self._accept(mapping)
+        logging.info(
+            f"NAT-PMP mapping obtained public port {mapping.public_port} "
+            f"(lifetime {mapping.lifetime}s, epoch {mapping.epoch})"
+        )
+        return self.public_port
+
+    def stop(self):
+        self._stop.set()
+
+    async def run(self):
+        """Renew the lease until cancelled or :meth:`stop` is called."""
+        delay = next_refresh(self.granted or self.lifetime, self.refresh_fraction)
+        failures = 0
+        while True:
+            await asyncio.sleep(delay)
+            if self._stop.is_set():
+                return
+            mapping = await asyncio.to_thread(self._map)
+            if mapping is None:
+                failures += 1
+                if self.public_port and time.time() >= self.expires:
+                    logging.warning("NAT-PMP lease expired without renewal; port lost")
+                    await asyncio.to_thread(self._set_port, 0)
+                delay = min(RETRY_INITIAL * 2 ** (failures - 1), RETRY_MAX)
+                logging.warning(f"NAT-PMP renewal failed ({failures}); retrying in {delay:.0f}s")
+                continue
+            failures = 0
+            # Port-change handlers do blocking I/O; keep them off the loop
+            if not await asyncio.to_thread(self._accept, mapping):
+                logging.warning("NAT-PMP gateway restart detected (epoch reset); remapping")
+                delay = 0
+                continue
+            delay = next_refresh(mapping.lifetime, self.refresh_fraction)
+
+
+_forwarder: Forwarder | None = None
+
+
 def start_forward(iface: str) -> int:
     """
-    Initiate NAT-PMP mapping for the configured qBittorrent port,
-    and spawn a background thread to refresh the mapping.
-    Returns the first mapped public port (or 0 on error).
+    Initiate NAT-PMP mapping for the configured qBittorrent port.
+    Returns the first mapped public port (or 0 on error); the lease is
+    renewed by the supervisor (see :func:`current_forwarder`).
     """
+    global _forwarder
     check_root()
 
     try:
@@ -80,36 +335,48 @@ def start_forward(iface: str) -> int:
     except Exception:
         return 0
 
-    pub_port = _request_mapping(gateway)
+    cfg = Config.load()
+
+    def _on_change(old: int, new: int):
+        if not new:
+            return
+        from pvpn.qbittorrent import update_port
+        update_port(cfg, new)
+        cfg.qb_port = new
+
+    def _on_lease(port: int, expires: float):
+        update_state(forwarded_port=port, lease_expires=expires)
+
+    if _forwarder:
+        _forwarder.stop()
+    _forwarder = Forwarder(
+        gateway, cfg.natpmp_lifetime, cfg.natpmp_refresh_fraction, on_lease=_on_lease
+    )
+    pub_port = _forwarder.start()
     if not pub_port:
         logging.warning("Initial NAT-PMP mapping failed")
         return 0
-
-    cfg = Config.load()
-    logging.info(f"NAT-PMP mapping obtained public port {pub_port}")
+    # Only later changes go to the handler; the caller applies the first port
+    _forwarder.on_change = _on_change
     cfg.qb_port = pub_port
-
-    def _refresher():
-        current = pub_port
-        while True:
-            time.sleep(REFRESH_INTERVAL)
-            new_port = _request_mapping(gateway)
-            if new_port and new_port != current:
-                logging.info(f"NAT-PMP port changed {current} -> {new_port}")
-                try:
-                    from pvpn.qbittorrent import update_port
-                    update_port(cfg, new_port)
-                    cfg.qb_port = new_port
-                except Exception as e:
-                    logging.error(f"Failed to update qBittorrent: {e}")
-                current = new_port
-
-    t = threading.Thread(target=_refresher, daemon=True)
-    t.start()
-
     return pub_port
 
 
+def current_forwarder() -> Forwarder | None:
+    """Return the forwarder holding the current lease, if any."""
+    if _forwarder and _forwarder.public_port and not _forwarder._stop.is_set():
+        return _forwarder
+    return None
+
+
+def stop_forward():
+    """Stop renewing the current lease (it expires on its own)."""
+    global _forwarder
+    if _forwarder:
+        _forwarder.stop()
+        _forwarder = None
+
+
 def get_public_port(iface: str) -> int:
     """Query the current NAT-PMP mapping and return the public port."""
     try:
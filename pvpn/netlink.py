@@ -0,0 +1,520 @@
+# pvpn/netlink.py
+
+"""
+Minimal netlink client used instead of forking ``ip`` and ``wg``:
+- Route: rtnetlink links, addresses, routes and policy rules
+- WireGuard: generic-netlink ``wireguard`` family (device/peer state, set config)
+
+Each instance keeps one netlink socket open and serialises requests on it;
+:func:`route` and :func:`wireguard` return process-wide shared instances.
+Any failure raises ``OSError`` so callers can fall back to the CLI tools.
+"""
+
+from __future__ import annotations
+
+import os
+import base64
+import socket
+import struct
+import threading
+import ipaddress
+
+NETLINK_ROUTE = 0
+NETLINK_GENERIC = 16
+
+NLM_F_REQUEST = 0x1
+NLM_F_MULTI = 0x2
+NLM_F_ACK = 0x4
+NLM_F_DUMP = 0x300
+NLM_F_REPLACE = 0x100
+NLM_F_EXCL = 0x200
+NLM_F_CREATE = 0x400
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLA_F_NESTED = 0x8000
+NLA_TYPE_MASK = 0x3FFF
+
+# rtnetlink
+RTM_NEWLINK, RTM_DELLINK, RTM_GETLINK = 16, 17, 18
+RTM_NEWADDR, RTM_DELADDR, RTM_GETADDR = 20, 21, 22
+RTM_NEWROUTE, RTM_DELROUTE, RTM_GETROUTE = 24, 25, 26
+RTM_NEWRULE, RTM_DELRULE, RTM_GETRULE = 32, 33, 34
+IFLA_IFNAME = 3
+IFLA_LINKINFO = 18
+IFLA_INFO_KIND = 1
+IFF_UP = 0x1
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+RTA_DST = 1
+RTA_OIF = 4
+RTA_GATEWAY = 5
+RTA_TABLE = 15
+RT_TABLE_UNSPEC = 0
+RT_TABLE_MAIN = 254
+RT_TABLE_LOCAL = 255
+RTPROT_BOOT = 3
+RT_SCOPE_UNIVERSE = 0
+RT_SCOPE_LINK = 253
+RTN_UNICAST = 1
+FRA_PRIORITY = 6
+FRA_FWMARK = 10
+FRA_SUPPRESS_PREFIXLEN = 14
+FRA_TABLE = 15
+FRA_FWMASK = 16
+FR_ACT_TO_TBL = 1
+FIB_RULE_INVERT = 0x2
+
+# generic netlink controller
+GENL_ID_CTRL = 0x10
+CTRL_CMD_GETFAMILY = 3
+CTRL_ATTR_FAMILY_ID = 1
+CTRL_ATTR_FAMILY_NAME = 2
+
+# WireGuard (include/uapi/linux/wireguard.h)
+WG_GENL_VERSION = 1
+WG_CMD_GET_DEVICE = 0
+WG_CMD_SET_DEVICE = 1
+WGDEVICE_A_IFNAME = 2
+WGDEVICE_A_PRIVATE_KEY = 3
+WGDEVICE_A_PUBLIC_KEY = 4
+WGDEVICE_A_FLAGS = 5
+WGDEVICE_A_LISTEN_PORT = 6
+WGDEVICE_A_FWMARK = 7
+WGDEVICE_A_PEERS = 8
+WGDEVICE_F_REPLACE_PEERS = 1
+WGPEER_A_PUBLIC_KEY = 1
+WGPEER_A_PRESHARED_KEY = 2
+WGPEER_A_FLAGS = 3
+WGPEER_A_ENDPOINT = 4
+WGPEER_A_PERSISTENT_KEEPALIVE_INTERVAL = 5
+WGPEER_A_LAST_HANDSHAKE_TIME = 6
+WGPEER_A_RX_BYTES = 7
+WGPEER_A_TX_BYTES = 8
+WGPEER_A_ALLOWEDIPS = 9
+WGPEER_F_REMOVE_ME = 1
+WGPEER_F_REPLACE_ALLOWEDIPS = 2
+WGALLOWEDIP_A_FAMILY = 1
+WGALLOWEDIP_A_IPADDR = 2
+WGALLOWEDIP_A_CIDR_MASK = 3
+
+_HDR = struct.Struct("=IHHII")
+_ATTR = struct.Struct("=HH")
+_IFINFO = struct.Struct("=BxHiII")
+_IFADDR = struct.Struct("=BBBBI")
+_RTMSG = struct.Struct("=BBBBBBBBI")
+_FIBRULE = struct.Struct("=BBBBBBBBI")
+_GENL = struct.Struct("=BBH")
+
+# Receive buffer; dumps are split across as many reads as needed
+RECV_SIZE = 1 << 16
+# Seconds to wait for the kernel before giving up
+SOCKET_TIMEOUT = 5
+
+
+class NetlinkError(OSError):
+    """The kernel rejected a request (``errno`` holds the error code)."""
+
+
+def _align(n: int) -> int:
+    return (n + 3) & ~3
+
+
+def attr(kind: int, data: bytes) -> bytes:
+    """Encode one netlink attribute, padded to 4 bytes."""
+    return _ATTR.pack(_ATTR.size + len(data), kind) + data + b"\0" * (_align(len(data)) - len(data))
+
+
+def nested(kind: int, *attrs: bytes) -> bytes:
+    return attr(kind | NLA_F_NESTED, b"".join(attrs))
+
+
+def iter_attrs(data: bytes):
+    """Yield ``(type, payload)`` for every attribute in ``data``."""
+    off = 0
+    while off + _ATTR.size <= len(data):
+        length, kind = _ATTR.unpack_from(data, off)
+        if length < _ATTR.size:
+            break
+        yield kind & NLA_TYPE_MASK, data[off + _ATTR.size:off + length]
+        off += _align(length)
+
+
+def parse_attrs(data: bytes) -> dict:
+    return dict(iter_attrs(data))
+
+
+def _cstr(data: bytes) -> str:
+    return data.split(b"\0", 1)[0].decode()
+
+
+def pack_sockaddr(endpoint: str) -> bytes:
+    """Encode ``host:port`` (or ``[v6]:port``) as a ``sockaddr_in``/``sockaddr_in6``."""
+    if endpoint.startswith("["):
+        host, port = endpoint[1:].split("]:", 1)
+    else:
+        host, port = endpoint.rsplit(":", 1)
+    family, _, _, _, sa = socket.getaddrinfo(host, int(port), type=socket.SOCK_DGRAM)[0]
+    if family == socket.AF_INET6:
+        return (struct.pack("=H", socket.AF_INET6) + struct.pack("!HI", sa[1], sa[2])
+                + socket.inet_pton(socket.AF_INET6, sa[0]) + struct.pack("=I", sa[3]))
+    return (struct.pack("=H", socket.AF_INET) + struct.pack("!H", sa[1])
+            + socket.inet_pton(socket.AF_INET, sa[0]) + b"\0" * 8)
+
+
+def unpack_sockaddr(data: bytes) -> str:
+    """Decode a ``sockaddr_in``/``sockaddr_in6`` into ``host:port``."""
+    family = struct.unpack_from("=H", data)[0]
+    port = struct.unpack_from("!H", data, 2)[0]
+    if family == socket.AF_INET6:
+        return f"[{socket.inet_ntop(socket.AF_INET6, data[8:24])}]:{port}"
+    if family == socket.AF_INET:
+        return f"{socket.inet_ntop(socket.AF_INET, data[4:8])}:{port}"
+    return ""
+
+
+class _Socket:
+    """A netlink socket with sequence-numbered request/response handling."""
+
+    def __init__(self, protocol: int):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, protocol)
+        self.sock.settimeout(SOCKET_TIMEOUT)
+        self.sock.bind((0, 0))
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def request(self, msg_type: int, payload: bytes, flags: int = 0) -> list[tuple[int, bytes]]:
+        """Send one request; return the ``(type, body)`` of every reply message.
+
+        Non-dump requests ask for an ACK, so success is confirmed even when
+        the kernel has nothing else to say. Raises :class:`NetlinkError`.
+        """
+        dump = (flags & NLM_F_DUMP) == NLM_F_DUMP
+        if not dump:
+            flags |= NLM_F_ACK
+        with self._lock:
+            self._seq = (self._seq + 1) & 0xFFFFFFFF
+            seq = self._seq
+            self.sock.send(_HDR.pack(_HDR.size + len(payload), msg_type, flags | NLM_F_REQUEST, seq, 0) + payload)
+            out = []
+            while True:
+                data = self.sock.recv(RECV_SIZE)
+                off = 0
+                while off + _HDR.size <= len(data):
+                    length, mtype, _, mseq, _ = _HDR.unpack_from(data, off)
+                    body = data[off + _HDR.size:off + length]
+                    off += _align(length)
+                    if mseq != seq:
+                        continue
+                    if mtype == NLMSG_ERROR:
+                        err = -struct.unpack_from("=i", body)[0]
+                        if err:
+                            raise NetlinkError(err, os.strerror(err))
+                        return out
+                    if mtype == NLMSG_DONE:
+                        return out
+                    out.append((mtype, body))
+
+    def close(self):
+        self.sock.close()
+
+
+class Route(_Socket):
+    """rtnetlink: links, addresses and routes."""
+
+    def __init__(self):
+        super().__init__(NETLINK_ROUTE)
+
+    def links(self) -> list[dict]:
+        """Return ``{index, name, kind, up}`` for every network interface."""
+        out = []
+        for _, body in self.request(RTM_GETLINK, _IFINFO.pack(0, 0, 0, 0, 0), NLM_F_DUMP):
+            _, _, index, flags, _ = _IFINFO.unpack_from(body)
+            attrs = parse_attrs(body[_IFINFO.size:])
+            info = parse_attrs(attrs.get(IFLA_LINKINFO, b""))
+            out.append({
+                "index": index,
+                "name": _cstr(attrs.get(IFLA_IFNAME, b"")),
+                "kind": _cstr(info.get(IFLA_INFO_KIND, b"")),
+                "up": bool(flags & IFF_UP),
+            })
+        return out
+
+    def link_index(self, name: str) -> int:
+        msgs = self.request(RTM_GETLINK, _IFINFO.pack(0, 0, 0, 0, 0) + attr(IFLA_IFNAME, name.encode() + b"\0"))
+        return _IFINFO.unpack_from(msgs[0][1])[2]
+
+    def add_link(self, name: str, kind: str):
+        payload = (_IFINFO.pack(0, 0, 0, 0, 0) + attr(IFLA_IFNAME, name.encode() + b"\0")
+                   + nested(IFLA_LINKINFO, attr(IFLA_INFO_KIND, kind.encode())))
+        self.request(RTM_NEWLINK, payload, NLM_F_CREATE | NLM_F_EXCL)
+
+    def del_link(self, name: str):
+        self.request(RTM_DELLINK, _IFINFO.pack(0, 0, self.link_index(name), 0, 0))
+
+    def set_link(self, name: str, up: bool):
+        self.request(RTM_NEWLINK, _IFINFO.pack(0, 0, self.link_index(name), IFF_UP if up else 0, IFF_UP))
+
+    def _addr_msg(self, name: str, cidr: str, peer: str | None) -> bytes:
+        iface = ipaddress.ip_interface(cidr)
+        family = socket.AF_INET6 if iface.version == 6 else socket.AF_INET
+        local = iface.ip.packed
+        prefix = iface.network.prefixlen
+        address = local
+        if peer:
+            peer_if = ipaddress.ip_interface(peer)
+            address, prefix = peer_if.ip.packed, peer_if.network.prefixlen
+        return (_IFADDR.pack(family, prefix, 0, 0, self.link_index(name))
+                + attr(IFA_LOCAL, local) + attr(IFA_ADDRESS, address))
+
+    def add_address(self, name: str, cidr: str, peer: str | None = None):
+        """Equivalent of ``ip address add <cidr> [peer <peer>] dev <name>``."""
+        self.request(RTM_NEWADDR, self._addr_msg(name, cidr, peer), NLM_F_CREATE | NLM_F_REPLACE)
+
+    def del_address(self, name: str, cidr: str, peer: str | None = None):
+        self.request(RTM_DELADDR, self._addr_msg(name, cidr, peer))
+
+    def addresses(self, name: str) -> list[str]:
+        """Return the local addresses of ``name`` as ``addr/prefix`` strings."""
+        index = self.link_index(name)
+        out = []
+        for _, body in self.request(RTM_GETADDR, _IFADDR.pack(0, 0, 0, 0, 0), NLM_F_DUMP):
+            family, prefix, _, _, idx = _IFADDR.unpack_from(body)
+            if idx != index:
+                continue
+            attrs = parse_attrs(body[_IFADDR.size:])
+            raw = attrs.get(IFA_LOCAL) or attrs.get(IFA_ADDRESS)
+            if raw:
+                out.append(f"{socket.inet_ntop(family, raw)}/{prefix}")
+        return out
+
+    def _route_msg(self, dst: str, name: str | None, gateway: str | None, table: int) -> bytes:
+        net = None if dst == "default" else ipaddress.ip_network(dst, strict=False)
+        version = net.version if net else (ipaddress.ip_address(gateway).version if gateway else 4)
+        family = socket.AF_INET6 if version == 6 else socket.AF_INET
+        scope = RT_SCOPE_UNIVERSE if gateway else RT_SCOPE_LINK
+        payload = _RTMSG.pack(family, net.prefixlen if net else 0, 0, 0, min(table, 255),
+                              RTPROT_BOOT, scope, RTN_UNICAST, 0)
+        payload += attr(RTA_TABLE, struct.pack("=I", table))
+        if net:
+            payload += attr(RTA_DST, net.network_address.packed)
+        if gateway:
+            payload += attr(RTA_GATEWAY, ipaddress.ip_address(gateway).packed)
+        if name:
+            payload += attr(RTA_OIF, struct.pack("=I", self.link_index(name)))
+        return payload
+
+    def set_route(self, dst: str, name: str | None = None, gateway: str | None = None,
+                  table: int = RT_TABLE_MAIN):
+        """Equivalent of ``ip route replace <dst> [via <gateway>] [dev <name>] table <table>``."""
+        self.request(RTM_NEWROUTE, self._route_msg(dst, name, gateway, table), NLM_F_CREATE | NLM_F_REPLACE)
+
+    def del_route(self, dst: str, name: str | None = None, gateway: str | None = None,
+                  table: int = RT_TABLE_MAIN):
+        self.request(RTM_DELROUTE, self._route_msg(dst, name, gateway, table))
+
+    def routes(self, family: int = socket.AF_INET) -> list[dict]:
+        """Return ``{table, dst, gateway, oif}`` for every route of ``family``."""
+        out = []
+        for _, body in self.request(RTM_GETROUTE, _RTMSG.pack(family, 0, 0, 0, 0, 0, 0, 0, 0), NLM_F_DUMP):
+            fam, dst_len, _, _, table, _, _, _, _ = _RTMSG.unpack_from(body)
+            attrs = parse_attrs(body[_RTMSG.size:])
+            if RTA_TABLE in attrs:
+                table = struct.unpack("=I", attrs[RTA_TABLE])[0]
+            dst = "default"
+            if dst_len and RTA_DST in attrs:
+                dst = f"{socket.inet_ntop(fam, attrs[RTA_DST])}/{dst_len}"
+            out.append({
+                "table": table,
+                "dst": dst,
+                "gateway": socket.inet_ntop(fam, attrs[RTA_GATEWAY]) if RTA_GATEWAY in attrs else None,
+                "oif": struct.unpack("=I", attrs[RTA_OIF])[0] if RTA_OIF in attrs else 0,
+            })
+        return out
+
+    def _rule_msg(self, family: int, table: int, priority: int, fwmark: int | None,
+                  invert: bool, suppress_prefixlen: int | None) -> bytes:
+        payload = _FIBRULE.pack(family, 0, 0, 0, table if table < 256 else RT_TABLE_UNSPEC, 0, 0,
+                                FR_ACT_TO_TBL, FIB_RULE_INVERT if invert else 0)
+        payload += attr(FRA_TABLE, struct.pack("=I", table))
+        payload += attr(FRA_PRIORITY, struct.pack("=I", priority))
+        if fwmark is not None:
+            payload += attr(FRA_FWMARK, struct.pack("=I", fwmark))
+            payload += attr(FRA_FWMASK, struct.pack("=I", 0xFFFFFFFF))
+        if suppress_prefixlen is not None:
+            payload += attr(FRA_SUPPRESS_PREFIXLEN, struct.pack("=I", suppress_prefixlen))
+        return payload
+
+    def add_rule(self, family: int, table: int, priority: int, fwmark: int | None = None,
+                 invert: bool = False, suppress_prefixlen: int | None = None):
+        """Equivalent of ``ip rule add [not] [fwmark <m>] table <t> [suppress_prefixlength <n>] priority <p>``."""
+        self.request(RTM_NEWRULE, self._rule_msg(family, table, priority, fwmark, invert, suppress_prefixlen),
+                     NLM_F_CREATE | NLM_F_EXCL)
+
+    def del_rule(self, family: int, table: int, priority: int, fwmark: int | None = None,
+                 invert: bool = False, suppress_prefixlen: int | None = None):
+        self.request(RTM_DELRULE, self._rule_msg(family, table, priority, fwmark, invert, suppress_prefixlen))
+
+    def rules(self, family: int = socket.AF_INET) -> list[dict]:
+        """Return ``{priority, table, fwmark, invert, suppress_prefixlen}`` for every rule of ``family``."""
+        out = []
+        for _, body in self.request(RTM_GETRULE, _FIBRULE.pack(family, 0, 0, 0, 0, 0, 0, 0, 0), NLM_F_DUMP):
+            _, _, _, _, table, _, _, _, flags = _FIBRULE.unpack_from(body)
+            attrs = parse_attrs(body[_FIBRULE.size:])
+
+            def u32(kind, default=None):
+                return struct.unpack("=I", attrs[kind])[0] if kind in attrs else default
+
+            suppress = u32(FRA_SUPPRESS_PREFIXLEN)
+            out.append({
+                "priority": u32(FRA_PRIORITY, 0),
+                "table": u32(FRA_TABLE, table),
+                "fwmark": u32(FRA_FWMARK),
+                "invert": bool(flags & FIB_RULE_INVERT),
+                "suppress_prefixlen": None if suppress in (None, 0xFFFFFFFF) else suppress,
+            })
+        return out
+
+
+class WireGuard(_Socket):
+    """Generic-netlink client for the kernel ``wireguard`` family."""
+
+    def __init__(self):
+        super().__init__(NETLINK_GENERIC)
+        payload = _GENL.pack(CTRL_CMD_GETFAMILY, 1, 0) + attr(CTRL_ATTR_FAMILY_NAME, b"wireguard\0")
+        msgs = self.request(GENL_ID_CTRL, payload)
+        attrs = parse_attrs(msgs[0][1][_GENL.size:])
+        self.family = struct.unpack_from("=H", attrs[CTRL_ATTR_FAMILY_ID])[0]
+
+    def get_device(self, name: str) -> dict:
+        """Return ``{public_key, listen_port, fwmark, peers}`` for ``name``.
+
+        Each peer is ``{public_key, endpoint, last_handshake, rx_bytes,
+        tx_bytes, persistent_keepalive, allowed_ips}``; ``last_handshake`` is
+        a UNIX timestamp (0 if the peer never completed a handshake).
+        """
+        payload = (_GENL.pack(WG_CMD_GET_DEVICE, WG_GENL_VERSION, 0)
+                   + attr(WGDEVICE_A_IFNAME, name.encode() + b"\0"))
+        device: dict = {"public_key": "", "listen_port": 0, "fwmark": 0, "peers": []}
+        for _, body in self.request(self.family, payload, NLM_F_DUMP):
+            for kind, value in iter_attrs(body[_GENL.size:]):
+                if kind == WGDEVICE_A_PUBLIC_KEY:
+                    device["public_key"] = base64.b64encode(value).decode()
+                elif kind == WGDEVICE_A_LISTEN_PORT:
+                    device["listen_port"] = struct.unpack("=H", value)[0]
+                elif kind == WGDEVICE_A_FWMARK:
+                    device["fwmark"] = struct.unpack("=I", value)[0]
+                elif kind == WGDEVICE_A_PEERS:
+                    for _, raw in iter_attrs(value):
+                        peer = _parse_peer(raw)
+                        peers = device["peers"]
+                        # Large peers are split across messages; merge the pieces
+                        if peers and peers[-1]["public_key"] == peer["public_key"]:
+                            peers[-1]["allowed_ips"].extend(peer["allowed_ips"])
+                        else:
+                            peers.append(peer)
+        return device
+
+    def set_device(self, name: str, private_key: str | None = None, listen_port: int | None = None,
+                   fwmark: int | None = None, peers: list[dict] | None = None,
+                   replace_peers: bool = False):
+        """Configure ``name`` like ``wg set``/``wg setconf``.
+
+        ``peers`` entries take ``public_key`` and optionally
+        ``preshared_key``, ``endpoint``, ``allowed_ips``,
+        ``persistent_keepalive`` and ``remove``. Keys are base64 strings.
+        ``replace_peers`` drops every peer not listed (``wg setconf``).
+        """
+        attrs = [attr(WGDEVICE_A_IFNAME, name.encode() + b"\0")]
+        if private_key:
+            attrs.append(attr(WGDEVICE_A_PRIVATE_KEY, base64.b64decode(private_key)))
+        if listen_port is not None:
+            attrs.append(attr(WGDEVICE_A_LISTEN_PORT, struct.pack("=H", listen_port)))
+        if fwmark is not None:
+            attrs.append(attr(WGDEVICE_A_FWMARK, struct.pack("=I", fwmark)))
+        if replace_peers:
+            attrs.append(attr(WGDEVICE_A_FLAGS, struct.pack("=I", WGDEVICE_F_REPLACE_PEERS)))
+        if peers:
+            attrs.append(nested(WGDEVICE_A_PEERS, *(nested(i, *_peer_attrs(p)) for i, p in enumerate(peers))))
+        self.request(self.family, _GENL.pack(WG_CMD_SET_DEVICE, WG_GENL_VERSION, 0) + b"".join(attrs))
+
+
+def _peer_attrs(peer: dict) -> list[bytes]:
+    out = [attr(WGPEER_A_PUBLIC_KEY, base64.b64decode(peer["public_key"]))]
+    flags = 0
+    if peer.get("remove"):
+        flags |= WGPEER_F_REMOVE_ME
+    if "allowed_ips" in peer:
+        flags |= WGPEER_F_REPLACE_ALLOWEDIPS
+    out.append(attr(WGPEER_A_FLAGS, struct.pack("=I", flags)))
+    if peer.get("preshared_key"):
+        out.append(attr(WGPEER_A_PRESHARED_KEY, base64.b64decode(peer["preshared_key"])))
+    if peer.get("endpoint"):
+        out.append(attr(WGPEER_A_ENDPOINT, pack_sockaddr(peer["endpoint"])))
+    if peer.get("persistent_keepalive") is not None:
+        out.append(attr(WGPEER_A_PERSISTENT_KEEPALIVE_INTERVAL, struct.pack("=H", int(peer["persistent_keepalive"]))))
+    if "allowed_ips" in peer:
+        ips = []
+        for i, cidr in enumerate(peer["allowed_ips"]):
+            net = ipaddress.ip_network(cidr, strict=False)
+            family = socket.AF_INET6 if net.version == 6 else socket.AF_INET
+            ips.append(nested(
+                i,
+                attr(WGALLOWEDIP_A_FAMILY, struct.pack("=H", family)),
+                attr(WGALLOWEDIP_A_IPADDR, net.network_address.packed),
+                attr(WGALLOWEDIP_A_CIDR_MASK, struct.pack("=B", net.prefixlen)),
+            ))
+        out.append(nested(WGPEER_A_ALLOWEDIPS, *ips))
+    return out
+
+
+def _parse_peer(data: bytes) -> dict:
+    peer = {
+        "public_key": "",
+        "endpoint": "",
+        "last_handshake": 0,
+        "rx_bytes": 0,
+        "tx_bytes": 0,
+        "persistent_keepalive": 0,
+        "allowed_ips": [],
+    }
+    for kind, value in iter_attrs(data):
+        if kind == WGPEER_A_PUBLIC_KEY:
+            peer["public_key"] = base64.b64encode(value).decode()
+        elif kind == WGPEER_A_ENDPOINT:
+            peer["endpoint"] = unpack_sockaddr(value)
+        elif kind == WGPEER_A_LAST_HANDSHAKE_TIME:
+            peer["last_handshake"] = struct.unpack_from("=q", value)[0]
+        elif kind == WGPEER_A_RX_BYTES:
+            peer["rx_bytes"] = struct.unpack("=Q", value)[0]
+        elif kind == WGPEER_A_TX_BYTES:
+            peer["tx_bytes"] = struct.unpack("=Q", value)[0]
+        elif kind == WGPEER_A_PERSISTENT_KEEPALIVE_INTERVAL:
+            peer["persistent_keepalive"] = struct.unpack("=H", value)[0]
+        elif kind == WGPEER_A_ALLOWEDIPS:
+            for _, raw in iter_attrs(value):
+                a = parse_attrs(raw)
+                family = struct.unpack("=H", a[WGALLOWEDIP_A_FAMILY])[0]
+                addr = socket.inet_ntop(family, a[WGALLOWEDIP_A_IPADDR])
+                peer["allowed_ips"].append(f"{addr}/{a[WGALLOWEDIP_A_CIDR_MASK][0]}")
+    return peer
+
+
+_shared: dict = {}
+_shared_lock = threading.Lock()
+
+
+def _get(cls):
+    with _shared_lock:
+        if cls not in _shared:
+            _shared[cls] = cls()
+        return _shared[cls]
+
+
+def route() -> Route:
+    """Return the shared rtnetlink socket (created on first use)."""
+    return _get(Route)
+
+
+def wireguard() -> WireGuard:
+    """Return the shared WireGuard generic-netlink socket (created on first use)."""
+    return _get(WireGuard)
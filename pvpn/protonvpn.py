@@ -9,60 +9,129 @@ configuration files that the user has placed in the configuration directory.
 
 import os
 import sys
+import json
+import time
 import logging
+import concurrent.futures
 
 from pvpn.config import Config
 from pvpn.utils import check_root
 
 WG_DIR = "wireguard"
-
-
-def connect(cfg: Config, args):
-    """Bring up a WireGuard interface using an existing configuration."""
+# Threads running connect stages alongside the tunnel bring-up
+CONNECT_WORKERS = 2
+
+# Per-component deadlines (seconds) for ``status --live``
+STATUS_DEADLINES = {
+    "interface": 0.15,
+    "dns": 0.15,
+    "killswitch": 0.15,
+    "forwarded_port": 0.18,
+    "qb_port": 0.18,
+    "qb_active": 0.18,
+}
+
+
+def connect(cfg: Config, args, wait: bool = True) -> dict:
+    """Bring up a WireGuard interface using an existing configuration.
+
+    Setup runs as a small pipeline: the kill-switch (and after it
+    qbittorrent-nox) is started in parallel with the tunnel, NAT-PMP is
+    requested as soon as the link is up, and the qBittorrent port push and
+    torrent resume run in the background. The NAT-PMP refresher and monitor
+    run as a supervisor session (:mod:`pvpn.supervisor`) replacing any
+    previous one. With ``wait`` (the
+    foreground CLI) this then blocks until interrupted; the daemon and the
+    monitor's rotation pass ``wait=False`` and get back ``{interface,
+    server, forwarded_port}`` once the tunnel is up.
+    """
 
     check_root()
     wg_path = os.path.join(cfg.config_dir, WG_DIR)
 
     def _connect_with_conf(conf_file: str):
         from pvpn.wireguard import bring_up
-
+        from pvpn.history import get_history
+        from pvpn.catalog import parse_file
+        from pvpn.state import clear_state, update_state
+        from pvpn import events
+
+        history = get_history(cfg)
+        name = os.path.splitext(os.path.basename(conf_file))[0]
+        server = parse_file(conf_file)
+        endpoint = server.endpoint
+        ks = (args.ks == "true") or (args.ks is None and cfg.network_ks_default)
+        split = _split_match(cfg)
+
+        # Stages that do not need the tunnel run while it comes up; the
+        # interface name is known up front, so the kill-switch can be armed
+        # before anything (qBittorrent included) can leak past it.
+        pool = concurrent.futures.ThreadPoolExecutor(CONNECT_WORKERS, thread_name_prefix="pvpn-connect")
+        # In split mode the torrent client is always confined to the tunnel
+        killswitch = pool.submit(_killswitch_stage, name, endpoint, cfg, split) if ks or split else None
+        service = pool.submit(_service_stage, killswitch) if cfg.qb_enable else None
+        pool.shutdown(wait=False)
+
+        started = time.monotonic()
         iface = bring_up(
             conf_file,
             dns=(args.dns == "true") if args.dns else cfg.network_dns_default,
         )
-
-        if (args.ks == "true") or (args.ks is None and cfg.network_ks_default):
-            from pvpn.routing import enable_killswitch
-
-            enable_killswitch(iface)
-
-        from pvpn.qbittorrent import start_service, update_port
-
-        if cfg.qb_enable:
-            start_service()
+        from pvpn.routing import install_policy
+        from pvpn.wireguard import _primary_address
+
+        if split and killswitch:
+            killswitch.result()  # split rules depend on the nftables table it installs
+        split = install_policy(iface, _primary_address(server.addresses, conf_file)[1], split=bool(split))
+        history.record_connect(name, time.monotonic() - started)
+
+        clear_state()
+        update_state(
+            pid=os.getpid(),
+            interface=iface,
+            server=name,
+            endpoint=endpoint,
+            connected_at=time.time(),
+            killswitch=bool(ks or cfg.network_split_tunnel),
+            split_tunnel=bool(split),
+        )
+        events.emit(events.TUNNEL_UP, interface=iface, server=name, endpoint=endpoint)
+        rotated_from = getattr(args, "rotated_from", None)
+        if rotated_from:
+            events.emit(events.SERVER_ROTATED, old=rotated_from, new=name, reason=getattr(args, "reason", None))
 
         from pvpn.natpmp import start_forward
 
+        # NAT-PMP as soon as the link is up
         pub_port = start_forward(iface)
+        history.record_natpmp(name, bool(pub_port))
+        history.save()
+        if killswitch:
+            killswitch.result()
 
-        if pub_port:
-            update_port(cfg, pub_port)
-        else:
-            logging.warning("Port forwarding unavailable; continuing without it")
+        from pvpn.supervisor import get_supervisor
 
-        from pvpn.monitor import start_monitor
+        supervisor = get_supervisor()
+        supervisor.start_session(cfg, iface, server=name)
 
-        monitor_thread = start_monitor(cfg, iface)
+        if pub_port and cfg.qb_enable:
+            from pvpn.qbittorrent import apply_port
 
-        port_msg = pub_port if pub_port else "none"
-        print(
-            f"✅ Connected using {os.path.basename(conf_file)} on {iface}, forwarded port {port_msg}"
-        )
+            # Pushed (and torrents resumed) once qbittorrent-nox answers
+            supervisor.spawn("qb_port", apply_port(cfg, pub_port, service))
+        elif not pub_port:
+            logging.warning("Port forwarding unavailable; continuing without it")
 
-        try:
-            monitor_thread.join()
-        except KeyboardInterrupt:
-            pass
+        result = {"interface": iface, "server": name, "forwarded_port": pub_port}
+        print(connected_message(result))
+        logging.info(f"Connected in {time.monotonic() - started:.2f}s")
+
+        if wait:
+            try:
+                supervisor.wait()
+            except KeyboardInterrupt:
+                pass
+        return result
 
     if getattr(args, "config", None):
         conf_file = args.config
@@ -71,17 +140,227 @@ def connect(cfg: Config, args):
         if not os.path.isfile(conf_file):
             logging.error(f"WireGuard config {conf_file} not found")
             sys.exit(1)
-        _connect_with_conf(conf_file)
-        return
+        return _connect_with_conf(conf_file)
+
+    candidates = _candidates(cfg, args)
+    if not candidates:
+        logging.error("No WireGuard config files found")
+        sys.exit(1)
+
+    from pvpn.servers import rank_with_history
+    from pvpn.history import get_history
+
+    ranked = rank_with_history(candidates, get_history(cfg))
+    return _connect_with_conf(ranked[0].path)
+
+
+def _split_match(cfg: Config) -> str | None:
+    """nft match for split-tunnel traffic: ``split_user``'s sockets, else the qbittorrent-nox cgroup.
+
+    Exits with a config error if ``split_user`` names no local user.
+    """
+    if not cfg.network_split_tunnel:
+        return None
+    from pvpn.routing import split_match
+
+    user = cfg.network_split_user
+    if user:
+        import pwd
+
+        try:
+            uid = int(user) if user.isdigit() else pwd.getpwnam(user).pw_uid
+        except KeyError:
+            logging.error(f"[network] split_user: no such user {user!r}")
+            sys.exit(1)
+        return split_match(uid=uid)
+    from pvpn.qbittorrent import service_cgroup
+
+    return split_match(cgroup=service_cgroup())
+
+
+def _killswitch_stage(iface: str, endpoint: str | None, cfg: Config, split: str | None = None):
+    """Connect stage: arm the kill-switch for ``iface``, its endpoint and the LAN allowlist.
+
+    With ``split`` (from :func:`_split_match`) it confines only qbittorrent-nox.
+    """
+    from pvpn.routing import enable_killswitch, allow_endpoint, parse_allowlist
+
+    allow = parse_allowlist(cfg.network_allow_lan, cfg.network_allow_ports)
+    enable_killswitch(iface, allow, split)
+    if endpoint:
+        allow_endpoint(endpoint)
+
+
+def _service_stage(killswitch: concurrent.futures.Future | None):
+    """Connect stage: start qbittorrent-nox, once the kill-switch is armed."""
+    from pvpn.qbittorrent import start_service
+
+    if killswitch:
+        killswitch.result()
+    start_service()
+
+
+def swap(cfg: Config, args) -> dict:
+    """Move the running tunnel to the best other server without teardown.
+
+    Only the WireGuard peer (key, endpoint, addresses) is replaced; the
+    interface, kill-switch, DNS and qBittorrent keep running. NAT-PMP is
+    remapped through the new server and the new port pushed to qB by a
+    supervisor task.
+    Returns ``{interface, server, forwarded_port}``; raises if there is no
+    tunnel to swap or no other server to move to.
+    """
+    check_root()
+
+    from pvpn.state import read_state, update_state
+    from pvpn.wireguard import get_active_iface, swap_peer
+    from pvpn.servers import rank_with_history
+    from pvpn.history import get_history
+    from pvpn.supervisor import get_supervisor
+    from pvpn import events
+
+    prev = read_state()
+    iface = prev.get("interface") or get_active_iface()
+    if not iface:
+        raise RuntimeError("no active tunnel to swap")
+    old = prev.get("server") or iface
+    exclude = set(getattr(args, "exclude", None) or ()) | {old}
+    candidates = [s for s in _candidates(cfg, args) if s.name not in exclude]
+    if not candidates:
+        raise RuntimeError("no other server to swap to")
+
+    history = get_history(cfg)
+    reason = getattr(args, "reason", None) or "user"
+    target = rank_with_history(candidates, history)[0]
+
+    supervisor = get_supervisor()
+    supervisor.stop_session()
+    started = time.monotonic()
+    server = swap_peer(iface, target.path)
+    from pvpn.routing import set_tunnel_route
+    from pvpn.wireguard import _primary_address
+
+    # The policy rules stay; only the tunnel table's default route is redone
+    set_tunnel_route(iface, _primary_address(server.addresses, target.path)[1])
+    if prev.get("killswitch"):
+        from pvpn.routing import allow_endpoint
+
+        allow_endpoint(server.endpoint)
+    history.record_disconnect(old, reason)
+    history.record_connect(server.name, time.monotonic() - started)
+    update_state(server=server.name, endpoint=server.endpoint, connected_at=time.time())
+    events.emit(events.SERVER_ROTATED, old=old, new=server.name, reason=reason, mode="swap")
+
+    from pvpn.natpmp import start_forward
+    from pvpn.qbittorrent import apply_port
+
+    pub_port = start_forward(iface)
+    history.record_natpmp(server.name, bool(pub_port))
+    history.save()
+    supervisor.start_session(cfg, iface, server=server.name)
+    if pub_port:
+        if cfg.qb_enable:
+            supervisor.spawn("qb_port", apply_port(cfg, pub_port))
+    else:
+        logging.warning("Port forwarding unavailable after swap; continuing without it")
+    logging.info(f"Swapped {old} -> {server.name} in {time.monotonic() - started:.2f}s")
+    return {"interface": iface, "server": server.name, "forwarded_port": pub_port}
+
+
+def switch(cfg: Config, args) -> dict:
+    """Change server now: promote the hot standby if one is ready, else :func:`swap`.
+
+    With ``qb_pause_on_rotate`` set, torrents are paused for the switch.
+    """
+    check_root()
 
+    from pvpn import qbittorrent, standby
+
+    paused = cfg.qb_enable and cfg.qb_pause_on_rotate and qbittorrent.pause_transfers(cfg)
+    result = None
+    try:
+        if standby.current():
+            result = standby.promote(cfg, getattr(args, "reason", None) or "user")
+        else:
+            result = swap(cfg, args)
+        return result
+    finally:
+        # Without a new port nothing else resumes the paused torrents
+        if paused and not (result or {}).get("forwarded_port"):
+            qbittorrent.resume_transfers(cfg)
+
+
+def connected_message(result: dict) -> str:
+    port = result.get("forwarded_port") or "none"
+    return f"✅ Connected using {result.get('server')} on {result.get('interface')}, forwarded port {port}"
+
+
+def _catalog(cfg: Config) -> list:
+    """Return every config in ``wireguard/`` via the persisted catalog index."""
+    from pvpn.catalog import load_catalog, CATALOG_FILE
+
+    wg_path = os.path.join(cfg.config_dir, WG_DIR)
     if not os.path.isdir(wg_path):
         logging.error("WireGuard config directory missing")
         sys.exit(1)
-    confs = [f for f in sorted(os.listdir(wg_path)) if f.endswith(".conf")]
-    if not confs:
-        logging.error("No WireGuard config files found")
-        sys.exit(1)
-    _connect_with_conf(os.path.join(wg_path, confs[0]))
+    return load_catalog(wg_path, os.path.join(cfg.config_dir, CATALOG_FILE))
+
+
+def _candidates(cfg: Config, args) -> list:
+    """Return the catalogued configs matching the ``--cc/--p2p/--sc`` filters.
+
+    Server names listed in ``args.exclude`` (e.g. the one the monitor just
+    abandoned) are dropped unless nothing else matches. So are servers in
+    the history's penalty box; if every match is penalised, the ones whose
+    cooldown ends first are kept.
+    """
+    from pvpn.servers import filter_servers
+    from pvpn.history import get_history
+
+    servers = filter_servers(
+        _catalog(cfg),
+        cc=getattr(args, "cc", None),
+        p2p=getattr(args, "p2p", False),
+        sc=getattr(args, "sc", False),
+    )
+    exclude = getattr(args, "exclude", None) or ()
+    remaining = [s for s in servers if s.name not in exclude]
+    # Only honour exclusions if something is left to connect to
+    servers = remaining or servers
+    history = get_history(cfg)
+    now = time.time()
+    penalties = {s.name: history.penalty(s.name, now) for s in servers}
+    if servers and all(penalties.values()):
+        soonest = min(penalties.values())
+        logging.warning(f"All matching servers are penalised; retrying those free in {soonest:.0f}s")
+        return [s for s in servers if penalties[s.name] == soonest]
+    return [s for s in servers if not penalties[s.name]]
+
+
+def list_servers(cfg: Config, args):
+    """Print available configs matching the filters, optionally ranked by latency."""
+
+    servers = _candidates(cfg, args)
+    if not servers:
+        print("No matching servers")
+        return
+
+    results = {}
+    if getattr(args, "fastest", False):
+        from pvpn.servers import probe_servers, rank_servers
+
+        results = probe_servers(servers)
+        servers = rank_servers(servers, results)
+
+    print(f"{'Name':<24} {'CC':<3} {'P2P':<4} {'SC':<3} {'RTT':>9} {'Loss':>5}  Endpoint")
+    for s in servers:
+        rtt, loss = results.get(s.name, (None, None))
+        rtt_s = f"{rtt:.1f}ms" if rtt is not None else "-"
+        loss_s = f"{loss:.0%}" if loss is not None else "-"
+        print(
+            f"{s.name:<24} {s.country or '-':<3} {'yes' if s.p2p else 'no':<4} "
+            f"{'yes' if s.secure_core else 'no':<3} {rtt_s:>9} {loss_s:>5}  {s.endpoint or '-'}"
+        )
 
 
 def disconnect(cfg: Config, args):
@@ -89,6 +368,28 @@ def disconnect(cfg: Config, args):
 
     check_root()
 
+    from pvpn.wireguard import get_active_iface
+    from pvpn.history import get_history
+    from pvpn.state import read_state, clear_state
+
+    prev = read_state()
+
+    from pvpn.supervisor import stop_session
+    from pvpn.natpmp import stop_forward
+
+    from pvpn.standby import discard
+
+    # Nothing may keep refreshing or probing the tunnel being torn down
+    stop_session()
+    stop_forward()
+    discard()
+
+    iface = prev.get("interface") or get_active_iface()
+    if iface:
+        history = get_history(cfg)
+        history.record_disconnect(prev.get("server") or iface, getattr(args, "reason", None) or "user")
+        history.save()
+
     from pvpn.qbittorrent import stop_service
 
     if cfg.qb_enable:
@@ -100,23 +401,103 @@ def disconnect(cfg: Config, args):
         disable_killswitch()
 
     from pvpn.wireguard import bring_down
+    from pvpn import events
 
     bring_down()
+    from pvpn.routing import remove_policy
+
+    remove_policy()
+    if iface:
+        events.emit(events.TUNNEL_DOWN, interface=iface, reason=getattr(args, "reason", None) or "user")
 
     from pvpn.utils import restore_file
 
     restore_file("/etc/resolv.conf.pvpnbak", "/etc/resolv.conf")
 
+    if args.ks != "false" and prev.get("killswitch"):
+        clear_state(killswitch=True)
+    else:
+        clear_state()
+
     print("✅ Disconnected")
 
 
-def status(cfg: Config):
-    """Display WireGuard, routing, and qBittorrent status."""
+def status(cfg: Config, live: bool = False, as_json: bool = False):
+    """Display WireGuard, routing, and qBittorrent status.
+
+    By default the report comes from the state file published by the
+    running ``connect`` process, which is instant and has no side effects.
+    ``live`` probes the system, NAT-PMP gateway and qBittorrent instead,
+    concurrently and each under its own deadline. ``as_json`` prints the
+    report as a JSON object instead of coloured text.
+    """
+
+    show_status(_live_status(cfg) if live else _cached_status(), as_json)
+
+
+def show_status(info: dict, as_json: bool = False):
+    """Print a status report built here or received from the daemon."""
+    if as_json:
+        print(json.dumps(info, sort_keys=True))
+    else:
+        _print_status(info)
+
 
+def _cached_status() -> dict:
+    """Build the status report from the published runtime state."""
+    from pvpn.state import read_state
+    from pvpn.wireguard import get_dns_servers
+
+    info = read_state()
+    info["dns"] = get_dns_servers()
+    return info
+
+
+def _live_status(cfg: Config) -> dict:
+    """Build the status report by probing every component concurrently.
+
+    Components that miss their entry in ``STATUS_DEADLINES`` are reported
+    as ``"timeout"`` rather than delaying the whole report.
+    """
     from pvpn.wireguard import get_active_iface, get_dns_servers
     from pvpn.routing import killswitch_status
     from pvpn.natpmp import get_public_port
-    from pvpn.qbittorrent import get_listen_port
+    from pvpn.qbittorrent import get_listen_port, active_torrents
+    from pvpn.utils import run_with_deadlines, TIMEOUT
+
+    def _forwarded_port() -> int:
+        iface = get_active_iface()
+        return get_public_port(iface) if iface else 0
+
+    probes = {
+        "interface": get_active_iface,
+        "dns": get_dns_servers,
+        "killswitch": killswitch_status,
+        "forwarded_port": _forwarded_port,
+        "qb_port": lambda: get_listen_port(cfg),
+    }
+    if cfg.qb_enable:
+        probes["qb_active"] = lambda: active_torrents(cfg)
+    info = run_with_deadlines({k: (fn, STATUS_DEADLINES[k]) for k, fn in probes.items()})
+
+    iface = info["interface"]
+    wg_path = os.path.join(cfg.config_dir, WG_DIR)
+    if iface and iface != TIMEOUT and os.path.isdir(wg_path):
+        from pvpn.catalog import load_catalog, find, CATALOG_FILE
+
+        from pvpn.state import read_state
+
+        # After an in-place swap the interface keeps the first server's name
+        name = read_state().get("server") or iface
+        server = find(load_catalog(wg_path, os.path.join(cfg.config_dir, CATALOG_FILE)), name)
+        if server:
+            info["server"] = server.name
+            info["endpoint"] = server.endpoint
+    return info
+
+
+def _print_status(info: dict):
+    from pvpn.utils import TIMEOUT
 
     RESET = "\033[0m"
     GREEN = "\033[92m"
@@ -127,18 +508,50 @@ def status(cfg: Config):
         color = GREEN if ok else RED
         print(f"{color}{icon}{RESET} {label:<14}: {color}{value}{RESET}")
 
-    iface = get_active_iface()
-    line("Interface", bool(iface), iface if iface else "none")
-
-    dns = get_dns_servers()
-    line("DNS", bool(dns), ", ".join(dns) if dns else "unknown")
-
-    ks = killswitch_status()
-    line("Kill-switch", ks, "enabled" if ks else "disabled")
-
-    pub_port = get_public_port(iface) if iface else 0
-    line("Forwarded port", bool(pub_port), str(pub_port) if pub_port else "none")
-
-    qb_port = get_listen_port(cfg)
-    line("qBittorrent port", bool(qb_port), str(qb_port) if qb_port else "unknown")
-
+    def field(label: str, key: str, fmt, missing: str):
+        value = info.get(key)
+        if value == TIMEOUT:
+            line(label, False, TIMEOUT)
+        else:
+            line(label, bool(value), fmt(value) if value else missing)
+
+    field("Interface", "interface", str, "none")
+    field("DNS", "dns", ", ".join, "unknown")
+    ks = info.get("killswitch")
+    if ks == TIMEOUT:
+        line("Kill-switch", False, TIMEOUT)
+    else:
+        scope = " (qbittorrent-nox only)" if info.get("split_tunnel") else ""
+        line("Kill-switch", bool(ks), f"enabled{scope}" if ks else "disabled")
+
+    def _port(port) -> str:
+        if info.get("lease_expires"):
+            return f"{port} (expires in {max(0, int(info['lease_expires'] - time.time()))}s)"
+        return str(port)
+
+    field("Forwarded port", "forwarded_port", _port, "none")
+    field("qBittorrent port", "qb_port", str, "unknown")
+    field("Server", "server", lambda s: f"{s} {info.get('endpoint') or '-'}", "unknown")
+
+    health = info.get("health")
+    if health:
+        rtt = health.get("rtt")
+        verdict = health.get("state")
+        age = int(time.time() - health.get("at", 0))
+        parts = [verdict] if verdict else []
+        if rtt is not None:
+            parts.append(f"{rtt:.0f} ms")
+        elif verdict != "healthy":
+            parts.append("no reply")
+        if health.get("p95") is not None:
+            parts.append(f"p95 {health['p95']:.0f} ms")
+        if health.get("loss"):
+            parts.append(f"loss {health['loss']:.0%}")
+        ok = verdict == "healthy" or (verdict != "stalled" and rtt is not None)
+        line("Health", ok, f"{', '.join(parts)} ({age}s ago)")
+
+    active = info.get("qb_active")
+    if active == TIMEOUT:
+        line("Torrents", False, TIMEOUT)
+    elif active is not None:
+        line("Torrents", True, f"{active} active")
@@ -2,24 +2,153 @@
 
 """
 Manage qBittorrent-nox integration:
+- QBClient / client: shared WebUI API client (keep-alive pool, cached SID)
+- TorrentTracker / tracker: in-memory torrent map kept current with
+  ``sync/maindata`` deltas, so polling costs what changed, not the library
+- PortReconciler / reconciler: desired listen port, applied only where
+  qBittorrent's actual preferences differ; reconcile_port re-applies it
+  when qBittorrent drifts or restarts
 - update_port: set the listening port via WebUI API
+- apply_port: background retrying port push while qbittorrent-nox starts
+- reannounce: tell trackers about a new port, busiest torrents first
+- pause_transfers / resume_transfers: hold transfers across a rotation
 - get_listen_port: determine qBittorrent's current listen port
 - resume stalled torrents after restart
+- start_service / stop_service / service_cgroup: the systemd unit
 """
 
+import json
 import time
+import asyncio
 import logging
+import threading
 import requests
 import configparser
 import subprocess
 from pathlib import Path
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from pvpn.config import Config
 from pvpn.utils import run_cmd
+from pvpn.state import update_state
+from pvpn.events import emit, QB_PORT_APPLIED
 
+# systemd unit running the torrent client
+QB_UNIT = "qbittorrent-nox"
 # How long to wait before forcing a resume (seconds)
 RESUME_TIMEOUT = 120
 POLL_INTERVAL = 5
+# WebUI request timeout (seconds) and transport-level retries
+API_TIMEOUT = 10
+API_RETRIES = 2
+# Keep-alive connections kept open to the WebUI
+POOL_SIZE = 4
+# Seconds between torrent map syncs while a tunnel is up
+TRACK_INTERVAL = 30
+# Seconds between checks of qBittorrent's actual listen port
+RECONCILE_INTERVAL = 5
+# How long apply_port keeps retrying while the WebUI starts, and how often
+APPLY_TIMEOUT = 60
+APPLY_RETRY = 2
+# qBittorrent torrent states that mean data is being transferred
+ACTIVE_STATES = ("downloading", "forcedDL", "metaDL", "uploading", "forcedUP")
+# States showing qBittorrent is already working through its download queue
+BUSY_STATES = ("downloading", "forcedDL", "metaDL", "queuedDL", "queued")
+# States with nothing to pause, resume or announce
+INACTIVE_STATES = ("pausedUP", "pausedDL", "stoppedUP", "stoppedDL", "error", "missingFiles", "unknown")
+# Reannounce rate limit: torrents per request and seconds between requests
+REANNOUNCE_BATCH = 50
+REANNOUNCE_INTERVAL = 2.0
+
+
+class QBLoginError(requests.RequestException):
+    """The WebUI rejected pvpn's credentials."""
+
+
+class QBClient:
+    """Long-lived qBittorrent WebUI API client.
+
+    One ``requests.Session`` with a small keep-alive pool is reused for
+    every call; the SID cookie from the first login is kept and only
+    renewed when the WebUI answers 403 (session expired or qBittorrent
+    restarted). Connection errors and 502/503/504 replies are retried with
+    a short backoff before an error is raised.
+    """
+
+    def __init__(self, url: str, user: str, password: str, timeout: float = API_TIMEOUT):
+        self.url = url.rstrip("/")
+        self.user = user
+        self.password = password
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = Retry(
+            total=API_RETRIES,
+            backoff_factor=0.2,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=None,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._logged_in = False
+        self._lock = threading.Lock()
+
+    def _login(self):
+        resp = self.session.post(
+            f"{self.url}/api/v2/auth/login",
+            data={"username": self.user, "password": self.password},
+            timeout=self.timeout,
+        )
+        resp.raise_for_status()
+        if resp.text.strip() != "Ok.":
+            raise QBLoginError("qBittorrent WebUI login failed")
+        self._logged_in = True
+        logging.debug("qBittorrent WebUI: logged in")
+
+    def login(self, force: bool = False):
+        """Log in unless a session cookie is already held (or ``force``)."""
+        with self._lock:
+            if force or not self._logged_in:
+                self._login()
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """Call ``/api/v2/<path>``, logging in first or again on 403."""
+        self.login()
+        kwargs.setdefault("timeout", self.timeout)
+        resp = self.session.request(method, f"{self.url}/api/v2/{path}", **kwargs)
+        if resp.status_code == 403:
+            self._logged_in = False
+            self.login(force=True)
+            resp = self.session.request(method, f"{self.url}/api/v2/{path}", **kwargs)
+        resp.raise_for_status()
+        return resp
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+_client: QBClient | None = None
+_client_lock = threading.Lock()
+
+
+def client(cfg: Config) -> QBClient:
+    """Return the shared :class:`QBClient` for ``cfg``'s WebUI and credentials."""
+    global _client
+    with _client_lock:
+        key = (cfg.qb_url.rstrip("/"), cfg.qb_user, cfg.qb_pass)
+        if _client is None or (_client.url, _client.user, _client.password) != key:
+            if _client is not None:
+                _client.close()
+            _client = QBClient(*key)
+        return _client
 
 
 def config_path() -> Path:
@@ -69,52 +198,319 @@ def config_path() -> Path:
 
     return Path.home() / ".config" / "qBittorrent" / "qBittorrent.conf"
 
-def update_port(cfg: Config, new_port: int):
+class TorrentTracker:
+    """Torrent hash -> fields map, updated from ``sync/maindata`` deltas.
+
+    qBittorrent answers each sync with only the torrents (and fields) that
+    changed since the response id ``rid`` we pass back, or a full update
+    when it cannot (first call, or the rid is too old).
+    """
+
+    def __init__(self, qb: QBClient):
+        self.qb = qb
+        self.rid = 0
+        self.torrents: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def sync(self) -> int:
+        """Fetch and apply one delta; return the number of torrents changed or removed."""
+        with self._lock:
+            data = self.qb.get("sync/maindata", params={"rid": self.rid}).json()
+            changed = data.get("torrents") or {}
+            removed = data.get("torrents_removed") or []
+            if data.get("full_update"):
+                self.torrents = {}
+            for h, fields in changed.items():
+                self.torrents.setdefault(h, {}).update(fields)
+            for h in removed:
+                self.torrents.pop(h, None)
+            self.rid = data.get("rid", self.rid)
+            return len(changed) + len(removed)
+
+    def count(self, states) -> int:
+        with self._lock:
+            return sum(1 for t in self.torrents.values() if t.get("state") in states)
+
+    def active(self) -> int:
+        """Number of torrents currently downloading or seeding."""
+        return self.count(ACTIVE_STATES)
+
+
+_tracker: TorrentTracker | None = None
+
+
+def tracker(cfg: Config) -> TorrentTracker:
+    """Return the shared :class:`TorrentTracker` for ``cfg``'s WebUI."""
+    global _tracker
+    qb = client(cfg)
+    with _client_lock:
+        if _tracker is None or _tracker.qb is not qb:
+            _tracker = TorrentTracker(qb)
+        return _tracker
+
+
+def active_torrents(cfg: Config) -> int:
+    """Sync the torrent map and return (and publish) the active torrent count."""
+    t = tracker(cfg)
+    t.sync()
+    active = t.active()
+    update_state(qb_active=active)
+    return active
+
+
+async def track_torrents(cfg: Config):
+    """Supervisor task: keep the torrent map and ``qb_active`` state current."""
+    def _sync() -> int:
+        t = tracker(cfg)
+        t.sync()
+        return t.active()
+
+    published = None
+    while True:
+        try:
+            active = await asyncio.to_thread(_sync)
+            if active != published:
+                update_state(qb_active=active)
+                published = active
+        except Exception as e:
+            logging.debug(f"Torrent sync failed: {e}")
+        await asyncio.sleep(TRACK_INTERVAL)
+
+
+def _torrents_action(qb: QBClient, names: tuple, hashes: list[str]):
+    """POST ``torrents/<name>`` for ``hashes``, trying each of ``names``.
+
+    qBittorrent 5 renamed pause/resume to stop/start; a 404 moves on to
+    the next name.
+    """
+    for name in names:
+        try:
+            qb.post(f"torrents/{name}", data={"hashes": "|".join(hashes)})
+            return
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 404 or name == names[-1]:
+                raise
+
+
+_paused: set[str] = set()
+_paused_lock = threading.Lock()
+
+
+def pause_transfers(cfg: Config) -> int:
+    """Pause every transferring torrent (remembered for :func:`resume_transfers`)."""
+    try:
+        t = tracker(cfg)
+        t.sync()
+        with t._lock:
+            hashes = [h for h, info in t.torrents.items() if info.get("state") not in INACTIVE_STATES]
+        if hashes:
+            _torrents_action(client(cfg), ("pause", "stop"), hashes)
+        with _paused_lock:
+            _paused.update(hashes)
+        logging.info(f"Paused {len(hashes)} torrents for rotation")
+        return len(hashes)
+    except requests.RequestException as e:
+        logging.warning(f"Could not pause torrents: {e}")
+        return 0
+
+
+def resume_transfers(cfg: Config) -> int:
+    """Resume the torrents :func:`pause_transfers` paused."""
+    with _paused_lock:
+        hashes = sorted(_paused)
+    if not hashes:
+        return 0
+    try:
+        _torrents_action(client(cfg), ("resume", "start"), hashes)
+    except requests.RequestException as e:
+        logging.warning(f"Could not resume paused torrents: {e}")
+        return 0
+    with _paused_lock:
+        _paused.difference_update(hashes)
+    logging.info(f"Resumed {len(hashes)} torrents")
+    return len(hashes)
+
+
+def reannounce_order(torrents: dict[str, dict]) -> list[str]:
+    """Hashes worth reannouncing, most active first (transferring, then by speed and recency)."""
+    def key(h: str):
+        t = torrents[h]
+        return (
+            t.get("state") not in ACTIVE_STATES,
+            -(t.get("upspeed", 0) + t.get("dlspeed", 0)),
+            -(t.get("num_leechs", 0) + t.get("num_seeds", 0)),
+            -t.get("last_activity", 0),
+        )
+
+    return sorted((h for h, t in torrents.items() if t.get("state") not in INACTIVE_STATES), key=key)
+
+
+async def reannounce(cfg: Config):
+    """Supervisor task: reannounce torrents after a port change.
+
+    Trackers otherwise keep handing out the old port until their next
+    announce interval. Requests carry REANNOUNCE_BATCH torrents each and
+    are spaced REANNOUNCE_INTERVAL apart so trackers are not hammered.
+    """
+    qb = client(cfg)
+    t = tracker(cfg)
+    await asyncio.to_thread(t.sync)
+    with t._lock:
+        order = reannounce_order(t.torrents)
+    for i in range(0, len(order), REANNOUNCE_BATCH):
+        if i:
+            await asyncio.sleep(REANNOUNCE_INTERVAL)
+        batch = order[i:i + REANNOUNCE_BATCH]
+        await asyncio.to_thread(qb.post, "torrents/reannounce", data={"hashes": "|".join(batch)})
+    logging.info(f"Reannounced {len(order)} torrents")
+
+
+def _port_prefs(port: int) -> dict:
+    """Preferences pvpn wants: ``port`` fixed, qBittorrent's own mapping off."""
+    return {
+        "listen_port": port,
+        "random_port": False,
+        "upnp": False,
+        "use_natpmp": False,
+    }
+
+
+class PortReconciler:
+    """Desired-state holder for qBittorrent's listen port.
+
+    ``desired`` is what pvpn wants, ``applied`` the last preference set
+    qBittorrent was seen to hold. :meth:`reconcile` reads the actual
+    preferences (one GET) and posts ``setPreferences`` only for the keys
+    that differ.
+    """
+
+    def __init__(self, qb: QBClient):
+        self.qb = qb
+        self.desired: dict | None = None
+        self.applied: dict | None = None
+        self._lock = threading.Lock()
+
+    def want(self, port: int):
+        self.desired = _port_prefs(port)
+
+    def in_sync(self) -> bool:
+        """Whether the desired preferences were already applied (no request made)."""
+        return self.desired is not None and self.applied == self.desired
+
+    def reconcile(self) -> dict:
+        """Apply whatever drifted from ``desired``; return the keys changed."""
+        with self._lock:
+            if self.desired is None:
+                return {}
+            desired = dict(self.desired)
+            actual = self.qb.get("app/preferences").json()
+            changes = {k: v for k, v in desired.items() if actual.get(k) != v}
+            if changes:
+                self.qb.post("app/setPreferences", data={"json": json.dumps(changes)})
+            self.applied = desired
+            return changes
+
+
+_reconciler: PortReconciler | None = None
+
+
+def reconciler(cfg: Config) -> PortReconciler:
+    """Return the shared :class:`PortReconciler`, bound to ``cfg``'s WebUI client."""
+    global _reconciler
+    qb = client(cfg)
+    with _client_lock:
+        if _reconciler is None:
+            _reconciler = PortReconciler(qb)
+        _reconciler.qb = qb
+        return _reconciler
+
+
+def _port_applied(cfg: Config, port: int, moved: bool):
+    """Follow-up once qBittorrent listens on ``port``; ``moved`` reannounces."""
+    update_state(qb_port=port)
+    emit(QB_PORT_APPLIED, port=port)
+    resume_transfers(cfg)
+    from pvpn.supervisor import spawn
+
+    spawn("resume", _resume_torrents(cfg))
+    if moved:
+        spawn("reannounce", reannounce(cfg))
+
+
+async def reconcile_port(cfg: Config):
+    """Supervisor task: re-apply the desired port when qBittorrent drifts.
+
+    A qBittorrent restart or a manual change in its WebUI is noticed
+    within RECONCILE_INTERVAL seconds.
+    """
+    r = reconciler(cfg)
+    while True:
+        await asyncio.sleep(RECONCILE_INTERVAL)
+        try:
+            changes = await asyncio.to_thread(r.reconcile)
+        except requests.RequestException as e:
+            logging.debug(f"qBittorrent port check failed: {e}")
+            continue
+        if changes:
+            port = r.desired["listen_port"]
+            logging.warning(f"qBittorrent drifted ({', '.join(sorted(changes))}); listen_port restored to {port}")
+            _port_applied(cfg, port, "listen_port" in changes)
+
+
+def update_port(cfg: Config, new_port: int, quiet: bool = False) -> bool:
     """
     Update qBittorrent's listen port to ``new_port`` via the WebUI API.
-    If the WebUI is disabled or ``new_port`` is falsy, skip the update.
+    If the WebUI is disabled or ``new_port`` is falsy, skip the update;
+    if the port is already applied (see :class:`PortReconciler`), skip it
+    without a request.
+    Returns whether the port was applied; ``quiet`` logs failures at debug.
     """
     if not cfg.qb_enable:
         logging.warning("qBittorrent WebUI disabled; skipping port update")
-        return
+        return False
 
     if not new_port or new_port <= 0:
         logging.warning("No forwarded port provided; skipping qBittorrent update")
-        return
+        return False
 
-    session = requests.Session()
+    r = reconciler(cfg)
+    r.want(new_port)
     try:
-        logging.info("Updating qBittorrent port via WebUI API")
-        resp = session.post(
-            f"{cfg.qb_url}/api/v2/auth/login",
-            data={"username": cfg.qb_user, "password": cfg.qb_pass},
-            timeout=10,
-        )
-        resp.raise_for_status()
-        if resp.text.strip() != "Ok.":
-            logging.error("qBittorrent WebUI login failed")
-            return
-
-        prefs = {
-            "listen_port": new_port,
-            "random_port": False,
-            "upnp": False,
-            "use_natpmp": False,
-        }
-        r2 = session.post(
-            f"{cfg.qb_url}/api/v2/app/setPreferences",
-            json=prefs,
-            timeout=10,
-        )
-        r2.raise_for_status()
+        changes = {} if r.in_sync() else r.reconcile()
+        if not changes:
+            logging.debug(f"qBittorrent already listens on {new_port}; skipping update")
+            update_state(qb_port=new_port)
+            resume_transfers(cfg)
+            return True
         logging.info(f"WebUI API: listen_port set to {new_port}")
-        _resume_torrents(cfg, session)
+        _port_applied(cfg, new_port, "listen_port" in changes)
+        return True
+    except QBLoginError as e:
+        logging.error(str(e))
     except requests.RequestException as e:
-        logging.error(f"WebUI API update failed: {e}")
-    finally:
-        close = getattr(session, "close", None)
-        if close:
-            close()
+        (logging.debug if quiet else logging.error)(f"WebUI API update failed: {e}")
+    return False
+
+
+async def apply_port(cfg: Config, port: int, ready=None):
+    """Supervisor task: push ``port`` to qBittorrent once its WebUI answers.
+
+    ``ready`` is an optional ``concurrent.futures.Future`` (the service
+    start) to wait for first. Retries every APPLY_RETRY seconds for up to
+    APPLY_TIMEOUT while qbittorrent-nox is still starting.
+    """
+    if ready is not None:
+        try:
+            await asyncio.wrap_future(ready)
+        except Exception as e:
+            logging.error(f"qbittorrent-nox start failed: {e}")
+    deadline = time.monotonic() + APPLY_TIMEOUT
+    while not await asyncio.to_thread(update_port, cfg, port, True):
+        if time.monotonic() >= deadline:
+            logging.error(f"qBittorrent WebUI did not accept port {port} within {APPLY_TIMEOUT}s")
+            await asyncio.to_thread(resume_transfers, cfg)
+            return
+        await asyncio.sleep(APPLY_RETRY)
 
 
 def get_listen_port(cfg: Config) -> int:
@@ -129,24 +525,13 @@ def get_listen_port(cfg: Config) -> int:
 
     # 1. WebUI API
     if cfg.qb_enable:
-        session = requests.Session()
         try:
-            session.post(
-                f"{cfg.qb_url}/api/v2/auth/login",
-                data={'username': cfg.qb_user, 'password': cfg.qb_pass},
-                timeout=5,
-            ).raise_for_status()
-            resp = session.get(f"{cfg.qb_url}/api/v2/app/preferences", timeout=5)
-            resp.raise_for_status()
+            resp = client(cfg).get("app/preferences", timeout=5)
             port = int(resp.json().get('listen_port') or 0)
             if port:
                 return port
         except requests.RequestException as e:
             logging.debug(f"WebUI API port query failed: {e}")
-        finally:
-            close = getattr(session, "close", None)
-            if close:
-                close()
 
     # 2. Config file
     try:
@@ -189,35 +574,54 @@ def get_listen_port(cfg: Config) -> int:
     return cfg.qb_port
 
 
-def _resume_torrents(cfg: Config, session: requests.Session):
+async def _resume_torrents(cfg: Config):
     """
-    Wait up to RESUME_TIMEOUT; if no active downloads, send resumeAll via WebUI.
+    Supervisor task: wait up to RESUME_TIMEOUT; if no active downloads,
+    send resumeAll via WebUI.
     """
+    qb = client(cfg)
+    torrents = tracker(cfg)
+
+    def _busy():
+        torrents.sync()
+        return torrents.count(BUSY_STATES)
+
+    def _resume_all():
+        _torrents_action(qb, ("resume", "start"), ["all"])
+
     logging.info("Waiting to resume any stalled torrents")
     start = time.time()
     while time.time() - start < RESUME_TIMEOUT:
-        time.sleep(POLL_INTERVAL)
+        await asyncio.sleep(POLL_INTERVAL)
         try:
-            resp = session.get(f"{cfg.qb_url}/api/v2/torrents/info", timeout=10)
-            resp.raise_for_status()
-            torrents = resp.json()
-            if any(t.get('state') in ('downloading', 'queued') for t in torrents):
+            if await asyncio.to_thread(_busy):
                 logging.info("Active torrents detected; not resuming")
                 return
         except Exception as e:
             logging.debug(f"Error checking torrents: {e}")
 
     try:
-        session.post(f"{cfg.qb_url}/api/v2/torrents/resumeAll", timeout=10).raise_for_status()
+        await asyncio.to_thread(_resume_all)
         logging.info("Sent resumeAll to qBittorrent WebUI")
     except Exception as e:
         logging.error(f"Failed to resume torrents: {e}")
 
 
+def service_cgroup() -> str:
+    """Return the cgroup v2 path of the qbittorrent-nox unit (relative to the cgroup root)."""
+    try:
+        path = run_cmd(["systemctl", "show", "-p", "ControlGroup", "--value", QB_UNIT]).strip()
+        if path:
+            return path.lstrip("/")
+    except Exception as e:
+        logging.debug(f"Could not read the {QB_UNIT} cgroup: {e}")
+    return f"system.slice/{QB_UNIT}.service"
+
+
 def start_service():
     """Start the qbittorrent-nox systemd service."""
     try:
-        run_cmd(["systemctl", "start", "qbittorrent-nox"], capture_output=False)
+        run_cmd(["systemctl", "start", QB_UNIT], capture_output=False)
         logging.info("Started qbittorrent-nox service")
     except Exception as e:
         logging.error(f"Failed to start qbittorrent-nox: {e}")
@@ -226,7 +630,7 @@ def start_service():
 def stop_service():
     """Stop the qbittorrent-nox systemd service."""
     try:
-        run_cmd(["systemctl", "stop", "qbittorrent-nox"], capture_output=False)
+        run_cmd(["systemctl", "stop", QB_UNIT], capture_output=False)
         logging.info("Stopped qbittorrent-nox service")
     except Exception as e:
         logging.error(f"Failed to stop qbittorrent-nox: {e}")
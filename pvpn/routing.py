@@ -2,62 +2,554 @@
 
 """
 Manage routing controls:
-- iptables-based kill-switch
+- kill-switch: an nftables table owned by pvpn (one atomic ``nft -f``
+  transaction to install, one table delete to remove), with the
+  iptables rules as fallback where ``nft`` is unavailable
+- parse_allowlist: LAN networks and ports exempt from the kill-switch,
+  matched through sets (one lookup per packet, however long the list)
+- allow_endpoint: open the kill-switch for a new WireGuard endpoint
+- allow_interface / revoke_interface: kill-switch accept rule per tunnel
+- switch_route: move every route using one interface to another
+- install_policy / remove_policy: wg-quick style full-tunnel policy
+  routing (fwmark rules installed once, a default route per tunnel), or
+  in split mode only the traffic marked by split_match
+- set_tunnel_route: point the tunnel table's default route at a tunnel
 """
 
 import os
+import shutil
+import socket
 import logging
+import ipaddress
 import subprocess
+from typing import NamedTuple
 
 from pvpn.utils import run_cmd, check_root
+from pvpn.events import emit, KILLSWITCH
 
-def enable_killswitch(iface: str):
+IPTABLES_BAK = "/etc/pvpn-iptables.bak"
+# nftables table holding the whole kill-switch; nothing else is touched
+NFT_FAMILY = "inet"
+NFT_TABLE = "pvpn"
+# ipset used for the LAN allowlist by the iptables fallback
+IPSET_LAN = "pvpn-lan"
+# Full-tunnel policy routing: everything not carrying FWMARK (which
+# WireGuard sets on its own encrypted packets, exempting the endpoint)
+# is looked up in TUNNEL_TABLE. The main table is consulted first with
+# its default route suppressed, so LAN and other specific routes still win.
+FWMARK = 51820
+TUNNEL_TABLE = 51820
+RULE_PRIORITY = 32764   # suppress rule; the fwmark rule follows at +1
+# Split tunnel: only packets the kill-switch table marks with SPLIT_MARK
+# (qbittorrent-nox, by cgroup or uid) are looked up in TUNNEL_TABLE
+SPLIT_MARK = 51821
+CGROUP_ROOT = "/sys/fs/cgroup"
+SRC_VALID_MARK = "/proc/sys/net/ipv4/conf/all/src_valid_mark"
+
+
+class Allowlist(NamedTuple):
+    """Traffic let past the kill-switch without the tunnel."""
+    lan4: list[str]
+    lan6: list[str]
+    ports: list[tuple[str, int]]   # (tcp|udp, port); empty means any port
+
+    def __bool__(self) -> bool:
+        return bool(self.lan4 or self.lan6)
+
+
+def parse_allowlist(cidrs=(), ports=()) -> Allowlist:
+    """
+    Build an :class:`Allowlist` from ``[network] allow_lan`` CIDRs and
+    ``allow_ports`` entries (``445/tcp``, ``2049/udp``, ``microsoft-ds``;
+    TCP when no protocol is given). Invalid entries are logged and skipped.
+    """
+    lan4, lan6, allowed = [], [], []
+    for cidr in cidrs:
+        try:
+            net = ipaddress.ip_network(cidr, strict=False)
+        except ValueError:
+            logging.warning(f"Ignoring invalid allow_lan entry {cidr!r}")
+            continue
+        (lan4 if net.version == 4 else lan6).append(str(net))
+    for entry in ports:
+        name, _, proto = entry.partition("/")
+        proto = (proto or "tcp").lower()
+        try:
+            if proto not in ("tcp", "udp"):
+                raise ValueError(proto)
+            port = int(name) if name.isdigit() else socket.getservbyname(name, proto)
+            if not 0 < port < 65536:
+                raise ValueError(port)
+        except (OSError, ValueError):
+            logging.warning(f"Ignoring invalid allow_ports entry {entry!r}")
+            continue
+        allowed.append((proto, port))
+    return Allowlist(lan4, lan6, allowed)
+
+
+def nft_ruleset(iface: str, allow: Allowlist | None = None, split: str | None = None) -> str:
+    """
+    Return the ``nft -f`` script installing the kill-switch for ``iface``
+    and the LAN ``allow`` list. Declaring and deleting the table first
+    makes the batch replace any earlier pvpn table within the same
+    transaction.
+
+    With ``split`` (an expression from :func:`split_match`) only the
+    matching traffic is confined: it is marked with SPLIT_MARK for the
+    policy rules, masqueraded onto the tunnel address, and dropped unless
+    it leaves through the tunnel, loopback or the LAN allowlist. Everything
+    else passes untouched.
+    """
+    allow = allow or Allowlist([], [], [])
+    t = f"{NFT_FAMILY} {NFT_TABLE}"
+
+    def elements(items) -> str:
+        return f"\n        elements = {{ {', '.join(items)} }}" if items else ""
+
+    lan_match = "meta l4proto . th dport @lan_ports accept" if allow.ports else "accept"
+    if split:
+        confine = f"""    chain mark {{
+        type route hook output priority mangle; policy accept;
+        {split} meta mark set {SPLIT_MARK}
+    }}
+    chain nat {{
+        type nat hook postrouting priority srcnat; policy accept;
+        meta mark {SPLIT_MARK} oifname @ifaces masquerade
+    }}
+    chain output {{
+        type filter hook output priority 0; policy accept;
+        meta mark != {SPLIT_MARK} accept
+        oifname "lo" accept
+        oifname @ifaces accept
+        ip daddr @lan4 ct direction reply accept
+        ip6 daddr @lan6 ct direction reply accept
+        ip daddr @lan4 {lan_match}
+        ip6 daddr @lan6 {lan_match}
+        drop
+    }}"""
+    else:
+        confine = f"""    chain output {{
+        type filter hook output priority 0; policy drop;
+        oifname "lo" accept
+        oifname @ifaces accept
+        ct state established,related accept
+        ip daddr . udp dport @endpoints4 accept
+        ip6 daddr . udp dport @endpoints6 accept
+        ip daddr @lan4 {lan_match}
+        ip6 daddr @lan6 {lan_match}
+    }}"""
+    return f"""table {t}
+delete table {t}
+table {t} {{
+    set ifaces {{
+        type ifname
+        elements = {{ "{iface}" }}
+    }}
+    set endpoints4 {{
+        type ipv4_addr . inet_service
+    }}
+    set endpoints6 {{
+        type ipv6_addr . inet_service
+    }}
+    set lan4 {{
+        type ipv4_addr
+        flags interval{elements(allow.lan4)}
+    }}
+    set lan6 {{
+        type ipv6_addr
+        flags interval{elements(allow.lan6)}
+    }}
+    set lan_ports {{
+        type inet_proto . inet_service{elements([f"{p} . {n}" for p, n in allow.ports])}
+    }}
+{confine}
+}}
+"""
+
+
+def _nft(script: str):
+    run_cmd(["nft", "-f", "-"], input_text=script)
+
+
+def _nft_active() -> bool:
+    """Return True if pvpn's nftables table is installed."""
+    if shutil.which("nft") is None:
+        return False
+    try:
+        run_cmd(["nft", "list", "table", NFT_FAMILY, NFT_TABLE])
+        return True
+    except Exception:
+        return False
+
+
+def _backend() -> str | None:
+    """Return the backend of the active kill-switch: ``"nft"``, ``"iptables"`` or ``None``."""
+    if _nft_active():
+        return "nft"
+    if os.path.exists(IPTABLES_BAK):
+        return "iptables"
+    return None
+
+
+def _split_endpoint(endpoint: str) -> tuple[str, str]:
+    """Split ``host:port`` or ``[v6]:port`` into host and port."""
+    host, port = endpoint.rsplit(":", 1)
+    return host.strip("[]"), port
+
+
+def _ipset_lan(allow: Allowlist) -> list[str]:
+    """Load ``allow``'s IPv4 networks into IPSET_LAN; return the iptables match."""
+    if allow.ports:
+        kind = "hash:net,port"
+        entries = [f"{net},{proto}:{port}" for net in allow.lan4 for proto, port in allow.ports]
+        match = "dst,dst"
+    else:
+        kind, entries, match = "hash:net", allow.lan4, "dst"
+    try:
+        run_cmd(["ipset", "destroy", IPSET_LAN])
+    except Exception:
+        pass  # not there yet
+    batch = "".join(f"add {IPSET_LAN} {e}\n" for e in entries)
+    run_cmd(["ipset", "restore"], input_text=f"create {IPSET_LAN} {kind}\n{batch}")
+    return ["-m", "set", "--match-set", IPSET_LAN, match]
+
+
+def _iptables_lan_rules(allow: Allowlist) -> list[list[str]]:
+    """iptables OUTPUT rule specs accepting ``allow``'s IPv4 networks."""
+    if not allow.lan4:
+        return []
+    if shutil.which("ipset"):
+        try:
+            return [[*_ipset_lan(allow), "-j", "ACCEPT"]]
+        except Exception as e:
+            logging.warning(f"ipset unavailable ({e}); using one rule per LAN entry")
+    if not allow.ports:
+        return [["-d", net, "-j", "ACCEPT"] for net in allow.lan4]
+    return [
+        ["-d", net, "-p", proto, "--dport", str(port), "-j", "ACCEPT"]
+        for net in allow.lan4 for proto, port in allow.ports
+    ]
+
+
+def split_match(cgroup: str | None = None, uid: int | None = None) -> str:
+    """
+    Return the nft expression selecting split-tunnel traffic: sockets of
+    ``uid``, else sockets in the cgroup v2 ``cgroup`` (e.g.
+    ``system.slice/qbittorrent-nox.service``). nft resolves a cgroup when
+    the rule is loaded, so the directory is created up front; systemd
+    adopts it when the unit starts, and the unit's first packet is matched.
+    """
+    if uid is not None:
+        return f"meta skuid {uid}"
+    path = cgroup.strip("/")
+    try:
+        os.makedirs(os.path.join(CGROUP_ROOT, path), exist_ok=True)
+    except OSError as e:
+        logging.warning(f"Could not create cgroup {path}: {e}")
+    return f'socket cgroupv2 level {path.count("/") + 1} "{path}"'
+
+
+def enable_killswitch(iface: str, allow: Allowlist | None = None, split: str | None = None):
     """
-    Enable a strict iptables kill-switch:
-      - backup current rules
-      - DROP all OUTPUT except on VPN interface and loopback
+    Enable a strict kill-switch: DROP all OUTPUT except on the VPN
+    interface, loopback and the LAN ``allow`` list. With ``split`` (see
+    :func:`split_match`) only that traffic class is confined. Uses nftables
+    when available, else backs up the iptables rules and changes them in
+    place (confining everything, as split mode needs nftables).
     """
     check_root()
-    bak = "/etc/pvpn-iptables.bak"
+    allow = allow or Allowlist([], [], [])
+    if shutil.which("nft"):
+        try:
+            _nft(nft_ruleset(iface, allow, split))
+            logging.info(f"Kill-switch enabled (nftables{', split tunnel' if split else ''})")
+            emit(KILLSWITCH, enabled=True, interface=iface)
+            return
+        except Exception as e:
+            logging.warning(f"nftables kill-switch failed ({e}); falling back to iptables")
+    if split:
+        logging.warning("Split tunnel needs nftables; the iptables kill-switch confines all traffic")
+    bak = IPTABLES_BAK
     try:
         result = subprocess.run(["iptables-save"], check=True, stdout=subprocess.PIPE)
         with open(bak, "w") as f:
             f.write(result.stdout.decode())
+        if allow.lan6:
+            logging.warning("iptables kill-switch: IPv6 allow_lan entries are not applied")
+        # Accept rules go in before the DROP policy so nothing allowed is cut off
+        for rule in (
+            ["-o", iface, "-j", "ACCEPT"],
+            ["-o", "lo", "-j", "ACCEPT"],
+            ["-m", "conntrack", "--ctstate", "ESTABLISHED,RELATED", "-j", "ACCEPT"],
+            *_iptables_lan_rules(allow),
+        ):
+            run_cmd(["iptables", "-A", "OUTPUT", *rule], capture_output=False)
         run_cmd(["iptables", "-P", "OUTPUT", "DROP"], capture_output=False)
-        run_cmd(["iptables", "-A", "OUTPUT", "-o", iface, "-j", "ACCEPT"], capture_output=False)
-        run_cmd(["iptables", "-A", "OUTPUT", "-o", "lo", "-j", "ACCEPT"], capture_output=False)
-        run_cmd([
-            "iptables", "-A", "OUTPUT", "-m", "conntrack",
-            "--ctstate", "ESTABLISHED,RELATED", "-j", "ACCEPT",
-        ], capture_output=False)
         logging.info("Kill-switch enabled")
+        emit(KILLSWITCH, enabled=True, interface=iface)
     except Exception as e:
         logging.error(f"Failed to enable kill-switch: {e}")
 
 def disable_killswitch():
     """
-    Disable the kill-switch by restoring iptables from backup.
+    Disable the kill-switch: delete pvpn's nftables table, or restore
+    iptables from backup for the fallback backend.
     """
     check_root()
-    bak = "/etc/pvpn-iptables.bak"
+    if _nft_active():
+        try:
+            run_cmd(["nft", "delete", "table", NFT_FAMILY, NFT_TABLE])
+            logging.info("Kill-switch disabled, nftables table removed")
+            emit(KILLSWITCH, enabled=False, interface=None)
+        except Exception as e:
+            logging.error(f"Failed to remove nftables table: {e}")
+        return
+    bak = IPTABLES_BAK
     if os.path.exists(bak):
         try:
             with open(bak) as f:
                 run_cmd(["iptables-restore"], capture_output=False, input_text=f.read())
             logging.info("Kill-switch disabled, iptables restored")
+            emit(KILLSWITCH, enabled=False, interface=None)
         except Exception as e:
             logging.error(f"Failed to restore iptables: {e}")
+        try:
+            run_cmd(["ipset", "destroy", IPSET_LAN])
+        except Exception:
+            pass  # no allowlist set was created
     else:
         logging.warning("No iptables backup found; cannot disable kill-switch")
 
 
 def killswitch_status() -> bool:
     """Return True if the kill-switch appears active."""
+    if _nft_active():
+        return True
     try:
         rules = run_cmd(["iptables", "-S", "OUTPUT"])
-        if "-P OUTPUT DROP" in rules and os.path.exists("/etc/pvpn-iptables.bak"):
+        if "-P OUTPUT DROP" in rules and os.path.exists(IPTABLES_BAK):
             return True
     except Exception as e:
         logging.error(f"Failed to check kill-switch: {e}")
     return False
 
+
+def allow_endpoint(endpoint: str):
+    """
+    Let WireGuard reach ``endpoint`` (host:port) while the kill-switch is on.
+    Needed after an in-place peer swap: the new endpoint has no ESTABLISHED
+    conntrack entry, so its handshake would otherwise be dropped.
+    """
+    check_root()
+    backend = _backend()
+    if not backend or not endpoint:
+        return
+    host, port = _split_endpoint(endpoint)
+    try:
+        if backend == "nft":
+            family = "6" if ":" in host else "4"
+            run_cmd([
+                "nft", "add", "element", NFT_FAMILY, NFT_TABLE, f"endpoints{family}", f"{{ {host} . {port} }}",
+            ])
+        elif ":" in host:
+            return  # the iptables fallback only manages IPv4
+        else:
+            run_cmd([
+                "iptables", "-I", "OUTPUT", "-d", host, "-p", "udp", "--dport", port, "-j", "ACCEPT",
+            ], capture_output=False)
+        logging.info(f"Kill-switch: allowed WireGuard endpoint {endpoint}")
+    except Exception as e:
+        logging.error(f"Failed to allow endpoint {endpoint}: {e}")
+
+
+def allow_interface(iface: str):
+    """Accept output on ``iface`` while the kill-switch is on (no-op otherwise)."""
+    check_root()
+    backend = _backend()
+    try:
+        if backend == "nft":
+            run_cmd(["nft", "add", "element", NFT_FAMILY, NFT_TABLE, "ifaces", f'{{ "{iface}" }}'])
+        elif backend == "iptables":
+            run_cmd(["iptables", "-I", "OUTPUT", "-o", iface, "-j", "ACCEPT"], capture_output=False)
+    except Exception as e:
+        logging.error(f"Failed to allow {iface} through kill-switch: {e}")
+
+
+def revoke_interface(iface: str):
+    """Remove the kill-switch accept rule(s) for ``iface``."""
+    check_root()
+    backend = _backend()
+    try:
+        if backend == "nft":
+            run_cmd(["nft", "delete", "element", NFT_FAMILY, NFT_TABLE, "ifaces", f'{{ "{iface}" }}'])
+        elif backend == "iptables":
+            while True:
+                run_cmd(["iptables", "-D", "OUTPUT", "-o", iface, "-j", "ACCEPT"], capture_output=False)
+    except Exception:
+        pass  # no (more) matching rules
+
+
+def switch_route(old_iface: str, new_iface: str):
+    """
+    Re-point every route that uses ``old_iface`` (any table) at ``new_iface``
+    in place, so traffic moves with one route replace per entry.
+    """
+    check_root()
+    try:
+        from pvpn import netlink
+
+        rt = netlink.route()
+        old = rt.link_index(old_iface)
+        for family in (socket.AF_INET, socket.AF_INET6):
+            for route in rt.routes(family):
+                if route["oif"] != old or route["table"] == netlink.RT_TABLE_LOCAL:
+                    continue
+                if route["dst"].startswith("fe80:"):
+                    continue  # link-local routes belong to each interface
+                rt.set_route(route["dst"], new_iface, route["gateway"], route["table"])
+        logging.info(f"Routes moved from {old_iface} to {new_iface}")
+        return
+    except Exception as e:
+        logging.debug(f"netlink route switch failed ({e}); using ip")
+    for family in ("-4", "-6"):
+        out = run_cmd(["ip", family, "-o", "route", "show", "table", "all", "dev", old_iface])
+        for line in out.splitlines():
+            fields = line.split()
+            if not fields or fields[0] in ("local", "broadcast", "multicast", "anycast") or "fe80::" in fields[0]:
+                continue
+            run_cmd(["ip", family, "route", "replace", *fields, "dev", new_iface])
+    logging.info(f"Routes moved from {old_iface} to {new_iface}")
+
+
+def _policy_rules(split: bool = False) -> list[dict]:
+    """The two rules of :func:`install_policy`, as :meth:`netlink.Route.add_rule` arguments.
+
+    Full tunnel: everything without WireGuard's FWMARK; split: only SPLIT_MARK.
+    """
+    from pvpn.netlink import RT_TABLE_MAIN
+
+    tunnel = {"table": TUNNEL_TABLE, "priority": RULE_PRIORITY + 1}
+    tunnel.update({"fwmark": SPLIT_MARK} if split else {"fwmark": FWMARK, "invert": True})
+    return [{"table": RT_TABLE_MAIN, "priority": RULE_PRIORITY, "suppress_prefixlen": 0}, tunnel]
+
+
+def _rule_matches(rule: dict, spec: dict) -> bool:
+    return all(rule.get(k) == spec.get(k, d) for k, d in
+               (("table", None), ("fwmark", None), ("invert", False), ("suppress_prefixlen", None)))
+
+
+def _families(iface: str) -> list[int]:
+    """Address families tunnelled by ``iface`` (IPv6 only if it has an IPv6 address)."""
+    try:
+        from pvpn import netlink
+
+        if any(":" in a for a in netlink.route().addresses(iface)):
+            return [socket.AF_INET, socket.AF_INET6]
+    except Exception:
+        pass
+    return [socket.AF_INET]
+
+
+def set_tunnel_route(iface: str, gateway: str | None = None):
+    """Point TUNNEL_TABLE's default route(s) at ``iface`` (via ``gateway`` for IPv4)."""
+    check_root()
+    for family in _families(iface):
+        dst, via = ("default", gateway) if family == socket.AF_INET else ("::/0", None)
+        try:
+            from pvpn import netlink
+
+            netlink.route().set_route(dst, iface, via, TUNNEL_TABLE)
+            continue
+        except Exception as e:
+            logging.debug(f"netlink tunnel route failed ({e}); using ip")
+        cmd = ["ip", "-6" if family == socket.AF_INET6 else "-4", "route", "replace", dst]
+        if via:
+            cmd += ["via", via]
+        run_cmd(cmd + ["dev", iface, "table", str(TUNNEL_TABLE)])
+
+
+def _ensure_rules(family: int, split: bool = False):
+    """Add whichever policy rules are missing for ``family``, replacing ones of the other mode."""
+    try:
+        from pvpn import netlink
+
+        rt = netlink.route()
+        existing = rt.rules(family)
+        for spec in _policy_rules(split):
+            at = [r for r in existing if r["priority"] == spec["priority"]]
+            if any(_rule_matches(r, spec) for r in at):
+                continue
+            for stale in at:
+                if stale["table"] in (TUNNEL_TABLE, netlink.RT_TABLE_MAIN):
+                    rt.del_rule(family, stale["table"], stale["priority"], stale["fwmark"],
+                                stale["invert"], stale["suppress_prefixlen"])
+            rt.add_rule(family, **spec)
+        return
+    except Exception as e:
+        logging.debug(f"netlink rule setup failed ({e}); using ip")
+    flag = "-6" if family == socket.AF_INET6 else "-4"
+    existing = run_cmd(["ip", flag, "rule", "show"])
+    mark = SPLIT_MARK if split else FWMARK
+    selector = ["fwmark", str(mark)] if split else ["not", "fwmark", str(mark)]
+    # e.g. "32765:	not from all fwmark 0xca6c lookup 51820"
+    rules = [line for line in existing.splitlines() if f"lookup {TUNNEL_TABLE}" in line]
+    if not any(f"fwmark {hex(mark)} " in r and r.split(":", 1)[1].strip().startswith("not") != split for r in rules):
+        if rules:
+            run_cmd(["ip", flag, "rule", "del", "priority", str(RULE_PRIORITY + 1)])
+        run_cmd(["ip", flag, "rule", "add", *selector, "table", str(TUNNEL_TABLE),
+                 "priority", str(RULE_PRIORITY + 1)])
+    if "suppress_prefixlength 0" not in existing:
+        run_cmd(["ip", flag, "rule", "add", "table", "main", "suppress_prefixlength", "0",
+                 "priority", str(RULE_PRIORITY)])
+
+
+def install_policy(iface: str, gateway: str | None = None, split: bool = False) -> bool:
+    """
+    Send all traffic (or with ``split``, only SPLIT_MARK traffic) through
+    ``iface``: set TUNNEL_TABLE's default route and make sure the fwmark
+    rules exist. The rules do not name the interface, so they survive
+    server rotation untouched; a swap or a standby promotion only changes
+    the table's default route.
+
+    Only the nftables kill-switch sets SPLIT_MARK, so without it split mode
+    falls back to full-tunnel rules. Returns whether split rules were used.
+    """
+    check_root()
+    if split and not _nft_active():
+        logging.warning("Split tunnel needs the nftables kill-switch; routing all traffic through the tunnel")
+        split = False
+    try:
+        set_tunnel_route(iface, gateway)
+        for family in _families(iface):
+            _ensure_rules(family, split)
+        try:
+            with open(SRC_VALID_MARK, "w") as f:
+                f.write("1")  # reverse-path filtering must honour the mark
+        except OSError as e:
+            logging.debug(f"Could not set src_valid_mark: {e}")
+        scope = "split-tunnel traffic" if split else "all traffic"
+        logging.info(f"Policy routing: {scope} via {iface} (table {TUNNEL_TABLE})")
+    except Exception as e:
+        logging.error(f"Failed to install policy routing for {iface}: {e}")
+    return split
+
+
+def remove_policy():
+    """Remove the fwmark rules; the table's routes go with their interface."""
+    check_root()
+    for family in (socket.AF_INET, socket.AF_INET6):
+        for spec in _policy_rules() + _policy_rules(split=True)[1:]:
+            try:
+                from pvpn import netlink
+
+                netlink.route().del_rule(family, **spec)
+                continue
+            except netlink.NetlinkError:
+                continue  # not installed
+            except Exception as e:
+                logging.debug(f"netlink rule delete failed ({e}); using ip")
+            try:
+                flag = "-6" if family == socket.AF_INET6 else "-4"
+                run_cmd(["ip", flag, "rule", "del", "priority", str(spec["priority"])])
+            except Exception:
+                pass  # not installed
@@ -0,0 +1,115 @@
+# pvpn/servers.py
+
+"""
+Select among the local WireGuard server configs (see :mod:`pvpn.catalog`):
+- filter_servers: restrict by country, SecureCore and P2P tags
+- probe_servers: measure RTT/loss to all endpoints concurrently
+- rank_servers: order candidates by loss, then median RTT
+- rank_with_history: rank by stored scores, probing only unknown servers
+"""
+
+from __future__ import annotations
+
+import re
+import logging
+import statistics
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from pvpn.catalog import Server
+
+# Echo requests sent to each endpoint
+PROBE_COUNT = 3
+# Upper bound on concurrent ping processes
+PROBE_WORKERS = 32
+# Hard deadline (seconds) for probing all candidates
+PROBE_DEADLINE = 10
+
+
+def filter_servers(servers: list[Server], cc: str | None = None,
+                   p2p: bool = False, sc: bool = False) -> list[Server]:
+    """Filter servers by country code, P2P and SecureCore flags."""
+    out = []
+    for s in servers:
+        if cc and s.country != cc.upper():
+            continue
+        if p2p and not s.p2p:
+            continue
+        if sc and not s.secure_core:
+            continue
+        out.append(s)
+    return out
+
+
+def _probe(host: str, count: int = PROBE_COUNT) -> tuple[float | None, float]:
+    """Ping ``host`` ``count`` times; return ``(median_rtt_ms, loss_ratio)``."""
+    try:
+        out = subprocess.run(
+            ["ping", "-n", "-c", str(count), "-i", "0.2", "-W", "1", host],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            timeout=count + 2,
+            text=True,
+        ).stdout
+    except Exception as e:
+        logging.debug(f"Probe of {host} failed: {e}")
+        return None, 1.0
+    rtts = [float(m) for m in re.findall(r"time[=<]([\d.]+)\s*ms", out)]
+    loss = 1.0 - min(len(rtts), count) / count
+    return (statistics.median(rtts) if rtts else None), loss
+
+
+def probe_servers(servers: list[Server], deadline: float = PROBE_DEADLINE,
+                  workers: int = PROBE_WORKERS) -> dict[str, tuple[float | None, float]]:
+    """Probe every distinct endpoint concurrently within ``deadline`` seconds.
+
+    Returns a mapping of server name to ``(median_rtt_ms, loss_ratio)``.
+    Servers without an endpoint, or whose probe misses the deadline, are
+    reported as unreachable (``(None, 1.0)``).
+    """
+    hosts = sorted({s.host for s in servers if s.endpoint})
+    by_host: dict[str, tuple[float | None, float]] = {}
+    if hosts:
+        pool = ThreadPoolExecutor(max_workers=min(workers, len(hosts)))
+        futures = {pool.submit(_probe, h): h for h in hosts}
+        done, pending = wait(futures, timeout=deadline)
+        pool.shutdown(wait=False, cancel_futures=True)
+        for fut in done:
+            try:
+                by_host[futures[fut]] = fut.result()
+            except Exception as e:
+                logging.debug(f"Probe of {futures[fut]} raised: {e}")
+        if pending:
+            logging.warning(f"{len(pending)} server probe(s) missed the {deadline}s deadline")
+    return {s.name: by_host.get(s.host, (None, 1.0)) if s.endpoint else (None, 1.0) for s in servers}
+
+
+def rank_servers(servers: list[Server],
+                 results: dict[str, tuple[float | None, float]]) -> list[Server]:
+    """Order servers best-first: reachable before unreachable, then loss, then RTT.
+
+    The sort is stable, so servers without measurements keep name order.
+    """
+    def key(s: Server):
+        rtt, loss = results.get(s.name, (None, 1.0))
+        return (rtt is None, round(loss, 2), rtt or 0.0)
+
+    return sorted(servers, key=key)
+
+
+def rank_with_history(servers: list[Server], history,
+                      deadline: float = PROBE_DEADLINE) -> list[Server]:
+    """Rank servers by their stored history score, probing only unknown ones.
+
+    Servers with a fresh score in ``history`` (:class:`pvpn.history.History`)
+    are not probed again; the rest are probed concurrently and the results
+    folded into the history before ranking.
+    """
+    scores = {s.name: history.score(s.name) for s in servers}
+    unknown = [s for s in servers if scores[s.name] is None]
+    if unknown:
+        for name, (rtt, loss) in probe_servers(unknown, deadline).items():
+            if rtt is not None:
+                history.record_probe(name, rtt, loss)
+                scores[name] = history.score(name)
+    return sorted(servers, key=lambda s: (scores[s.name] is None, scores[s.name] or 0.0))
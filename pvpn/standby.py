@@ -0,0 +1,207 @@
+# pvpn/standby.py
+
+"""
+Hot-standby tunnel for make-before-break server switching:
+- prepare: bring up a second interface to the next-best server, complete
+  its handshake and probe its NAT-PMP gateway, without routing traffic
+- promote: move routes and the kill-switch rule to the standby, make it the
+  active tunnel and retire the old interface
+- discard: tear the standby down (on disconnect)
+
+Enabled with ``standby = true`` in the ``[monitor]`` section. The standby
+is published in the state file under ``standby`` and re-prepared in the
+background after every connect, swap or promotion.
+"""
+
+from __future__ import annotations
+
+import os
+import time
+import asyncio
+import logging
+import threading
+
+# Seconds to wait for the standby's first handshake
+HANDSHAKE_WAIT = 5
+# Lease lifetime (seconds) requested when probing the standby's gateway
+PROBE_LIFETIME = 60
+
+_standby: dict | None = None
+_lock = threading.Lock()
+
+
+def current() -> dict | None:
+    """Return ``{interface, server, path, endpoint, gateway, forwarded_port, ready_at}`` or ``None``."""
+    with _lock:
+        return dict(_standby) if _standby else None
+
+
+def _set(value: dict | None):
+    global _standby
+    from pvpn.state import update_state
+
+    with _lock:
+        _standby = value
+    update_state(standby={k: v for k, v in value.items() if k != "path"} if value else None)
+
+
+def _wait_handshake(iface: str, gateway: str) -> bool:
+    """Trigger and wait for the first handshake on ``iface``."""
+    from pvpn.natpmp import request_mappings
+    from pvpn.wireguard import get_latest_handshake
+
+    deadline = time.monotonic() + HANDSHAKE_WAIT
+    while time.monotonic() < deadline:
+        if get_latest_handshake(iface):
+            return True
+        # Any packet into the tunnel starts the handshake; NAT-PMP is cheap
+        request_mappings(gateway, lifetime=0, deadline=0.25, iface=iface, quiet=True)
+    return bool(get_latest_handshake(iface))
+
+
+def prepare(cfg) -> dict | None:
+    """Bring up a standby tunnel to the best server other than the active one.
+
+    Replaces any previous standby. Returns the new standby, or ``None`` if
+    there is no other server or it could not be made ready.
+    """
+    from pvpn import protonvpn
+    from pvpn.state import read_state
+    from pvpn.history import get_history
+    from pvpn.servers import rank_with_history
+    from pvpn.natpmp import request_mappings
+    from pvpn.wireguard import bring_up, delete_iface, _primary_address
+
+    discard()
+    state = read_state()
+    active = state.get("server") or state.get("interface")
+    candidates = [
+        s for s in protonvpn._candidates(cfg, None)
+        if s.name not in (active, state.get("interface"))
+    ]
+    if not candidates:
+        logging.info("standby: no other server available")
+        return None
+    history = get_history(cfg)
+    server = rank_with_history(candidates, history)[0]
+    _, gateway = _primary_address(server.addresses, server.path)
+
+    killswitch = state.get("killswitch")
+    if killswitch:
+        from pvpn.routing import allow_endpoint
+
+        allow_endpoint(server.endpoint)
+    started = time.monotonic()
+    iface = bring_up(server.path, dns=False)
+    if killswitch:
+        from pvpn.routing import allow_interface
+
+        # The handshake trigger and NAT-PMP probe leave through the standby
+        allow_interface(iface)
+    try:
+        if not _wait_handshake(iface, gateway):
+            raise RuntimeError(f"no handshake with {server.name}")
+        mappings = request_mappings(gateway, lifetime=PROBE_LIFETIME, iface=iface)
+        mapping = mappings.get("udp") or mappings.get("tcp")
+    except Exception as e:
+        logging.warning(f"standby: {server.name} not usable: {e}")
+        delete_iface(iface)
+        if killswitch:
+            from pvpn.routing import revoke_interface
+
+            revoke_interface(iface)
+        return None
+    history.record_connect(server.name, time.monotonic() - started)
+    history.save()
+    standby = {
+        "interface": iface,
+        "server": server.name,
+        "path": server.path,
+        "endpoint": server.endpoint,
+        "gateway": gateway,
+        "forwarded_port": mapping.public_port if mapping else 0,
+        "ready_at": time.time(),
+    }
+    _set(standby)
+    logging.info(f"standby: {server.name} ready on {iface}")
+    return standby
+
+
+async def keep_ready(cfg):
+    """Supervisor task: prepare a standby in the background."""
+    await asyncio.to_thread(prepare, cfg)
+
+
+def promote(cfg, reason: str = "user") -> dict:
+    """Switch traffic to the standby tunnel and retire the active one.
+
+    The kill-switch rule for the standby (added by :func:`prepare`) is
+    re-asserted before routes move and the old one removed after, so
+    traffic is never blocked or leaked in between. Returns ``{interface, server, forwarded_port}``; raises
+    ``RuntimeError`` if no standby is ready.
+    """
+    from pvpn import events
+    from pvpn.state import read_state, update_state
+    from pvpn.history import get_history
+    from pvpn.routing import allow_interface, revoke_interface, switch_route
+    from pvpn.wireguard import delete_iface
+    from pvpn.supervisor import get_supervisor
+    from pvpn.natpmp import start_forward
+    from pvpn.qbittorrent import apply_port
+
+    standby = current()
+    if not standby:
+        raise RuntimeError("no standby tunnel ready")
+    state = read_state()
+    old_iface = state.get("interface")
+    old = state.get("server") or old_iface
+    new_iface = standby["interface"]
+
+    started = time.monotonic()
+    supervisor = get_supervisor()
+    supervisor.stop_session()
+    if state.get("killswitch"):
+        allow_interface(new_iface)
+    if old_iface:
+        switch_route(old_iface, new_iface)
+    _set(None)
+    update_state(
+        pid=os.getpid(),
+        interface=new_iface,
+        server=standby["server"],
+        endpoint=standby["endpoint"],
+        connected_at=time.time(),
+    )
+    events.emit(events.SERVER_ROTATED, old=old, new=standby["server"], reason=reason, mode="standby")
+    logging.info(f"standby: switched {old} -> {standby['server']} in {time.monotonic() - started:.3f}s")
+
+    history = get_history(cfg)
+    if old:
+        history.record_disconnect(old, reason)
+    if old_iface:
+        delete_iface(old_iface)
+        revoke_interface(old_iface)
+
+    pub_port = start_forward(new_iface)
+    history.record_natpmp(standby["server"], bool(pub_port))
+    history.save()
+    supervisor.start_session(cfg, new_iface, server=standby["server"])
+    if pub_port and cfg.qb_enable:
+        supervisor.spawn("qb_port", apply_port(cfg, pub_port))
+    return {"interface": new_iface, "server": standby["server"], "forwarded_port": pub_port}
+
+
+def discard():
+    """Tear down the standby tunnel, if any."""
+    standby = current()
+    if not standby:
+        return
+    from pvpn.state import read_state
+    from pvpn.wireguard import delete_iface
+
+    _set(None)
+    delete_iface(standby["interface"])
+    if read_state().get("killswitch"):
+        from pvpn.routing import revoke_interface
+
+        revoke_interface(standby["interface"])
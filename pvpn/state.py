@@ -0,0 +1,107 @@
+# pvpn/state.py
+
+"""
+Runtime state published by the process that owns the tunnel:
+- update_state: merge fields into the state file (atomic replace)
+- read_state: return the current state, or {} if its owner has exited
+- clear_state: remove the state file
+
+The file lives on tmpfs (``/run/pvpn/state.json``) so ``pvpn status`` can
+answer from it without touching the network, NAT-PMP or qBittorrent. The
+owning process also keeps the state in memory and reads it from there.
+"""
+
+from __future__ import annotations
+
+import os
+import json
+import logging
+import tempfile
+import threading
+
+STATE_DIR = "/run/pvpn"
+STATE_FILE = "state.json"
+
+_lock = threading.Lock()
+# Last state written by this process (None until it publishes anything)
+_current: dict | None = None
+
+
+def state_path() -> str:
+    return os.path.join(STATE_DIR, STATE_FILE)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _load() -> dict:
+    try:
+        with open(state_path()) as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logging.debug(f"Ignoring unreadable state file {state_path()}: {e}")
+        return {}
+
+
+def _write(data: dict):
+    os.makedirs(STATE_DIR, mode=0o755, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=STATE_DIR, prefix=".state.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, state_path())
+    except Exception:
+        os.unlink(tmp)
+        raise
+
+
+def update_state(**fields):
+    """Merge ``fields`` into the state file; failures are logged, not raised."""
+    global _current
+    with _lock:
+        data = dict(_current) if _current is not None else _load()
+        data.update(fields)
+        _current = data
+        try:
+            _write(data)
+        except Exception as e:
+            logging.debug(f"Failed to update state file: {e}")
+
+
+def read_state() -> dict:
+    """Return the published state, or ``{}`` if the publishing process is gone."""
+    with _lock:
+        if _current is not None and _current.get("pid") == os.getpid():
+            return dict(_current)
+    data = _load()
+    pid = data.get("pid")
+    if pid and not _pid_alive(int(pid)):
+        return {}
+    return data
+
+
+def clear_state(**keep):
+    """Remove the state file, optionally leaving ``keep`` fields behind."""
+    global _current
+    with _lock:
+        _current = dict(keep) if keep else None
+        try:
+            if keep:
+                _write(keep)
+            else:
+                os.unlink(state_path())
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.debug(f"Failed to clear state file: {e}")
@@ -0,0 +1,164 @@
+# pvpn/supervisor.py
+
+"""
+Single asyncio event loop owning pvpn's background work:
+- start_session: run the NAT-PMP refresher and connection monitor for a
+  tunnel, cancelling whatever the previous tunnel left running
+- stop_session: cancel the current tunnel's tasks (refresher, monitor,
+  qBittorrent port push, port reconciliation, resume, reannounce and
+  torrent tracking, standby preparation)
+- spawn: run a named coroutine, replacing any task of the same name
+
+The loop runs in one thread; blocking calls (ping, NAT-PMP, WebUI,
+connect/disconnect) go through a bounded executor, so the number of
+threads stays fixed however often the tunnel rotates. Every public method
+is safe to call from any thread.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import concurrent.futures
+
+# Threads available to blocking work scheduled from the loop
+EXECUTOR_WORKERS = 8
+# Tasks that belong to one tunnel and die with it
+SESSION_TASKS = (
+    "refresher", "monitor", "qb_port", "qb_reconcile", "resume", "reannounce", "standby", "torrents",
+)
+
+
+class Supervisor:
+    """An event loop thread plus the named tasks running on it."""
+
+    def __init__(self, workers: int = EXECUTOR_WORKERS):
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="pvpn-io")
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(self.executor)
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="pvpn-supervisor", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            self._stopped.set()
+
+    def call(self, fn, *args):
+        """Run the non-blocking ``fn(*args)`` on the loop thread and return its result."""
+        if threading.current_thread() is self._thread:
+            return fn(*args)
+        fut: concurrent.futures.Future = concurrent.futures.Future()
+
+        def _call():
+            try:
+                fut.set_result(fn(*args))
+            except BaseException as e:  # noqa: BLE001
+                fut.set_exception(e)
+
+        self.loop.call_soon_threadsafe(_call)
+        return fut.result()
+
+    def run(self, coro, timeout: float | None = None):
+        """Run ``coro`` on the loop and wait for its result (not from the loop thread)."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    async def _guard(self, name: str, coro):
+        try:
+            await coro
+        except asyncio.CancelledError:
+            logging.debug(f"supervisor: {name} cancelled")
+            raise
+        except Exception as e:
+            logging.error(f"supervisor: {name} failed: {e}")
+
+    def spawn(self, name: str, coro):
+        """Run ``coro`` as task ``name``, cancelling any task already using that name."""
+        def _spawn():
+            old = self._tasks.pop(name, None)
+            if old:
+                old.cancel()
+            task = self.loop.create_task(self._guard(name, coro), name=name)
+            self._tasks[name] = task
+            task.add_done_callback(lambda t: self._tasks.get(name) is t and self._tasks.pop(name))
+            # A task cancelled before its first step never awaited ``coro``
+            task.add_done_callback(lambda t: coro.close())
+
+        self.call(_spawn)
+
+    def cancel(self, *names: str):
+        def _cancel():
+            for name in names:
+                task = self._tasks.pop(name, None)
+                if task:
+                    task.cancel()
+
+        self.call(_cancel)
+
+    def running(self) -> list[str]:
+        return self.call(lambda: sorted(self._tasks))
+
+    def start_session(self, cfg, iface: str, server: str | None = None):
+        """Supervise the tunnel on ``iface`` (connected to ``server``):
+        NAT-PMP refresher, monitor, torrent tracking, qBittorrent port
+        reconciliation and, if enabled, a hot standby."""
+        from pvpn.natpmp import current_forwarder
+        from pvpn.monitor import monitor
+
+        self.stop_session()
+        forwarder = current_forwarder()
+        if forwarder:
+            self.spawn("refresher", forwarder.run())
+        self.spawn("monitor", monitor(cfg, iface, self, server))
+        if cfg.qb_enable:
+            from pvpn.qbittorrent import reconcile_port, track_torrents
+
+            self.spawn("torrents", track_torrents(cfg))
+            self.spawn("qb_reconcile", reconcile_port(cfg))
+        if getattr(cfg, "monitor_standby", False):
+            from pvpn.standby import keep_ready
+
+            self.spawn("standby", keep_ready(cfg))
+
+    def stop_session(self):
+        self.cancel(*SESSION_TASKS)
+
+    def wait(self):
+        """Block until :meth:`shutdown` (or ``KeyboardInterrupt``)."""
+        while not self._stopped.wait(1):
+            pass
+
+    def shutdown(self):
+        """Cancel every task and stop the loop."""
+        self.cancel(*self.call(lambda: list(self._tasks)))
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(5)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+_supervisor: Supervisor | None = None
+_supervisor_lock = threading.Lock()
+
+
+def get_supervisor() -> Supervisor:
+    """Return the process-wide :class:`Supervisor`, starting it on first use."""
+    global _supervisor
+    with _supervisor_lock:
+        if _supervisor is None or _supervisor._stopped.is_set():
+            _supervisor = Supervisor()
+        return _supervisor
+
+
+def spawn(name: str, coro):
+    get_supervisor().spawn(name, coro)
+
+
+def stop_session():
+    """Cancel the current tunnel's tasks, if a supervisor is running."""
+    if _supervisor is not None and not _supervisor._stopped.is_set():
+        _supervisor.stop_session()
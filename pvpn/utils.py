@@ -5,6 +5,7 @@ Utility functions for pvpn modules:
 - run_cmd: execute commands without invoking a shell
 - backup_file / restore_file: file backup and restore operations
 - check_root: ensure script runs with root privileges
+- run_with_deadlines: run independent probes concurrently, each with a deadline
 """
 
 import subprocess
@@ -13,7 +14,12 @@ import shutil
 import os
 import sys
 import shlex
-from typing import Sequence, Union
+import threading
+import time
+from typing import Callable, Sequence, Union
+
+# Result placeholder for probes that missed their deadline
+TIMEOUT = "timeout"
 
 def run_cmd(cmd: Union[str, Sequence[str]], *, capture_output: bool = True, input_text: str | None = None) -> str:
     """Run a command without using the shell.
@@ -76,3 +82,31 @@ def check_root():
         logging.error("Root privileges required. Please run as root or via sudo.")
         sys.exit(1)
 
+
+def run_with_deadlines(probes: dict[str, tuple[Callable, float]]) -> dict:
+    """Run every probe concurrently and collect the results.
+
+    ``probes`` maps a name to ``(callable, deadline_seconds)``. Deadlines
+    are measured from the common start, so the total wall time is bounded
+    by the largest one. Probes that do not finish in time yield
+    :data:`TIMEOUT`; probes that raise yield ``None``. Stragglers run in
+    daemon threads and never delay interpreter exit.
+    """
+    results: dict = {}
+
+    def _worker(name: str, fn: Callable):
+        try:
+            results[name] = fn()
+        except Exception as e:
+            logging.debug(f"Probe {name} failed: {e}")
+            results[name] = None
+
+    start = time.monotonic()
+    threads = {}
+    for name, (fn, _) in probes.items():
+        t = threading.Thread(target=_worker, args=(name, fn), daemon=True)
+        t.start()
+        threads[name] = t
+    for name, (_, deadline) in sorted(probes.items(), key=lambda kv: kv[1][1]):
+        threads[name].join(max(0.0, start + deadline - time.monotonic()))
+    return {name: TIMEOUT if threads[name].is_alive() else results.get(name) for name in probes}
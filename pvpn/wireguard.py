@@ -4,41 +4,36 @@
 Manage WireGuard interface lifecycle:
 - bring_up: create and configure the WireGuard interface from a .conf file
 - bring_down: tear down any existing pvpn-managed WireGuard interfaces
+- delete_iface: remove a single interface (e.g. a standby tunnel)
+- swap_peer: move a running interface to another server's peer in place
 - status: display interface and DNS status
+- get_peers: peer endpoint/handshake/transfer state of an interface
+
+Links, addresses and device config go through netlink (pvpn.netlink);
+``ip``/``wg`` are only forked if the netlink request fails.
 """
 
 import re
 import logging
+import ipaddress
 from pathlib import Path
 
+from pvpn import netlink
 from pvpn.utils import run_cmd, backup_file, restore_file, check_root
+from pvpn.catalog import parse_file, read_wg, wg_config
+from pvpn.routing import FWMARK
 
-
-def ensure_ipv6_allowed(conf_file: str) -> None:
-    """Ensure ``AllowedIPs`` in ``conf_file`` routes IPv6 (``::/0``)."""
-    try:
-        with open(conf_file, "r") as f:
-            lines = f.readlines()
-        for i, line in enumerate(lines):
-            m = re.match(r"\s*AllowedIPs\s*=\s*(.+)", line)
-            if m:
-                ips = m.group(1).strip()
-                if "::/0" not in ips:
-                    lines[i] = f"AllowedIPs = {ips}, ::/0\n"
-                    with open(conf_file, "w") as f:
-                        f.writelines(lines)
-                    logging.info(f"Added IPv6 ::/0 to AllowedIPs in {conf_file}")
-                break
-    except Exception as e:
-        logging.debug(f"Failed to ensure IPv6 AllowedIPs: {e}")
 
 # Constants for DNS management
 RESOLV_CONF = "/etc/resolv.conf"
 RESOLV_BAK = "/etc/resolv.conf.pvpnbak"
+_PVPN_IFACE = re.compile(r"wgp[a-z]{2}[0-9a-z]+")
 
 def bring_up(conf_file: str, dns: bool = True) -> str:
     """
     Bring up a WireGuard interface using the given config file.
+    Its packets are marked with ``routing.FWMARK`` so they bypass the
+    tunnel's policy routing (see :func:`pvpn.routing.install_policy`).
     - conf_file: path to .conf containing Address and optional DNS lines
     - dns: if True, back up and overwrite /etc/resolv.conf with config DNS
     Returns the interface name (e.g. 'wgpau123').
@@ -46,21 +41,11 @@ def bring_up(conf_file: str, dns: bool = True) -> str:
     check_root()
 
     iface = Path(conf_file).stem
-    addr = None
-    dns_servers = []
 
-    ensure_ipv6_allowed(conf_file)
-
-    # Parse Address and DNS entries
+    # Parse Address and DNS entries; the source file is never modified
     try:
-        with open(conf_file, "r") as f:
-            for line in f:
-                m = re.match(r'#?\s*Address\s*=\s*(\S+)', line)
-                if m:
-                    addr = m.group(1)
-                m2 = re.match(r'#?\s*DNS\s*=\s*(\S+)', line)
-                if m2:
-                    dns_servers.append(m2.group(1))
+        server = parse_file(conf_file)
+        wg_conf = wg_config(conf_file)
     except FileNotFoundError:
         logging.error(f"Config file not found: {conf_file}")
         raise
@@ -68,32 +53,18 @@ def bring_up(conf_file: str, dns: bool = True) -> str:
         logging.error(f"Error reading {conf_file}: {e}")
         raise
 
-    if not addr:
-        raise ValueError(f"No Address found in {conf_file}")
-
-    # Compute gateway (change last octet to .1)
-    try:
-        base = addr.split("/")[0].rsplit(".", 1)[0]
-        gateway = f"{base}.1"
-    except Exception as e:
-        logging.error(f"Failed to parse gateway from Address '{addr}': {e}")
-        raise
+    addr, gateway = _primary_address(server.addresses, conf_file)
+    dns_servers = list(server.dns)
 
     # Backup DNS if requested
     if dns:
         backup_file(RESOLV_CONF, RESOLV_BAK)
 
-    # Tear down stale interface if exists
     try:
-        run_cmd(["ip", "link", "del", "dev", iface], capture_output=False)
-    except Exception:
-        pass  # ignore if not present
-
-    # Create and configure interface
-    run_cmd(["ip", "link", "add", "dev", iface, "type", "wireguard"])
-    run_cmd(["wg", "setconf", iface, conf_file])
-    run_cmd(["ip", "address", "add", addr, "peer", gateway, "dev", iface])
-    run_cmd(["ip", "link", "set", "up", "dev", iface])
+        _setup_netlink(iface, conf_file, addr, gateway, server.addresses)
+    except Exception as e:
+        logging.debug(f"netlink setup of {iface} failed ({e}); using ip/wg")
+        _setup_cli(iface, wg_conf, addr, gateway, server.addresses)
     logging.info(f"Brought up interface {iface} with IP {addr}")
 
     # Update DNS
@@ -110,7 +81,156 @@ def bring_up(conf_file: str, dns: bool = True) -> str:
             restore_file(RESOLV_BAK, RESOLV_CONF)
 
     return iface
+
+def _primary_address(addresses, conf_file: str) -> tuple[str, str]:
+    """Return the first IPv4 Address and its gateway (last octet set to .1)."""
+    addrs4 = [a for a in addresses if ":" not in a]
+    if not addrs4:
+        raise ValueError(f"No Address found in {conf_file}")
+    addr = addrs4[0]
+    try:
+        base = addr.split("/")[0].rsplit(".", 1)[0]
+        gateway = f"{base}.1"
+    except Exception as e:
+        logging.error(f"Failed to parse gateway from Address '{addr}': {e}")
+        raise
+    return addr, gateway
+
+
+def swap_peer(iface: str, conf_file: str):
+    """Point the running ``iface`` at the server in ``conf_file``.
+
+    Replaces the private key and peer (``wg set``-style, ``replace_peers``)
+    and adjusts the interface addresses only where they differ. The link,
+    routes, kill-switch and DNS are left alone. Returns the new server's
+    :class:`pvpn.catalog.Server`.
+    """
+    check_root()
+    server = parse_file(conf_file)
+    addr, gateway = _primary_address(server.addresses, conf_file)
+    try:
+        interface, peers = read_wg(conf_file)
+        netlink.wireguard().set_device(
+            iface,
+            private_key=interface.get("privatekey"),
+            peers=_netlink_peers(peers),
+            replace_peers=True,
+        )
+        rt = netlink.route()
+        primary = str(ipaddress.ip_interface(addr))
+        current = {str(ipaddress.ip_interface(a)) for a in rt.addresses(iface)}
+        wanted = {str(ipaddress.ip_interface(a)) for a in server.addresses}
+        for new in wanted - current:
+            rt.add_address(iface, new, peer=gateway if new == primary else None)
+        for stale in current - wanted:
+            rt.del_address(iface, stale)
+    except Exception as e:
+        logging.debug(f"netlink peer swap on {iface} failed ({e}); using wg/ip")
+        run_cmd(["wg", "setconf", iface, "/dev/stdin"], input_text=wg_config(conf_file))
+        run_cmd(["wg", "set", iface, "fwmark", str(FWMARK)])
+        current = _cli_addresses(iface)
+        for extra in server.addresses:
+            cmd = ["ip", "address", "replace", extra, "dev", iface]
+            if extra == addr:
+                cmd[4:4] = ["peer", gateway]
+            run_cmd(cmd)
+        wanted = {str(ipaddress.ip_interface(a)) for a in server.addresses}
+        for stale, spec in current.items():
+            if stale not in wanted:
+                run_cmd(["ip", "address", "del", *spec, "dev", iface])
+    logging.info(f"Swapped {iface} to {server.name} ({server.endpoint})")
+    return server
+
+
+def _cli_addresses(iface: str) -> dict[str, list[str]]:
+    """Map ``addr/prefix`` of each address on ``iface`` to its ``ip address del`` spec."""
+    out = {}
+    for line in run_cmd(["ip", "-o", "address", "show", "dev", iface]).splitlines():
+        f = line.split()
+        if "inet" in f or "inet6" in f:
+            i = f.index("inet6" if "inet6" in f else "inet") + 1
+            if f[i + 1:i + 2] == ["peer"]:
+                # "10.2.0.2 peer 10.2.0.1/32": the prefix belongs to the peer
+                prefix = f[i + 2].rsplit("/", 1)[1]
+                out[str(ipaddress.ip_interface(f"{f[i]}/{prefix}"))] = [f[i], "peer", f[i + 2]]
+            else:
+                out[str(ipaddress.ip_interface(f[i]))] = [f[i]]
+    return out
+
 
+def _netlink_peers(peers: list[dict]) -> list[dict]:
+    out = []
+    for peer in peers:
+        entry = {"public_key": peer["publickey"], "allowed_ips": peer["allowedips"]}
+        if "presharedkey" in peer:
+            entry["preshared_key"] = peer["presharedkey"]
+        if "endpoint" in peer:
+            entry["endpoint"] = peer["endpoint"]
+        if "persistentkeepalive" in peer:
+            entry["persistent_keepalive"] = int(peer["persistentkeepalive"])
+        out.append(entry)
+    return out
+
+
+def _setup_netlink(iface: str, conf_file: str, addr: str, gateway: str, addresses):
+    interface, peers = read_wg(conf_file)
+    rt = netlink.route()
+    wg = netlink.wireguard()
+    try:
+        rt.del_link(iface)
+    except OSError:
+        pass  # ignore if not present
+    rt.add_link(iface, "wireguard")
+    try:
+        wg.set_device(
+            iface,
+            private_key=interface.get("privatekey"),
+            listen_port=int(interface["listenport"]) if "listenport" in interface else None,
+            fwmark=FWMARK,
+            peers=_netlink_peers(peers),
+            replace_peers=True,
+        )
+        rt.add_address(iface, addr, peer=gateway)
+        for extra in addresses:
+            if extra != addr:
+                rt.add_address(iface, extra)
+        rt.set_link(iface, True)
+    except Exception:
+        try:
+            rt.del_link(iface)
+        except OSError:
+            pass
+        raise
+
+
+def _setup_cli(iface: str, wg_conf: str, addr: str, gateway: str, addresses):
+    # Tear down stale interface if exists
+    try:
+        run_cmd(["ip", "link", "del", "dev", iface], capture_output=False)
+    except Exception:
+        pass  # ignore if not present
+
+    # Create and configure interface
+    run_cmd(["ip", "link", "add", "dev", iface, "type", "wireguard"])
+    run_cmd(["wg", "setconf", iface, "/dev/stdin"], input_text=wg_conf)
+    run_cmd(["wg", "set", iface, "fwmark", str(FWMARK)])
+    run_cmd(["ip", "address", "add", addr, "peer", gateway, "dev", iface])
+    for extra in addresses:
+        if extra != addr:
+            run_cmd(["ip", "address", "add", extra, "dev", iface])
+    run_cmd(["ip", "link", "set", "up", "dev", iface])
+
+
+def _pvpn_links() -> list[str]:
+    """Return the names of pvpn-managed (wgp*) interfaces."""
+    try:
+        return [link["name"] for link in netlink.route().links() if _PVPN_IFACE.fullmatch(link["name"])]
+    except Exception as e:
+        logging.debug(f"netlink link dump failed ({e}); using ip")
+    output = run_cmd(["ip", "-o", "link", "show"])
+    return [m.group(1) for m in (re.search(r':\s*(wgp[a-z]{2}[0-9a-z]+):', line) for line in output.splitlines()) if m]
+
+
 def bring_down():
     """
     Tear down all WireGuard interfaces created by pvpn (matching wgp*).
@@ -118,24 +238,32 @@ def bring_down():
     check_root()
 
     try:
-        output = run_cmd(["ip", "-o", "link", "show"])
+        ifaces = _pvpn_links()
     except Exception as e:
         logging.error(f"Failed to list interfaces: {e}")
         return
 
-    for line in output.splitlines():
-        m = re.search(r':\s*(wgp[a-z]{2}[0-9a-z]+):', line)
-        if m:
-            iface = m.group(1)
-            try:
-                run_cmd(["ip", "link", "set", "down", "dev", iface], capture_output=False)
-                run_cmd(["ip", "link", "del", "dev", iface], capture_output=False)
-                logging.info(f"Torn down WireGuard interface {iface}")
-            except Exception as e:
-                logging.error(f"Error tearing down {iface}: {e}")
+    for iface in ifaces:
+        delete_iface(iface)
 
     # Restore original DNS if a backup exists
     restore_file(RESOLV_BAK, RESOLV_CONF)
+
+
+def delete_iface(iface: str):
+    """Delete one WireGuard interface (e.g. a standby tunnel), leaving DNS alone."""
+    try:
+        try:
+            netlink.route().del_link(iface)
+        except Exception as e:
+            logging.debug(f"netlink delete of {iface} failed ({e}); using ip")
+            run_cmd(["ip", "link", "set", "down", "dev", iface], capture_output=False)
+            run_cmd(["ip", "link", "del", "dev", iface], capture_output=False)
+        logging.info(f"Torn down WireGuard interface {iface}")
+    except Exception as e:
+        logging.error(f"Error tearing down {iface}: {e}")
+
+
 def status():
     """
     Display status of pvpn-managed WireGuard interfaces and DNS.
@@ -158,17 +286,70 @@ def status():
 
 
 def get_active_iface() -> str:
-    """Return the first active pvpn-managed WireGuard interface name or an empty string."""
+    """Return the active pvpn-managed WireGuard interface name or an empty string.
+
+    The interface recorded in the state file wins; a hot standby tunnel
+    (also ``wgp*``) is never reported as the active one.
+    """
+    from pvpn.state import read_state
+
+    state = read_state()
+    standby = (state.get("standby") or {}).get("interface")
+    ifaces = []
     try:
-        out = run_cmd(["wg", "show", "interfaces"]).strip()
-        for iface in out.split():
-            if iface.startswith("wgp"):
-                return iface
-    except Exception as e:
-        logging.debug(f"Failed to get active WireGuard interface: {e}")
-    return ""
+        ifaces = [link["name"] for link in netlink.route().links() if link["kind"] == "wireguard"]
+    except Exception as e:
+        logging.debug(f"netlink link dump failed ({e}); using wg")
+        try:
+            ifaces = run_cmd(["wg", "show", "interfaces"]).split()
+        except Exception as e:
+            logging.debug(f"Failed to get active WireGuard interface: {e}")
+    ifaces = [i for i in ifaces if i.startswith("wgp") and i != standby]
+    if state.get("interface") in ifaces:
+        return state["interface"]
+    return ifaces[0] if ifaces else ""
 
 
+def _parse_dump(out: str) -> list[dict]:
+    """Parse the peer lines of ``wg show <iface> dump``."""
+    peers = []
+    for line in out.splitlines()[1:]:
+        f = line.split("\t")
+        if len(f) < 8:
+            continue
+        peers.append({
+            "public_key": f[0],
+            "endpoint": "" if f[2] == "(none)" else f[2],
+            "allowed_ips": [] if f[3] == "(none)" else f[3].split(","),
+            "last_handshake": int(f[4]),
+            "rx_bytes": int(f[5]),
+            "tx_bytes": int(f[6]),
+            "persistent_keepalive": 0 if f[7] == "off" else int(f[7]),
+        })
+    return peers
+
+
+def get_peers(iface: str) -> list[dict]:
+    """Return the peers of ``iface`` (see :meth:`pvpn.netlink.WireGuard.get_device`).
+
+    Returns an empty list if the interface cannot be queried.
+    """
+    try:
+        return netlink.wireguard().get_device(iface)["peers"]
+    except Exception as e:
+        logging.debug(f"netlink peer query for {iface} failed ({e}); using wg")
+    try:
+        return _parse_dump(run_cmd(["wg", "show", iface, "dump"]))
+    except Exception as e:
+        logging.debug(f"Failed to read peers of {iface}: {e}")
+    return []
+
+
+def get_latest_handshake(iface: str) -> int:
+    """Return the most recent peer handshake on ``iface`` as a UNIX timestamp (0 if none)."""
+    return max((p["last_handshake"] for p in get_peers(iface)), default=0)
+
+
 def get_dns_servers() -> list:
     """Return a list of DNS resolvers from /etc/resolv.conf."""
     servers = []
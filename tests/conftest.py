@@ -1,3 +1,12 @@
 import os
 import sys
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def _state_dir(tmp_path, monkeypatch):
+    """Keep the runtime state file out of the real /run/pvpn."""
+    monkeypatch.setattr("pvpn.state.STATE_DIR", str(tmp_path / "run"))
@@ -0,0 +1,81 @@
+"""A local fake NAT-PMP gateway for tests and benchmarks.
+
+Run directly to benchmark the client against it::
+
+    python tests/fake_natpmp.py [requests]
+"""
+
+import socket
+import struct
+import threading
+import time
+
+
+class FakeGateway:
+    """Answer RFC 6886 mapping requests on ``127.0.0.1`` from a background thread.
+
+    - ``public_port``: port granted for every mapping
+    - ``lifetime``: granted lifetime (``None`` echoes the requested one)
+    - ``drop``: number of initial requests silently ignored (packet loss)
+    - ``result``: result code to answer with (0 = success)
+    """
+
+    def __init__(self, public_port=40000, lifetime=None, drop=0, result=0):
+        self.public_port = public_port
+        self.lifetime = lifetime
+        self.drop = drop
+        self.result = result
+        self.requests = []
+        self.started = time.monotonic()
+        self.epoch_offset = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def restart(self):
+        """Simulate a gateway reboot: the epoch counter starts again at zero."""
+        self.started = time.monotonic()
+        self.epoch_offset = 0
+
+    def _serve(self):
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(64)
+            except OSError:
+                return
+            if len(data) < 12:
+                continue
+            _, op, _, internal, _, lifetime = struct.unpack("!BBHHHI", data[:12])
+            self.requests.append((op, internal, lifetime))
+            if self.drop > 0:
+                self.drop -= 1
+                continue
+            epoch = int(time.monotonic() - self.started) + self.epoch_offset
+            granted = lifetime if self.lifetime is None else self.lifetime
+            reply = struct.pack(
+                "!BBHIHHI", 0, 128 + op, self.result, epoch, internal,
+                self.public_port if not self.result else 0, granted,
+            )
+            self.sock.sendto(reply, addr)
+
+    def close(self):
+        self.sock.close()
+
+
+if __name__ == "__main__":  # pragma: no cover
+    import os
+    import sys
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from pvpn import natpmp
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    gw = FakeGateway()
+    start = time.perf_counter()
+    for _ in range(n):
+        natpmp.request_mappings("127.0.0.1", port=gw.port)
+    elapsed = time.perf_counter() - start
+    print(f"{n} UDP+TCP mapping requests in {elapsed:.3f}s ({elapsed / n * 1e3:.3f} ms each)")
+    gw.close()
@@ -0,0 +1,64 @@
+import os
+
+import pvpn.catalog as catalog
+
+CONF = """# NAT-PMP (Port Forwarding) = on
+[Interface]
+PrivateKey = secret
+Address = 10.2.0.2/32, 2a07:b944::2:2/128
+DNS = 10.2.0.1
+
+[Peer]
+PublicKey = pubkey=
+AllowedIPs = 0.0.0.0/0
+Endpoint = 185.1.2.3:51820
+"""
+
+
+def test_parse_name_tags():
+    assert catalog.parse_name_tags("wgpnl12") == ("NL", False, False)
+    assert catalog.parse_name_tags("US-NY-12") == ("US", False, False)
+    assert catalog.parse_name_tags("CH-US-1") == ("US", False, True)
+    assert catalog.parse_name_tags("wg-NL-FREE-P2P-3") == ("NL", True, False)
+
+
+def test_parse_file(tmp_path):
+    conf = tmp_path / "NL-1.conf"
+    conf.write_text(CONF)
+    s = catalog.parse_file(str(conf))
+    assert s.name == "NL-1" and s.country == "NL" and s.p2p
+    assert s.addresses == ("10.2.0.2/32", "2a07:b944::2:2/128")
+    assert s.dns == ("10.2.0.1",)
+    assert s.public_key == "pubkey="
+    assert s.endpoint == "185.1.2.3:51820" and s.host == "185.1.2.3"
+
+
+def test_commented_address(tmp_path):
+    conf = tmp_path / "wgpus1.conf"
+    conf.write_text("[Interface]\n# Address = 10.2.0.2/32\n#PrivateKey = x\n")
+    s = catalog.parse_file(str(conf))
+    assert s.addresses == ("10.2.0.2/32",)
+
+
+def test_index_incremental(tmp_path, monkeypatch):
+    wg = tmp_path / "wireguard"
+    wg.mkdir()
+    (wg / "NL-1.conf").write_text(CONF)
+    (wg / "US-2.conf").write_text(CONF)
+    index = str(tmp_path / "catalog.json")
+
+    first = catalog.load_catalog(str(wg), index)
+    assert [s.name for s in first] == ["NL-1", "US-2"]
+    assert "secret" not in open(index).read()
+
+    parsed = []
+    real = catalog.parse_file
+    monkeypatch.setattr(catalog, "parse_file", lambda p: parsed.append(p) or real(p))
+    catalog.load_catalog(str(wg), index)
+    assert parsed == []
+
+    (wg / "US-2.conf").write_text(CONF.replace("185.1.2.3", "185.9.9.9"))
+    os.remove(wg / "NL-1.conf")
+    again = catalog.load_catalog(str(wg), index)
+    assert parsed == [str(wg / "US-2.conf")]
+    assert [s.endpoint for s in again] == ["185.9.9.9:51820"]
@@ -6,7 +6,7 @@ def test_subcommands_present():
     parser = build_parser()
     help_text = parser.format_help()
     # Check that all subcommands are documented
-    for cmd in ["init", "connect", "disconnect", "status"]:
+    for cmd in ["init", "connect", "disconnect", "status", "list", "daemon", "events", "switch"]:
         assert cmd in help_text
 
 def test_connect_alias():
@@ -18,3 +18,9 @@ def test_connect_config_option():
     parser = build_parser()
     args = parser.parse_args(["connect", "--config", "file.conf"])
     assert args.config == "file.conf"
+
+def test_list_filters():
+    parser = build_parser()
+    args = parser.parse_args(["list", "--cc", "nl", "--p2p", "--fastest"])
+    assert args.cmd == "list"
+    assert args.cc == "nl" and args.p2p and args.fastest and not args.sc
@@ -11,9 +11,20 @@ def test_config_save_load(tmp_path):
     cfg.proton_user = "alice"
     cfg.proton_pass = "secret"
     cfg.qb_port = 12345
+    cfg.qb_pause_on_rotate = True
+    cfg.network_allow_lan = ["192.168.1.0/24", "fd00::/8"]
+    cfg.network_allow_ports = ["445/tcp", "http"]
+    cfg.network_split_tunnel = True
+    cfg.network_split_user = "qbtuser"
     cfg.monitor_interval = 30
     cfg.monitor_failures = 5
     cfg.monitor_latency_threshold = 800
+    cfg.monitor_loss_threshold = 0.1
+    cfg.monitor_window = 30
+    cfg.monitor_max_interval = 120
+    cfg.monitor_standby = True
+    cfg.natpmp_lifetime = 120
+    cfg.natpmp_refresh_fraction = 0.25
     cfg.save()
 
     mode = cfg.ini_path.stat().st_mode & 0o777
@@ -26,7 +37,17 @@ def test_config_save_load(tmp_path):
     assert cfg2.proton_user == "alice"
     assert cfg2.proton_pass == "secret"
     assert cfg2.qb_port == 12345
+    assert cfg2.qb_pause_on_rotate is True
+    assert cfg2.network_allow_lan == ["192.168.1.0/24", "fd00::/8"]
+    assert cfg2.network_allow_ports == ["445/tcp", "http"]
+    assert cfg2.network_split_tunnel is True
+    assert cfg2.network_split_user == "qbtuser"
     assert cfg2.monitor_interval == 30
     assert cfg2.monitor_failures == 5
     assert cfg2.monitor_latency_threshold == 800
-
+    assert cfg2.monitor_loss_threshold == 0.1
+    assert cfg2.monitor_window == 30
+    assert cfg2.monitor_max_interval == 120
+    assert cfg2.monitor_standby is True
+    assert cfg2.natpmp_lifetime == 120
+    assert cfg2.natpmp_refresh_fraction == 0.25
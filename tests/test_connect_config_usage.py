@@ -3,8 +3,11 @@ from pvpn.config import Config
 import pvpn.protonvpn as pv
 
 
-class DummyThread:
-    def join(self):
+class DummySupervisor:
+    def start_session(self, cfg, iface, server=None):
+        self.iface = iface
+
+    def wait(self):
         pass
 
 
@@ -30,9 +33,10 @@ def test_connect_uses_specified_config(tmp_path, monkeypatch):
         return "wg0"
 
     monkeypatch.setattr("pvpn.wireguard.bring_up", fake_bring_up)
-    monkeypatch.setattr("pvpn.routing.enable_killswitch", lambda iface: None)
+    monkeypatch.setattr("pvpn.routing.enable_killswitch", lambda iface, allow=None, split=None: None)
     monkeypatch.setattr("pvpn.natpmp.start_forward", lambda iface: 0)
-    monkeypatch.setattr("pvpn.monitor.start_monitor", lambda cfg, iface: DummyThread())
+    monkeypatch.setattr("pvpn.routing.install_policy", lambda iface, gw, split=False: None)
+    monkeypatch.setattr("pvpn.supervisor.get_supervisor", lambda: DummySupervisor())
     monkeypatch.setattr("pvpn.qbittorrent.start_service", lambda: None)
     monkeypatch.setattr("pvpn.qbittorrent.update_port", lambda cfg, port: None)
 
@@ -63,11 +67,74 @@ def test_connect_uses_first_available_config(tmp_path, monkeypatch):
         return "wg0"
 
     monkeypatch.setattr("pvpn.wireguard.bring_up", fake_bring_up)
-    monkeypatch.setattr("pvpn.routing.enable_killswitch", lambda iface: None)
+    monkeypatch.setattr("pvpn.routing.enable_killswitch", lambda iface, allow=None, split=None: None)
     monkeypatch.setattr("pvpn.natpmp.start_forward", lambda iface: 0)
-    monkeypatch.setattr("pvpn.monitor.start_monitor", lambda cfg, iface: DummyThread())
+    monkeypatch.setattr("pvpn.routing.install_policy", lambda iface, gw, split=False: None)
+    monkeypatch.setattr("pvpn.supervisor.get_supervisor", lambda: DummySupervisor())
     monkeypatch.setattr("pvpn.qbittorrent.start_service", lambda: None)
     monkeypatch.setattr("pvpn.qbittorrent.update_port", lambda cfg, port: None)
 
     pv.connect(cfg, args)
     assert called["file"] == str(first)
+
+
+def test_connect_pipeline_orders_stages(tmp_path, monkeypatch):
+    import threading
+
+    cfg = Config()
+    cfg.config_dir = str(tmp_path)
+    cfg.qb_enable = True
+    conf = tmp_path / "NL-1.conf"
+    conf.write_text("[Interface]\nAddress = 10.2.0.2/32\n[Peer]\nEndpoint = 192.0.2.1:51820\n")
+
+    order = []
+    release = threading.Event()
+    spawned = {}
+
+    class Sup(DummySupervisor):
+        def spawn(self, name, coro):
+            coro.close()
+            spawned[name] = coro
+
+    def slow_service():
+        release.wait(5)
+        order.append("service")
+
+    monkeypatch.setattr("pvpn.wireguard.bring_up", lambda file, dns: order.append("up") or "NL-1")
+    monkeypatch.setattr(
+        "pvpn.routing.enable_killswitch", lambda iface, allow=None, split=None: order.append(("ks", iface))
+    )
+    monkeypatch.setattr("pvpn.routing.allow_endpoint", lambda ep: order.append(("endpoint", ep)))
+    monkeypatch.setattr("pvpn.natpmp.start_forward", lambda iface: order.append("natpmp") or 41000)
+    monkeypatch.setattr(
+        "pvpn.routing.install_policy", lambda iface, gw, split=False: order.append(("policy", iface, gw))
+    )
+    monkeypatch.setattr("pvpn.supervisor.get_supervisor", lambda: Sup())
+    monkeypatch.setattr("pvpn.qbittorrent.start_service", slow_service)
+
+    result = pv.connect(cfg, SimpleNamespace(config=str(conf), dns="false", ks="true"), wait=False)
+
+    # Connected (and the port push queued) while qbittorrent-nox is still starting
+    assert result["forwarded_port"] == 41000
+    assert "service" not in order and "qb_port" in spawned
+    assert order.index(("ks", "NL-1")) < order.index(("endpoint", "192.0.2.1:51820"))
+    assert order.index("up") < order.index(("policy", "NL-1", "10.2.0.1")) < order.index("natpmp")
+    release.set()
+
+
+def test_unknown_split_user_is_a_config_error(tmp_path, monkeypatch):
+    import pytest
+
+    cfg = Config()
+    cfg.config_dir = str(tmp_path)
+    cfg.network_split_tunnel = True
+    cfg.network_split_user = "no-such-user-pvpn"
+    conf = tmp_path / "wg0.conf"
+    conf.write_text("[Interface]\nAddress = 10.0.0.2/32\n")
+    monkeypatch.setattr("pvpn.utils.check_root", lambda: None)
+    monkeypatch.setattr(pv, "check_root", lambda: None)
+    monkeypatch.setattr("pvpn.routing.enable_killswitch", lambda *a, **k: pytest.fail("stage started"))
+    monkeypatch.setattr("pvpn.wireguard.bring_up", lambda *a, **k: pytest.fail("tunnel brought up"))
+
+    with pytest.raises(SystemExit):
+        pv.connect(cfg, SimpleNamespace(config=str(conf), dns="false", ks=None), wait=False)
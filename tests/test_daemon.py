@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+import pvpn.daemon as daemon
+import pvpn.state as state
+from pvpn.config import Config
+
+
+@pytest.fixture
+def server():
+    srv = daemon.start_server(daemon.Daemon(Config()))
+    yield srv
+    srv.close()
+
+
+def test_unavailable_without_daemon():
+    with pytest.raises(daemon.DaemonUnavailable):
+        daemon.request("ping")
+
+
+def test_status_from_memory(server, monkeypatch):
+    monkeypatch.setattr("pvpn.wireguard.get_dns_servers", lambda: ["10.2.0.1"])
+    state.update_state(pid=os.getpid(), interface="wgpnl1", forwarded_port=4242)
+    try:
+        info = daemon.request("status")
+    finally:
+        state.clear_state()
+    assert info["interface"] == "wgpnl1"
+    assert info["forwarded_port"] == 4242
+    assert info["dns"] == ["10.2.0.1"]
+
+
+def test_connect_and_errors(server, monkeypatch):
+    calls = []
+
+    def fake_connect(cfg, args, wait=True):
+        calls.append((args.cc, wait))
+        return {}
+
+    monkeypatch.setattr("pvpn.protonvpn.connect", fake_connect)
+    daemon.request("connect", cc="nl")
+    assert calls == [("nl", False)]
+
+    with pytest.raises(daemon.DaemonError, match="unknown command"):
+        daemon.request("reboot")
+    with pytest.raises(daemon.DaemonError):
+        daemon.request("status", bogus=1)
+
+
+def test_slow_daemon_is_an_error(server, monkeypatch):
+    import threading
+
+    release = threading.Event()
+    monkeypatch.setattr(daemon.Daemon, "handle", lambda self, cmd, args: release.wait(5))
+    try:
+        with pytest.raises(daemon.DaemonError, match="no reply"):
+            daemon.request("status", timeout=0.2)
+    finally:
+        release.set()
@@ -0,0 +1,58 @@
+import pvpn.events as events
+import pvpn.daemon as daemon
+import pvpn.natpmp as natpmp
+from pvpn.config import Config
+
+
+def test_replay_and_filter():
+    bus = events.EventBus(replay_size=3)
+    for port in (1, 2, 3, 4):
+        bus.emit(events.PORT_CHANGED, old=port - 1, port=port)
+    bus.emit(events.TUNNEL_DOWN, interface="wgpnl1", reason="user")
+
+    sub = bus.subscribe(replay=10, types=[events.PORT_CHANGED])
+    assert [sub.get(0)["port"] for _ in range(2)] == [3, 4]
+    assert sub.get(0) is None
+
+    bus.emit(events.TUNNEL_UP, interface="wgpnl1")
+    bus.emit(events.PORT_LOST, old=4)
+    assert sub.get(0) is None
+    bus.emit(events.PORT_CHANGED, old=4, port=5)
+    assert sub.get(0)["seq"] == 8
+
+
+def test_slow_subscriber_dropped(monkeypatch):
+    monkeypatch.setattr(events, "SUBSCRIBER_QUEUE", 2)
+    bus = events.EventBus()
+    sub = bus.subscribe()
+    for _ in range(3):
+        bus.emit(events.HANDSHAKE_STALE, interface="wgpnl1")
+    assert sub.closed
+    bus.emit(events.HANDSHAKE_STALE, interface="wgpnl1")
+    assert sub.queue.qsize() == 2
+
+
+def test_forwarder_port_events(monkeypatch):
+    seen = []
+    monkeypatch.setattr(natpmp, "emit", lambda kind, **data: seen.append((kind, data)))
+    fwd = natpmp.Forwarder("127.0.0.1")
+    fwd._set_port(1000)
+    fwd._set_port(1000)
+    fwd._set_port(2000)
+    fwd._set_port(0)
+    assert [k for k, _ in seen] == [events.PORT_MAPPED, events.PORT_CHANGED, events.PORT_LOST]
+    assert seen[1][1] == {"old": 1000, "port": 2000}
+
+
+def test_daemon_stream():
+    server = daemon.start_server(daemon.Daemon(Config()))
+    try:
+        events.emit(events.KILLSWITCH, enabled=True, interface="wgpnl1")
+        stream = daemon.subscribe(replay=1)
+        first = next(stream)
+        assert first["type"] == events.KILLSWITCH and first["enabled"]
+        events.emit(events.QB_PORT_APPLIED, port=51413)
+        assert next(stream)["port"] == 51413
+        stream.close()
+    finally:
+        server.close()
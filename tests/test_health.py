@@ -0,0 +1,177 @@
+import asyncio
+import itertools
+import time
+
+import pytest
+
+import pvpn.health as health
+import pvpn.monitor as monitor
+from pvpn.config import Config
+from pvpn.health import Cadence, Counters, HealthTracker, RttWindow
+
+
+def test_tracker_verdicts():
+    now = time.time()
+    t = HealthTracker(stall_after=15)
+    assert t.update(Counters(0, now, 100, 100), now) == health.IDLE
+    assert t.update(Counters(10, now, 200, 150), now) == health.HEALTHY
+    assert t.update(Counters(20, now, 200, 150), now) == health.IDLE
+    # Sending without replies: tolerated until stall_after has passed
+    assert t.update(Counters(30, now, 200, 300), now) == health.IDLE
+    assert t.update(Counters(40, now, 200, 400), now) == health.STALLED
+    assert t.update(Counters(50, now, 300, 500), now) == health.HEALTHY
+
+
+def test_tracker_stalls_at_once_on_expired_session():
+    now = time.time()
+    t = HealthTracker()
+    t.update(Counters(0, now - 600, 100, 100), now)
+    assert t.update(Counters(10, now - 600, 100, 200), now) == health.STALLED
+
+
+def test_tracker_resets_on_counter_reset():
+    now = time.time()
+    t = HealthTracker(stall_after=5)
+    t.update(Counters(0, now, 100, 100), now)
+    t.update(Counters(10, now, 100, 200), now)
+    assert t.update(Counters(20, now, 0, 0), now) == health.IDLE
+
+
+def test_window_ignores_single_spike():
+    w = RttWindow(10)
+    for rtt in [20.0] * 9 + [2000.0]:
+        w.add(rtt)
+    assert w.percentile(95) == 20.0
+    assert w.degraded(500, 0.2) is None
+    w.add(1500.0)
+    assert w.percentile(95) == 1500.0
+    assert w.degraded(500, 0.2) == "latency"
+
+
+def test_window_loss_and_jitter():
+    w = RttWindow(10)
+    for rtt in (10.0, 20.0, None, 10.0, None, None):
+        w.add(rtt)
+    assert w.loss() == 0.5
+    assert w.jitter() == 10.0
+    assert w.degraded(500, 0.2) is None  # too few samples to judge
+    assert w.degraded(500, 0.2, min_samples=5) == "loss"
+
+
+def test_small_window_is_still_judged():
+    # A window smaller than MIN_SAMPLES is judged once it is full
+    w = RttWindow(4)
+    for _ in range(4):
+        w.add(None)
+    assert w.degraded(500, 0.2) == "loss"
+
+
+def test_cadence_stretches_and_tightens():
+    c = Cadence(60, 10, 100)
+    assert c.relax() == 90
+    assert c.relax() == 100
+    assert c.tighten() == 10
+    assert Cadence(5, 10, 100).interval == 10
+
+
+def test_monitor_probes_only_when_stalled(tmp_path, monkeypatch):
+    now = time.time()
+    samples = iter([
+        Counters(0, now, 100, 100),
+        Counters(1, now, 200, 200),
+        Counters(2, now, 300, 300),
+        Counters(20, now, 300, 400),
+        Counters(30, now, 300, 500),
+        Counters(40, now, 300, 600),
+    ])
+    probes, rotated = [], []
+
+    async def no_sleep(_):
+        return None
+
+    def fake_probe(iface):
+        probes.append(iface)
+        return None
+
+    class Sup:
+        def spawn(self, name, coro):
+            coro.close()
+            rotated.append(name)
+
+    monkeypatch.setattr(monitor.asyncio, "sleep", no_sleep)
+    monkeypatch.setattr(monitor, "read_counters", lambda iface: next(samples))
+    monkeypatch.setattr(monitor, "probe", fake_probe)
+    monkeypatch.setattr(monitor.time, "monotonic", lambda: 0)
+    cfg = Config()
+    cfg.config_dir = str(tmp_path)
+    cfg.monitor_failures = 3
+
+    asyncio.run(monitor.monitor(cfg, "wgpnl1", Sup(), "NL-1"))
+
+    # Healthy and idle samples cost nothing; each stalled sample is probed
+    assert len(probes) == 3
+    assert rotated == ["rotate"]
+
+
+def test_monitor_never_probes_healthy_tunnel(tmp_path, monkeypatch):
+    now = time.time()
+    samples = iter([Counters(t, now, 100 * t, 100 * t) for t in range(1, 6)])
+    probes, clock = [], itertools.count(0, 100)
+
+    async def no_sleep(_):
+        return None
+
+    class Done(Exception):
+        pass
+
+    def next_sample(iface):
+        try:
+            return next(samples)
+        except StopIteration:
+            raise Done
+
+    monkeypatch.setattr(monitor.asyncio, "sleep", no_sleep)
+    monkeypatch.setattr(monitor, "read_counters", next_sample)
+    monkeypatch.setattr(monitor, "probe", lambda iface: probes.append(iface) or 20.0)
+    monkeypatch.setattr(monitor.time, "monotonic", lambda: next(clock))
+    cfg = Config()
+    cfg.config_dir = str(tmp_path)
+
+    with pytest.raises(Done):
+        asyncio.run(monitor.monitor(cfg, "wgpnl1", None, "NL-1"))
+
+    # Every sample past the probe interval, but rx keeps advancing
+    assert probes == ["wgpnl1"]  # only the first (idle) sample
+
+
+def test_idle_tunnel_with_old_handshake_is_not_stale(tmp_path, monkeypatch):
+    old = time.time() - 2 * health.HANDSHAKE_TIMEOUT
+    samples = iter([Counters(t, old, 100, 100) for t in range(5)])
+    seen, clock = [], itertools.count(0, 100)
+
+    async def no_sleep(_):
+        return None
+
+    class Done(Exception):
+        pass
+
+    def next_sample(iface):
+        try:
+            return next(samples)
+        except StopIteration:
+            raise Done
+
+    monkeypatch.setattr(monitor.asyncio, "sleep", no_sleep)
+    monkeypatch.setattr(monitor, "read_counters", next_sample)
+    monkeypatch.setattr(monitor, "probe", lambda iface: 20.0)
+    monkeypatch.setattr(monitor, "emit", lambda kind, **data: seen.append(kind))
+    monkeypatch.setattr(monitor.time, "monotonic", lambda: next(clock))
+    cfg = Config()
+    cfg.config_dir = str(tmp_path)
+
+    with pytest.raises(Done):
+        asyncio.run(monitor.monitor(cfg, "wgpnl1", None, "NL-1"))
+
+    # No keepalives means no rekeying; the probes answer, so nothing is wrong
+    assert seen == []
+    assert monitor.get_history(cfg).servers["NL-1"]["handshake"] == 1.0
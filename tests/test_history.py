@@ -0,0 +1,113 @@
+import json
+import time
+
+import pvpn.history as hist
+import pvpn.servers as srv
+
+
+def test_ewma_score_and_persistence(tmp_path):
+    path = str(tmp_path / "history.json")
+    h = hist.History(path)
+    h.record_rtt("a", 100.0)
+    h.record_rtt("a", 50.0)
+    h.record_natpmp("a", True)
+    assert h.servers["a"]["rtt"] == 100.0 * 0.7 + 50.0 * 0.3
+    base = h.score("a")
+
+    h.record_disconnect("a", "latency")
+    assert h.score("a") > base
+    assert h.servers["a"]["last_reason"] == "latency"
+    h.save()
+
+    again = hist.History(path)
+    assert again.servers["a"]["last_reason"] == "latency"
+    assert hist.History(str(tmp_path / "missing.json")).servers == {}
+
+
+def test_stale_scores_ignored(tmp_path):
+    h = hist.History(str(tmp_path / "h.json"))
+    h.record_rtt("a", 10.0)
+    assert h.score("a", now=h.servers["a"]["updated"] + hist.SCORE_TTL + 1) is None
+
+
+def test_non_rtt_samples_do_not_refresh_score(tmp_path, monkeypatch):
+    h = hist.History(str(tmp_path / "h.json"))
+    h.record_rtt("a", 10.0)
+    later = h.servers["a"]["rtt_at"] + hist.SCORE_TTL + 1
+    monkeypatch.setattr(hist.time, "time", lambda: later)
+    h.record_disconnect("a", "user")
+    h.record_natpmp("a", True)
+    assert h.score("a", now=later) is None
+
+
+def test_failed_save_leaves_no_temp_file(tmp_path, monkeypatch):
+    h = hist.History(str(tmp_path / "h.json"))
+    h.record_rtt("a", 10.0)
+
+    def fail(src, dst):
+        raise OSError("read-only")
+
+    monkeypatch.setattr(hist.os, "replace", fail)
+    h.save()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_compaction_evicts(tmp_path, monkeypatch):
+    monkeypatch.setattr(hist, "MAX_SERVERS", 2)
+    h = hist.History(str(tmp_path / "h.json"))
+    now = time.time()
+    for i, name in enumerate(["old", "a", "b", "c"]):
+        h.record_rtt(name, 10.0)
+        h.servers[name]["updated"] = now + i
+    h.servers["old"]["updated"] = now - hist.MAX_AGE - 1
+    h.compact(now=now)
+    assert sorted(h.servers) == ["b", "c"]
+    h.save()
+    data = json.loads((tmp_path / "h.json").read_text())
+    assert sorted(data["servers"]) == ["b", "c"]
+
+
+def test_rank_with_history_skips_known(tmp_path, monkeypatch):
+    h = hist.History(str(tmp_path / "h.json"))
+    h.record_rtt("known", 5.0)
+    servers = [srv.Server("/x/new.conf", "10.0.0.2:1"), srv.Server("/x/known.conf", "10.0.0.1:1")]
+    probed = []
+
+    def fake_probe(host):
+        probed.append(host)
+        return 40.0, 0.0
+
+    monkeypatch.setattr(srv, "_probe", fake_probe)
+    ranked = srv.rank_with_history(servers, h)
+    assert probed == ["10.0.0.2"]
+    assert [s.name for s in ranked] == ["known", "new"]
+    assert h.servers["new"]["rtt"] == 40.0
+
+
+def test_penalty_box_backs_off_and_persists(tmp_path):
+    path = str(tmp_path / "h.json")
+    h = hist.History(path)
+    h.record_disconnect("a", "user")
+    assert h.penalty("a") == 0
+    h.record_disconnect("a", "unreachable")
+    first = h.penalty("a")
+    assert 0 < first <= hist.PENALTY_BASE
+    h.record_disconnect("a", "latency")
+    assert h.penalty("a") > first
+    h.save()
+    again = hist.History(path)
+    assert again.penalty("a") > first
+    again.record_stable("a")
+    assert again.penalty("a") == 0
+
+
+def test_reconnect_rate_limit(tmp_path):
+    path = str(tmp_path / "h.json")
+    h = hist.History(path)
+    now = 1000.0
+    for i in range(hist.RECONNECT_BURST):
+        assert h.reconnect_delay(now + i) == 0
+        h.record_reconnect(now + i)
+    assert h.reconnect_delay(now + 10) == hist.RECONNECT_WINDOW - 10
+    h.save()
+    assert hist.History(path).reconnect_delay(now + hist.RECONNECT_WINDOW) == 0
@@ -0,0 +1,242 @@
+import pvpn.routing as routing
+
+
+def _fake_nft(monkeypatch, table_exists=False):
+    calls = []
+
+    def fake_run(cmd, capture_output=True, input_text=None):
+        calls.append((cmd, input_text))
+        if cmd[:2] == ["nft", "list"] and not table_exists:
+            raise routing.subprocess.CalledProcessError(1, cmd)
+        return ""
+
+    monkeypatch.setattr(routing, "check_root", lambda: None)
+    monkeypatch.setattr(routing, "run_cmd", fake_run)
+    monkeypatch.setattr(routing.shutil, "which", lambda tool: f"/usr/sbin/{tool}" if tool == "nft" else None)
+    monkeypatch.setattr(routing, "emit", lambda *a, **k: None)
+    return calls
+
+
+def test_enable_is_one_nft_transaction(monkeypatch):
+    calls = _fake_nft(monkeypatch)
+    routing.enable_killswitch("wg0")
+
+    assert len(calls) == 1
+    cmd, script = calls[0]
+    assert cmd == ["nft", "-f", "-"]
+    # Replaces any earlier pvpn table within the same batch
+    assert script.startswith("table inet pvpn\ndelete table inet pvpn\n")
+    assert "policy drop;" in script and 'elements = { "wg0" }' in script
+
+
+def test_nft_sets_and_teardown(monkeypatch):
+    calls = _fake_nft(monkeypatch, table_exists=True)
+    routing.allow_endpoint("192.0.2.1:51820")
+    routing.allow_endpoint("[2001:db8::1]:51820")
+    routing.allow_interface("wg1")
+    routing.revoke_interface("wg0")
+    routing.disable_killswitch()
+
+    changes = [cmd for cmd, _ in calls if cmd[1] != "list"]
+    assert changes == [
+        ["nft", "add", "element", "inet", "pvpn", "endpoints4", "{ 192.0.2.1 . 51820 }"],
+        ["nft", "add", "element", "inet", "pvpn", "endpoints6", "{ 2001:db8::1 . 51820 }"],
+        ["nft", "add", "element", "inet", "pvpn", "ifaces", '{ "wg1" }'],
+        ["nft", "delete", "element", "inet", "pvpn", "ifaces", '{ "wg0" }'],
+        ["nft", "delete", "table", "inet", "pvpn"],
+    ]
+
+
+def test_nft_failure_falls_back_to_iptables(tmp_path, monkeypatch):
+    calls = _fake_nft(monkeypatch)
+    bak = tmp_path / "iptables.bak"
+    monkeypatch.setattr(routing, "IPTABLES_BAK", str(bak))
+    saved = []
+
+    def failing_run(cmd, capture_output=True, input_text=None):
+        if cmd[0] == "nft":
+            raise routing.subprocess.CalledProcessError(1, cmd)
+        calls.append((cmd, input_text))
+        return ""
+
+    class Saved:
+        stdout = b"*filter\nCOMMIT\n"
+
+    monkeypatch.setattr(routing, "run_cmd", failing_run)
+    monkeypatch.setattr(routing.subprocess, "run", lambda *a, **k: saved.append(a) or Saved())
+
+    routing.enable_killswitch("wg0")
+
+    assert saved and bak.read_text() == "*filter\nCOMMIT\n"
+    # The DROP policy goes in only after every accept rule
+    assert calls[0][0] == ["iptables", "-A", "OUTPUT", "-o", "wg0", "-j", "ACCEPT"]
+    assert calls[-1][0] == ["iptables", "-P", "OUTPUT", "DROP"]
+
+
+def test_parse_allowlist():
+    allow = routing.parse_allowlist(
+        ["192.168.1.0/24", "fd00::/8", "10.0.0.7", "nonsense"],
+        ["445/tcp", "2049/udp", "http", "99999", "53/icmp"],
+    )
+    assert allow.lan4 == ["192.168.1.0/24", "10.0.0.7/32"]
+    assert allow.lan6 == ["fd00::/8"]
+    assert allow.ports == [("tcp", 445), ("udp", 2049), ("tcp", 80)]
+    assert not routing.parse_allowlist([], ["445"])
+
+
+def test_allowlist_in_the_same_nft_batch(monkeypatch):
+    calls = _fake_nft(monkeypatch)
+    allow = routing.parse_allowlist(["192.168.1.0/24", "fd00::/8"], ["445/tcp"])
+    routing.enable_killswitch("wg0", allow)
+
+    assert len(calls) == 1
+    script = calls[0][1]
+    assert "elements = { 192.168.1.0/24 }" in script
+    assert "elements = { fd00::/8 }" in script
+    assert "elements = { tcp . 445 }" in script
+    assert "ip daddr @lan4 meta l4proto . th dport @lan_ports accept" in script
+    # Without ports, the LAN networks are open on every port
+    assert "ip daddr @lan4 accept" in routing.nft_ruleset("wg0", routing.parse_allowlist(["10.0.0.0/8"]))
+
+
+def test_empty_allowlist_has_no_empty_elements():
+    # "elements = {  }" is an nft syntax error that would fail the whole batch
+    for split in (None, "meta skuid 1001"):
+        script = routing.nft_ruleset("wgpnl1", routing.parse_allowlist([], []), split)
+        assert "elements = {" not in script.replace('elements = { "wgpnl1" }', "")
+
+
+def test_iptables_allowlist_uses_one_ipset_rule(monkeypatch):
+    calls = []
+
+    def fake_run(cmd, capture_output=True, input_text=None):
+        calls.append((cmd, input_text))
+        return ""
+
+    monkeypatch.setattr(routing, "run_cmd", fake_run)
+    monkeypatch.setattr(routing.shutil, "which", lambda tool: "/usr/sbin/ipset")
+    allow = routing.parse_allowlist(["192.168.1.0/24", "10.0.0.0/8"], ["445/tcp"])
+
+    rules = routing._iptables_lan_rules(allow)
+
+    assert rules == [["-m", "set", "--match-set", "pvpn-lan", "dst,dst", "-j", "ACCEPT"]]
+    assert calls[-1] == (["ipset", "restore"], (
+        "create pvpn-lan hash:net,port\n"
+        "add pvpn-lan 192.168.1.0/24,tcp:445\n"
+        "add pvpn-lan 10.0.0.0/8,tcp:445\n"
+    ))
+
+
+def test_policy_rules_installed_once(monkeypatch):
+    import socket
+
+    added, routes = [], []
+
+    class FakeRoute:
+        def __init__(self):
+            self.installed = []
+
+        def addresses(self, iface):
+            return ["10.2.0.2/32"]
+
+        def set_route(self, dst, iface, gateway, table):
+            routes.append((dst, iface, gateway, table))
+
+        def rules(self, family):
+            return list(self.installed)
+
+        def add_rule(self, family, **spec):
+            added.append((family, spec))
+            self.installed.append(spec)
+
+    rt = FakeRoute()
+    monkeypatch.setattr(routing, "check_root", lambda: None)
+    monkeypatch.setattr(routing, "SRC_VALID_MARK", "/nonexistent/src_valid_mark")
+    monkeypatch.setattr("pvpn.netlink.route", lambda: rt)
+
+    routing.install_policy("NL-1", "10.2.0.1")
+    routing.install_policy("NL-2", "10.2.0.1")
+
+    # Rules are keyed on the fwmark and table, so the second tunnel reuses them
+    assert [spec["priority"] for _, spec in added] == [routing.RULE_PRIORITY, routing.RULE_PRIORITY + 1]
+    assert all(family == socket.AF_INET for family, _ in added)
+    assert added[1][1] == {"table": routing.TUNNEL_TABLE, "priority": routing.RULE_PRIORITY + 1,
+                           "fwmark": routing.FWMARK, "invert": True}
+    assert routes == [
+        ("default", "NL-1", "10.2.0.1", routing.TUNNEL_TABLE),
+        ("default", "NL-2", "10.2.0.1", routing.TUNNEL_TABLE),
+    ]
+
+
+def test_split_match_by_uid_or_cgroup(tmp_path, monkeypatch):
+    monkeypatch.setattr(routing, "CGROUP_ROOT", str(tmp_path))
+    assert routing.split_match(uid=1001) == "meta skuid 1001"
+    match = routing.split_match(cgroup="/system.slice/qbittorrent-nox.service")
+    assert match == 'socket cgroupv2 level 2 "system.slice/qbittorrent-nox.service"'
+    # Created before the unit starts, so nft can resolve it for the first packet
+    assert (tmp_path / "system.slice" / "qbittorrent-nox.service").is_dir()
+
+
+def test_split_ruleset_confines_only_marked_traffic(monkeypatch):
+    calls = _fake_nft(monkeypatch)
+    allow = routing.parse_allowlist(["192.168.1.0/24"])
+    routing.enable_killswitch("wg0", allow, split="meta skuid 1001")
+
+    script = calls[0][1]
+    assert "meta skuid 1001 meta mark set 51821" in script
+    assert "type filter hook output priority 0; policy accept;" in script
+    assert "policy drop" not in script
+    output = script[script.index("chain output"):]
+    # Unmarked traffic goes first and untouched; marked traffic ends in drop
+    assert output.index("meta mark != 51821 accept") < output.index("oifname @ifaces accept") < output.index("drop")
+    assert "ip daddr @lan4 ct direction reply accept" in output
+    assert "meta mark 51821 oifname @ifaces masquerade" in script
+
+
+def test_split_rules_replace_full_tunnel_rule(monkeypatch):
+    import socket
+
+    calls = []
+
+    class FakeRoute:
+        installed = [
+            {"priority": routing.RULE_PRIORITY, "table": 254, "fwmark": None, "invert": False,
+             "suppress_prefixlen": 0},
+            {"priority": routing.RULE_PRIORITY + 1, "table": routing.TUNNEL_TABLE, "fwmark": routing.FWMARK,
+             "invert": True, "suppress_prefixlen": None},
+        ]
+
+        def rules(self, family):
+            return self.installed
+
+        def del_rule(self, family, *args):
+            calls.append(("del", args[:4]))
+
+        def add_rule(self, family, **spec):
+            calls.append(("add", spec))
+
+    monkeypatch.setattr("pvpn.netlink.route", lambda: FakeRoute())
+    routing._ensure_rules(socket.AF_INET, split=True)
+
+    assert calls == [
+        ("del", (routing.TUNNEL_TABLE, routing.RULE_PRIORITY + 1, routing.FWMARK, True)),
+        ("add", {"table": routing.TUNNEL_TABLE, "priority": routing.RULE_PRIORITY + 1, "fwmark": routing.SPLIT_MARK}),
+    ]
+
+
+def test_split_policy_needs_nft_table(monkeypatch):
+    import socket
+
+    ensured = []
+    monkeypatch.setattr(routing, "check_root", lambda: None)
+    monkeypatch.setattr(routing, "SRC_VALID_MARK", "/nonexistent/src_valid_mark")
+    monkeypatch.setattr(routing, "set_tunnel_route", lambda iface, gw: None)
+    monkeypatch.setattr(routing, "_families", lambda iface: [socket.AF_INET])
+    monkeypatch.setattr(routing, "_ensure_rules", lambda family, split: ensured.append(split))
+
+    # iptables fallback (or a failed nft batch): nothing sets SPLIT_MARK
+    monkeypatch.setattr(routing, "_nft_active", lambda: False)
+    assert routing.install_policy("wg0", "10.2.0.1", split=True) is False
+    monkeypatch.setattr(routing, "_nft_active", lambda: True)
+    assert routing.install_policy("wg0", "10.2.0.1", split=True) is True
+    assert ensured == [False, True]
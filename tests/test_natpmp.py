@@ -0,0 +1,159 @@
+import time
+
+import pytest
+
+import pvpn.natpmp as natpmp
+from pvpn.supervisor import Supervisor
+from fake_natpmp import FakeGateway
+
+
+@pytest.fixture
+def gateway():
+    gw = FakeGateway(public_port=45678)
+    yield gw
+    gw.close()
+
+
+def test_pack_parse_roundtrip():
+    assert natpmp.pack_request("tcp", 1, 0, 60) == bytes([0, 2, 0, 0, 0, 1, 0, 0, 0, 0, 0, 60])
+    reply = bytes([0, 129, 0, 0, 0, 0, 0, 7, 0, 1, 0xB2, 0x6E, 0, 0, 0, 60])
+    assert natpmp.parse_response(reply) == natpmp.Mapping("udp", 1, 45678, 60, 7)
+    with pytest.raises(natpmp.MappingError):
+        natpmp.parse_response(bytes([0, 130, 0, 2]) + bytes(12))
+    with pytest.raises(ValueError):
+        natpmp.parse_response(b"\x00")
+
+
+def test_request_mappings_parallel(gateway):
+    result = natpmp.request_mappings("127.0.0.1", port=gateway.port)
+    assert set(result) == {"udp", "tcp"}
+    assert result["udp"].public_port == 45678 and result["udp"].lifetime == 60
+    # One request per protocol, each answered without a retransmit
+    assert sorted(op for op, _, _ in gateway.requests) == [1, 2]
+
+
+def test_retransmits_after_loss():
+    gw = FakeGateway(public_port=40001, drop=2)
+    try:
+        result = natpmp.request_mappings("127.0.0.1", port=gw.port)
+        assert result["tcp"].public_port == 40001
+        assert len(gw.requests) == 4
+    finally:
+        gw.close()
+
+
+def test_refused_mapping_is_not_retried():
+    gw = FakeGateway(result=2)
+    try:
+        assert natpmp.request_mappings("127.0.0.1", port=gw.port) == {}
+        assert len(gw.requests) == 2
+    finally:
+        gw.close()
+
+
+def test_deadline_without_gateway():
+    gw = FakeGateway(drop=100)
+    try:
+        start = time.monotonic()
+        assert natpmp.request_mappings("127.0.0.1", port=gw.port, deadline=0.2) == {}
+        # Loose bound: the full retransmit schedule would take over a minute
+        assert time.monotonic() - start < 5.0
+    finally:
+        gw.close()
+
+
+def test_next_refresh_uses_granted_lifetime():
+    for _ in range(50):
+        delay = natpmp.next_refresh(120, 0.5, jitter=0.1)
+        assert 54 <= delay <= 66
+    assert natpmp.next_refresh(0, 0.5) == 1.0
+
+
+def test_gateway_restarted():
+    assert not natpmp.gateway_restarted(100, 0.0, 130, 30.0)
+    assert not natpmp.gateway_restarted(100, 0.0, 126, 30.0)
+    assert natpmp.gateway_restarted(100, 0.0, 5, 30.0)
+
+
+def _wait_for(cond, timeout=2.0):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if cond():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+@pytest.fixture
+def supervisor():
+    sup = Supervisor(workers=2)
+    yield sup
+    sup.shutdown()
+
+
+@pytest.fixture
+def fast_refresh(monkeypatch):
+    monkeypatch.setattr(natpmp, "next_refresh", lambda lifetime, fraction: 0.05)
+    monkeypatch.setattr(natpmp, "RETRY_INITIAL", 0.05)
+    monkeypatch.setattr(natpmp, "REQUEST_DEADLINE", 0.1)
+
+
+def test_forwarder_reports_port_change(gateway, fast_refresh, supervisor):
+    changes = []
+    fwd = natpmp.Forwarder("127.0.0.1", on_change=lambda o, n: changes.append((o, n)), port=gateway.port)
+    assert fwd.start() == 45678
+    supervisor.spawn("refresher", fwd.run())
+    gateway.public_port = 45999
+    assert _wait_for(lambda: (45678, 45999) in changes)
+    supervisor.cancel("refresher")
+    assert _wait_for(lambda: supervisor.running() == [])
+    seen = len(gateway.requests)
+    time.sleep(0.2)
+    # A cancelled refresher stops talking to the gateway
+    assert len(gateway.requests) == seen
+
+
+def test_forwarder_remaps_on_gateway_restart(gateway, fast_refresh, supervisor, monkeypatch):
+    gateway.epoch_offset = 1000
+    fwd = natpmp.Forwarder("127.0.0.1", port=gateway.port)
+    fwd.start()
+    supervisor.spawn("refresher", fwd.run())
+    monkeypatch.setattr(natpmp, "next_refresh", lambda lifetime, fraction: 60)
+    remaps = []
+    real_map = fwd._map
+    fwd._map = lambda: remaps.append(1) or real_map()
+    gateway.restart()
+    # The first renewal runs on the fast schedule, sees the epoch reset and
+    # remaps immediately instead of waiting for the next 60 s slot
+    assert _wait_for(lambda: len(remaps) >= 2)
+    fwd.stop()
+
+
+def test_forwarder_reports_lost_lease(fast_refresh, supervisor):
+    gw = FakeGateway(public_port=40002, lifetime=0)
+    changes = []
+    try:
+        fwd = natpmp.Forwarder("127.0.0.1", on_change=lambda o, n: changes.append((o, n)), port=gw.port)
+        assert fwd.start() == 40002
+        supervisor.spawn("refresher", fwd.run())
+        gw.drop = 1000
+        assert _wait_for(lambda: (40002, 0) in changes)
+        fwd.stop()
+    finally:
+        gw.close()
+
+
+def test_first_renewal_uses_granted_lifetime(supervisor, monkeypatch):
+    gw = FakeGateway(public_port=40003, lifetime=10)
+    lifetimes = []
+    monkeypatch.setattr(natpmp, "next_refresh", lambda lifetime, fraction: lifetimes.append(lifetime) or 0.05)
+    try:
+        fwd = natpmp.Forwarder("127.0.0.1", lifetime=3600, port=gw.port)
+        assert fwd.start() == 40003
+        supervisor.spawn("refresher", fwd.run())
+        # Asked for an hour, granted 10 s: renew well before those 10 s run out
+        assert _wait_for(lambda: len(lifetimes) >= 2)
+        fwd.stop()
+        assert lifetimes[:2] == [10, 10]
+    finally:
+        gw.close()
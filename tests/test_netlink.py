@@ -0,0 +1,69 @@
+import base64
+import struct
+
+import pvpn.netlink as nl
+import pvpn.wireguard as wireguard
+
+KEY = base64.b64encode(bytes(range(32))).decode()
+
+
+def test_attr_roundtrip():
+    data = nl.attr(1, b"abc") + nl.nested(2, nl.attr(3, b"\x01\x02\x03\x04"))
+    attrs = nl.parse_attrs(data)
+    assert attrs[1] == b"abc"
+    assert nl.parse_attrs(attrs[2]) == {3: b"\x01\x02\x03\x04"}
+
+
+def test_sockaddr_roundtrip():
+    assert nl.unpack_sockaddr(nl.pack_sockaddr("192.0.2.1:51820")) == "192.0.2.1:51820"
+    assert nl.unpack_sockaddr(nl.pack_sockaddr("[2001:db8::1]:51820")) == "[2001:db8::1]:51820"
+
+
+def test_peer_encode_decode():
+    peer = {
+        "public_key": KEY,
+        "endpoint": "192.0.2.1:51820",
+        "persistent_keepalive": 25,
+        "allowed_ips": ["0.0.0.0/0", "::/0"],
+    }
+    raw = b"".join(nl._peer_attrs(peer))
+    raw += nl.attr(nl.WGPEER_A_LAST_HANDSHAKE_TIME, struct.pack("=qq", 1700000000, 0))
+    raw += nl.attr(nl.WGPEER_A_RX_BYTES, struct.pack("=Q", 1234))
+    parsed = nl._parse_peer(raw)
+    assert parsed["public_key"] == KEY
+    assert parsed["endpoint"] == "192.0.2.1:51820"
+    assert parsed["persistent_keepalive"] == 25
+    assert parsed["allowed_ips"] == ["0.0.0.0/0", "::/0"]
+    assert parsed["last_handshake"] == 1700000000
+    assert parsed["rx_bytes"] == 1234
+
+
+def test_get_peers_falls_back_to_wg(monkeypatch):
+    def no_netlink():
+        raise OSError(2, "no wireguard family")
+
+    dump = (
+        "priv\tpub\t51820\toff\n"
+        f"{KEY}\t(none)\t192.0.2.1:51820\t0.0.0.0/0,::/0\t1700000000\t10\t20\t25\n"
+    )
+    monkeypatch.setattr(nl, "wireguard", no_netlink)
+    monkeypatch.setattr(wireguard, "run_cmd", lambda cmd, **kw: dump)
+    peers = wireguard.get_peers("wgptest0")
+    assert peers[0]["endpoint"] == "192.0.2.1:51820"
+    assert peers[0]["allowed_ips"] == ["0.0.0.0/0", "::/0"]
+    assert wireguard.get_latest_handshake("wgptest0") == 1700000000
+
+
+def test_rule_message_encodes_fwmark_and_suppress():
+    rt = object.__new__(nl.Route)
+    raw = rt._rule_msg(2, 51820, 32765, fwmark=51820, invert=True, suppress_prefixlen=None)
+    family, _, _, _, table, _, _, action, flags = nl._FIBRULE.unpack_from(raw)
+    attrs = nl.parse_attrs(raw[nl._FIBRULE.size:])
+    assert (family, table, action, flags) == (2, nl.RT_TABLE_UNSPEC, nl.FR_ACT_TO_TBL, nl.FIB_RULE_INVERT)
+    assert struct.unpack("=I", attrs[nl.FRA_TABLE])[0] == 51820
+    assert struct.unpack("=I", attrs[nl.FRA_FWMARK])[0] == 51820
+    assert nl.FRA_SUPPRESS_PREFIXLEN not in attrs
+    raw = rt._rule_msg(2, nl.RT_TABLE_MAIN, 32764, None, False, 0)
+    attrs = nl.parse_attrs(raw[nl._FIBRULE.size:])
+    assert nl._FIBRULE.unpack_from(raw)[4] == nl.RT_TABLE_MAIN
+    assert struct.unpack("=I", attrs[nl.FRA_SUPPRESS_PREFIXLEN])[0] == 0
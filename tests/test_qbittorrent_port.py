@@ -44,17 +44,67 @@ def test_config_path_from_pgrep(tmp_path, monkeypatch):
 def test_get_listen_port_webui(monkeypatch):
     cfg = Config(config_dir="/tmp/pvpn-test1")
 
-    class DummySession:
-        def post(self, *args, **kwargs):
-            return DummyResp()
-
-        def get(self, *args, **kwargs):
+    class DummyClient:
+        def get(self, path, **kwargs):
+            assert path == "app/preferences"
             return DummyResp({"listen_port": 1111})
 
-    monkeypatch.setattr(qb.requests, "Session", lambda: DummySession())
+    monkeypatch.setattr(qb, "client", lambda cfg: DummyClient())
     assert qb.get_listen_port(cfg) == 1111
 
 
+class FakeSession:
+    """Records calls; answers 403 once the SID has been invalidated."""
+
+    def __init__(self):
+        self.calls = []
+        self.sid_valid = False
+
+    def post(self, url, **kwargs):
+        self.calls.append(url.rsplit("/api/v2/", 1)[1])
+        self.sid_valid = True
+        return FakeResp(200, "Ok.")
+
+    def request(self, method, url, **kwargs):
+        self.calls.append(url.rsplit("/api/v2/", 1)[1])
+        return FakeResp(200 if self.sid_valid else 403, "{}")
+
+    def close(self):
+        pass
+
+
+class FakeResp(DummyResp):
+    def __init__(self, status, text):
+        super().__init__({"listen_port": 2222})
+        self.status_code = status
+        self.text = text
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise qb.requests.HTTPError(str(self.status_code))
+
+
+def test_client_reuses_sid_and_relogs_on_403():
+    c = qb.QBClient("http://qb", "u", "p")
+    c.session = FakeSession()
+    c.get("app/preferences")
+    c.get("app/preferences")
+    assert c.session.calls == ["auth/login", "app/preferences", "app/preferences"]
+    # qBittorrent restarted: the cached SID is rejected once, then renewed
+    c.session.sid_valid = False
+    c.session.calls.clear()
+    assert c.get("app/preferences").json()["listen_port"] == 2222
+    assert c.session.calls == ["app/preferences", "auth/login", "app/preferences"]
+
+
+def test_client_shared_per_credentials(tmp_path):
+    cfg = Config(config_dir=tmp_path / "cfg")
+    assert qb.client(cfg) is qb.client(cfg)
+    first = qb.client(cfg)
+    cfg.qb_pass = "changed"
+    assert qb.client(cfg) is not first
+
+
 def test_get_listen_port_config_fallback(tmp_path, monkeypatch):
     cfg = Config(config_dir=tmp_path / "cfg")
     cfg.qb_enable = False  # skip API
@@ -107,3 +157,159 @@ def test_get_listen_port_default(tmp_path, monkeypatch):
     )
 
     assert qb.get_listen_port(cfg) == cfg.qb_port
+
+
+def test_tracker_applies_maindata_deltas():
+    replies = iter([
+        {"rid": 1, "full_update": True, "torrents": {
+            "a": {"state": "downloading", "name": "A"},
+            "b": {"state": "pausedUP", "name": "B"},
+            "c": {"state": "queuedDL", "name": "C"},
+        }},
+        {"rid": 2, "torrents": {"b": {"state": "uploading"}}, "torrents_removed": ["c"]},
+    ])
+    rids = []
+
+    class DummyClient:
+        def get(self, path, params=None, **kwargs):
+            assert path == "sync/maindata"
+            rids.append(params["rid"])
+            return DummyResp(next(replies))
+
+    t = qb.TorrentTracker(DummyClient())
+    assert t.sync() == 3
+    assert t.active() == 1 and t.count(qb.BUSY_STATES) == 2
+    assert t.sync() == 2
+    assert rids == [0, 1]
+    assert t.torrents["b"] == {"state": "uploading", "name": "B"}
+    assert "c" not in t.torrents
+    assert t.active() == 2 and t.count(qb.BUSY_STATES) == 1
+
+
+class ActionClient:
+    """Records POSTs; answers 404 for the pre-5.0 pause/resume names if ``v5``."""
+
+    def __init__(self, v5=False):
+        self.posts = []
+        self.v5 = v5
+
+    def post(self, path, data=None, **kwargs):
+        if self.v5 and path in ("torrents/pause", "torrents/resume"):
+            resp = FakeResp(404, "Not Found")
+            raise qb.requests.HTTPError("404", response=resp)
+        self.posts.append((path, data["hashes"]))
+        return DummyResp()
+
+
+def _tracker(torrents):
+    t = qb.TorrentTracker(None)
+    t.torrents = torrents
+    t.sync = lambda: len(torrents)
+    return t
+
+
+def test_reannounce_order_busiest_first():
+    torrents = {
+        "idle": {"state": "stalledUP", "upspeed": 0, "dlspeed": 0, "last_activity": 50},
+        "paused": {"state": "pausedUP", "upspeed": 0, "dlspeed": 0},
+        "fast": {"state": "uploading", "upspeed": 900, "dlspeed": 0},
+        "slow": {"state": "downloading", "upspeed": 10, "dlspeed": 20},
+        "recent": {"state": "stalledDL", "upspeed": 0, "dlspeed": 0, "last_activity": 90},
+    }
+    assert qb.reannounce_order(torrents) == ["fast", "slow", "recent", "idle"]
+
+
+def test_reannounce_batches(monkeypatch):
+    import asyncio
+
+    c = ActionClient()
+    sleeps = []
+
+    async def fake_sleep(s):
+        sleeps.append(s)
+
+    torrents = {f"h{i:03}": {"state": "uploading", "upspeed": i} for i in range(120)}
+    monkeypatch.setattr(qb, "client", lambda cfg: c)
+    monkeypatch.setattr(qb, "tracker", lambda cfg: _tracker(torrents))
+    monkeypatch.setattr(qb.asyncio, "sleep", fake_sleep)
+
+    asyncio.run(qb.reannounce(Config(config_dir="/tmp/pvpn-test1")))
+
+    assert [p for p, _ in c.posts] == ["torrents/reannounce"] * 3
+    assert [len(h.split("|")) for _, h in c.posts] == [50, 50, 20]
+    assert c.posts[0][1].startswith("h119|h118")
+    assert sleeps == [qb.REANNOUNCE_INTERVAL] * 2
+
+
+def test_pause_then_resume_only_paused(monkeypatch):
+    c = ActionClient(v5=True)
+    torrents = {
+        "a": {"state": "uploading"},
+        "b": {"state": "stoppedUP"},
+        "c": {"state": "stalledDL"},
+    }
+    monkeypatch.setattr(qb, "client", lambda cfg: c)
+    monkeypatch.setattr(qb, "tracker", lambda cfg: _tracker(torrents))
+    monkeypatch.setattr(qb, "_paused", set())
+    cfg = Config(config_dir="/tmp/pvpn-test1")
+
+    assert qb.pause_transfers(cfg) == 2
+    assert qb.resume_transfers(cfg) == 2
+    assert qb.resume_transfers(cfg) == 0
+    # qBittorrent 5 only knows stop/start; the 404 falls through to them
+    assert c.posts == [("torrents/stop", "a|c"), ("torrents/start", "a|c")]
+
+
+class PrefsClient:
+    """Serves ``app/preferences`` from ``prefs`` and records ``setPreferences``."""
+
+    def __init__(self, **prefs):
+        self.prefs = {"listen_port": 6881, "random_port": False, "upnp": True, "use_natpmp": False, **prefs}
+        self.sets = []
+
+    def get(self, path, **kwargs):
+        assert path == "app/preferences"
+        return DummyResp(dict(self.prefs))
+
+    def post(self, path, data=None, **kwargs):
+        assert path == "app/setPreferences"
+        changes = qb.json.loads(data["json"])
+        self.sets.append(changes)
+        self.prefs.update(changes)
+        return DummyResp()
+
+
+def test_reconciler_posts_only_drift():
+    c = PrefsClient()
+    r = qb.PortReconciler(c)
+    assert r.reconcile() == {}  # nothing desired yet
+    r.want(41000)
+    assert r.reconcile() == {"listen_port": 41000, "upnp": False}
+    assert r.in_sync() and r.reconcile() == {}
+    # qBittorrent restarted with its old settings
+    c.prefs["listen_port"] = 6881
+    assert r.reconcile() == {"listen_port": 41000}
+    assert c.sets == [{"listen_port": 41000, "upnp": False}, {"listen_port": 41000}]
+
+
+def test_update_port_skips_applied_port(tmp_path, monkeypatch):
+    c = PrefsClient()
+    spawned = []
+    cfg = Config(config_dir=tmp_path / "cfg")
+    cfg.qb_enable = True
+    monkeypatch.setattr(qb, "client", lambda cfg: c)
+    monkeypatch.setattr(qb, "_reconciler", None)
+    monkeypatch.setattr(qb, "emit", lambda *a, **k: None)
+    monkeypatch.setattr(qb, "update_state", lambda **k: None)
+
+    def fake_spawn(name, coro):
+        coro.close()
+        spawned.append(name)
+
+    monkeypatch.setattr("pvpn.supervisor.spawn", fake_spawn)
+
+    assert qb.update_port(cfg, 41000)
+    assert spawned == ["resume", "reannounce"]
+    c.get = None  # a repeat of the same port makes no request at all
+    assert qb.update_port(cfg, 41000)
+    assert len(c.sets) == 1 and spawned == ["resume", "reannounce"]
@@ -0,0 +1,56 @@
+import threading
+
+import pvpn.catalog as catalog
+import pvpn.servers as srv
+
+
+def test_catalog_filter(tmp_path):
+    (tmp_path / "US-1.conf").write_text(
+        "# NAT-PMP (Port Forwarding) = on\n[Peer]\nEndpoint = 1.2.3.4:51820\n"
+    )
+    (tmp_path / "NL-2.conf").write_text("[Peer]\nEndpoint = [2001:db8::1]:51820\n")
+    (tmp_path / "notes.txt").write_text("ignored")
+
+    servers = catalog.load_catalog(str(tmp_path))
+    assert [s.name for s in servers] == ["NL-2", "US-1"]
+    assert servers[0].host == "2001:db8::1"
+    assert servers[1].host == "1.2.3.4" and servers[1].p2p
+
+    assert [s.name for s in srv.filter_servers(servers, cc="us")] == ["US-1"]
+    assert [s.name for s in srv.filter_servers(servers, p2p=True)] == ["US-1"]
+
+
+def test_rank_by_loss_then_rtt(monkeypatch):
+    servers = [
+        srv.Server("/x/a.conf", "10.0.0.1:1"),
+        srv.Server("/x/b.conf", "10.0.0.2:1"),
+        srv.Server("/x/c.conf", "10.0.0.3:1"),
+        srv.Server("/x/d.conf"),
+    ]
+    samples = {
+        "10.0.0.1": (80.0, 0.0),
+        "10.0.0.2": (20.0, 1 / 3),
+        "10.0.0.3": (30.0, 0.0),
+    }
+    monkeypatch.setattr(srv, "_probe", lambda host: samples[host])
+    results = srv.probe_servers(servers)
+    assert results["d"] == (None, 1.0)
+    assert [s.name for s in srv.rank_servers(servers, results)] == ["c", "a", "b", "d"]
+
+
+def test_probe_deadline(monkeypatch):
+    release = threading.Event()
+
+    def slow_probe(host):
+        if host == "10.0.0.2":
+            release.wait(5)
+        return 5.0, 0.0
+
+    servers = [srv.Server("/x/a.conf", "10.0.0.1:1"), srv.Server("/x/b.conf", "10.0.0.2:1")]
+    monkeypatch.setattr(srv, "_probe", slow_probe)
+    try:
+        # Only returns before the release if the deadline cuts the probe off
+        results = srv.probe_servers(servers, deadline=0.5)
+    finally:
+        release.set()
+    assert results == {"a": (5.0, 0.0), "b": (None, 1.0)}
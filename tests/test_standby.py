@@ -0,0 +1,146 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+import pvpn.events as events
+import pvpn.protonvpn as pv
+import pvpn.standby as standby
+from pvpn.config import Config
+from pvpn.natpmp import Mapping
+from pvpn.state import clear_state, read_state, update_state
+
+
+class DummySupervisor:
+    def __init__(self):
+        self.calls = []
+
+    def stop_session(self):
+        self.calls.append("stop")
+
+    def start_session(self, cfg, iface, server=None):
+        self.calls.append(("start", iface, server))
+
+    def spawn(self, name, coro):
+        self.calls.append(name)
+        asyncio.run(coro)
+
+
+def _setup(tmp_path, monkeypatch):
+    cfg = Config()
+    cfg.config_dir = str(tmp_path)
+    wg_dir = tmp_path / "wireguard"
+    wg_dir.mkdir()
+    for name, ip in (("NL-1", "192.0.2.1"), ("NL-2", "192.0.2.2")):
+        (wg_dir / f"{name}.conf").write_text(
+            f"[Interface]\nAddress = 10.2.0.2/32\n[Peer]\nEndpoint = {ip}:51820\n"
+        )
+    monkeypatch.setattr(pv, "check_root", lambda: None)
+    monkeypatch.setattr("pvpn.servers._probe", lambda host: (1.0, 0.0))
+    monkeypatch.setattr(standby, "_standby", None)
+    clear_state()
+    update_state(pid=os.getpid(), interface="NL-1", server="NL-1", killswitch=True)
+    return cfg
+
+
+def test_prepare_brings_up_next_best_server(tmp_path, monkeypatch):
+    cfg = _setup(tmp_path, monkeypatch)
+    up, allowed, probed = [], [], []
+    monkeypatch.setattr("pvpn.wireguard.bring_up", lambda path, dns=True: up.append((path, dns)) or "NL-2")
+    monkeypatch.setattr("pvpn.routing.allow_endpoint", allowed.append)
+    monkeypatch.setattr("pvpn.routing.allow_interface", lambda i: None)
+    monkeypatch.setattr(standby, "_wait_handshake", lambda iface, gw: True)
+
+    def fake_mappings(gateway, lifetime=0, iface=None, **kw):
+        probed.append((gateway, iface))
+        return {"udp": Mapping("udp", 1, 42000, lifetime, 7)}
+
+    monkeypatch.setattr("pvpn.natpmp.request_mappings", fake_mappings)
+
+    ready = standby.prepare(cfg)
+
+    assert ready["interface"] == "NL-2" and ready["server"] == "NL-2"
+    assert ready["forwarded_port"] == 42000
+    assert up == [(str(tmp_path / "wireguard" / "NL-2.conf"), False)]
+    assert allowed == ["192.0.2.2:51820"]
+    assert probed == [("10.2.0.1", "NL-2")]
+    assert read_state()["standby"]["server"] == "NL-2"
+    assert read_state()["interface"] == "NL-1"
+
+
+def test_prepare_drops_standby_without_handshake(tmp_path, monkeypatch):
+    cfg = _setup(tmp_path, monkeypatch)
+    deleted = []
+    monkeypatch.setattr("pvpn.wireguard.bring_up", lambda path, dns=True: "NL-2")
+    monkeypatch.setattr("pvpn.wireguard.delete_iface", deleted.append)
+    monkeypatch.setattr("pvpn.routing.allow_endpoint", lambda ep: None)
+    monkeypatch.setattr("pvpn.routing.allow_interface", lambda i: None)
+    monkeypatch.setattr("pvpn.routing.revoke_interface", lambda i: deleted.append(("revoke", i)))
+    monkeypatch.setattr(standby, "_wait_handshake", lambda iface, gw: False)
+
+    assert standby.prepare(cfg) is None
+    assert deleted == ["NL-2", ("revoke", "NL-2")]
+    assert standby.current() is None
+
+
+def test_prepare_allows_standby_before_handshake(tmp_path, monkeypatch):
+    cfg = _setup(tmp_path, monkeypatch)
+    order = []
+    monkeypatch.setattr("pvpn.wireguard.bring_up", lambda path, dns=True: order.append("up") or "NL-2")
+    monkeypatch.setattr("pvpn.routing.allow_endpoint", lambda ep: order.append("endpoint"))
+    monkeypatch.setattr("pvpn.routing.allow_interface", lambda i: order.append(("allow", i)))
+    monkeypatch.setattr(standby, "_wait_handshake", lambda iface, gw: order.append("handshake") or True)
+    monkeypatch.setattr("pvpn.natpmp.request_mappings", lambda *a, **kw: {})
+
+    standby.prepare(cfg)
+
+    # The handshake probe leaves through the standby, so the kill-switch must pass it first
+    assert order == ["endpoint", "up", ("allow", "NL-2"), "handshake"]
+
+
+def test_switch_promotes_ready_standby(tmp_path, monkeypatch):
+    cfg = _setup(tmp_path, monkeypatch)
+    sup = DummySupervisor()
+    order, pushed, seen = [], [], []
+    monkeypatch.setattr(standby, "_standby", {
+        "interface": "NL-2", "server": "NL-2", "path": "", "endpoint": "192.0.2.2:51820",
+        "gateway": "10.2.0.1", "forwarded_port": 42000, "ready_at": 0,
+    })
+    monkeypatch.setattr("pvpn.supervisor.get_supervisor", lambda: sup)
+    monkeypatch.setattr("pvpn.routing.allow_interface", lambda i: order.append(("allow", i)))
+    monkeypatch.setattr("pvpn.routing.switch_route", lambda a, b: order.append(("route", a, b)))
+    monkeypatch.setattr("pvpn.routing.revoke_interface", lambda i: order.append(("revoke", i)))
+    monkeypatch.setattr("pvpn.wireguard.delete_iface", lambda i: order.append(("delete", i)))
+    monkeypatch.setattr("pvpn.natpmp.start_forward", lambda iface: 42000)
+    monkeypatch.setattr("pvpn.qbittorrent.update_port", lambda cfg, port, quiet=False: pushed.append(port) or True)
+    monkeypatch.setattr(pv, "swap", lambda *a: (_ for _ in ()).throw(AssertionError))
+    monkeypatch.setattr(events, "emit", lambda kind, **data: seen.append((kind, data)))
+
+    result = pv.switch(cfg, SimpleNamespace(reason="user"))
+
+    assert result == {"interface": "NL-2", "server": "NL-2", "forwarded_port": 42000}
+    # Kill-switch opens for the standby before routes move; old rule goes last
+    assert order == [("allow", "NL-2"), ("route", "NL-1", "NL-2"), ("delete", "NL-1"), ("revoke", "NL-1")]
+    assert sup.calls == ["stop", ("start", "NL-2", "NL-2"), "qb_port"]
+    assert pushed == [42000]
+    state = read_state()
+    assert state["interface"] == "NL-2" and state["server"] == "NL-2" and state["standby"] is None
+    assert seen == [(events.SERVER_ROTATED, {"old": "NL-1", "new": "NL-2", "reason": "user", "mode": "standby"})]
+    assert standby.current() is None
+
+
+def test_switch_without_standby_swaps(tmp_path, monkeypatch):
+    cfg = _setup(tmp_path, monkeypatch)
+    monkeypatch.setattr(pv, "swap", lambda cfg, args: {"server": "swapped"})
+    assert pv.switch(cfg, SimpleNamespace(reason="user")) == {"server": "swapped"}
+
+
+def test_active_iface_is_never_the_standby(tmp_path, monkeypatch):
+    _setup(tmp_path, monkeypatch)
+    from pvpn.wireguard import get_active_iface
+
+    links = [{"name": "wgpnl2", "kind": "wireguard"}, {"name": "wgpnl1", "kind": "wireguard"}]
+    monkeypatch.setattr("pvpn.netlink.route", lambda: SimpleNamespace(links=lambda: links))
+    update_state(interface="wgpnl1", standby={"interface": "wgpnl2"})
+    assert get_active_iface() == "wgpnl1"
+    update_state(interface=None)
+    assert get_active_iface() == "wgpnl1"
@@ -1,5 +1,10 @@
+import json
+import os
 import re
+import threading
+import time
 import pvpn.protonvpn as pv
+import pvpn.state as state
 from pvpn.config import Config
 
 ANSI_RE = re.compile(r"\x1b\[[0-9;]*m")
@@ -16,11 +21,82 @@ def test_status_reports_all(monkeypatch, capsys):
     monkeypatch.setattr('pvpn.routing.killswitch_status', lambda: True)
     monkeypatch.setattr('pvpn.natpmp.get_public_port', lambda iface: 12345)
     monkeypatch.setattr('pvpn.qbittorrent.get_listen_port', lambda cfg: 6881)
+    monkeypatch.setattr('pvpn.qbittorrent.active_torrents', lambda cfg: 3)
 
-    pv.status(cfg)
+    pv.status(cfg, live=True)
     out_lines = strip_ansi(capsys.readouterr().out).splitlines()
     assert out_lines[0].startswith('✔ Interface') and out_lines[0].endswith('wgpTEST0')
     assert out_lines[1].startswith('✔ DNS') and out_lines[1].endswith('1.1.1.1, 9.9.9.9')
     assert out_lines[2].startswith('✔ Kill-switch') and out_lines[2].endswith('enabled')
     assert out_lines[3].startswith('✔ Forwarded port') and out_lines[3].endswith('12345')
     assert out_lines[4].startswith('✔ qBittorrent port') and out_lines[4].endswith('6881')
+    assert out_lines[-1].startswith('✔ Torrents') and out_lines[-1].endswith('3 active')
+
+
+def test_status_reads_state_file(monkeypatch, capsys):
+    cfg = Config()
+
+    def boom(*a, **k):
+        raise AssertionError("status must not probe without --live")
+
+    monkeypatch.setattr('pvpn.natpmp.get_public_port', boom)
+    monkeypatch.setattr('pvpn.qbittorrent.get_listen_port', boom)
+    monkeypatch.setattr('pvpn.routing.killswitch_status', boom)
+    monkeypatch.setattr('pvpn.wireguard.get_dns_servers', lambda: ['10.2.0.1'])
+    state.update_state(
+        pid=os.getpid(), interface='wgpnl1', server='NL-1', endpoint='1.2.3.4:51820',
+        killswitch=True, forwarded_port=40000, lease_expires=time.time() + 30, qb_port=40000,
+    )
+
+    pv.status(cfg)
+    out_lines = strip_ansi(capsys.readouterr().out).splitlines()
+    assert out_lines[0].endswith('wgpnl1')
+    assert out_lines[2].endswith('enabled')
+    assert '40000 (expires in' in out_lines[3]
+    assert out_lines[4].endswith('40000')
+    assert out_lines[5].endswith('NL-1 1.2.3.4:51820')
+
+
+def test_state_ignored_when_owner_gone(monkeypatch):
+    state.update_state(pid=2 ** 22 + 12345, interface='wgpnl1')
+    assert state.read_state() == {}
+    state.clear_state(killswitch=True)
+    assert state.read_state() == {'killswitch': True}
+
+
+def test_live_status_concurrent_with_timeouts(monkeypatch, capsys):
+    cfg = Config()
+    release = threading.Event()
+    # Both probes must be running at once to get past the barrier
+    together = threading.Barrier(2, timeout=5)
+
+    def slow_port(cfg):
+        release.wait(5)
+        return 6881
+
+    def slow_probe(*a):
+        together.wait()
+        return True
+
+    monkeypatch.setattr('pvpn.wireguard.get_active_iface', lambda: 'wgpTEST0')
+    monkeypatch.setattr('pvpn.wireguard.get_dns_servers', lambda: ['1.1.1.1'])
+    monkeypatch.setattr('pvpn.routing.killswitch_status', slow_probe)
+    monkeypatch.setattr('pvpn.natpmp.get_public_port', lambda iface: slow_probe() and 12345)
+    monkeypatch.setattr('pvpn.qbittorrent.get_listen_port', slow_port)
+
+    # Loose deadlines for the probes that answer; qb_port keeps its own
+    loose = {k: 5 for k in ("interface", "dns", "killswitch", "forwarded_port")}
+    monkeypatch.setattr(pv, "STATUS_DEADLINES", {**pv.STATUS_DEADLINES, **loose})
+    try:
+        pv.status(cfg, live=True, as_json=True)
+    finally:
+        release.set()
+    info = json.loads(capsys.readouterr().out)
+    assert info['interface'] == 'wgpTEST0'
+    assert info['killswitch'] is True
+    assert info['forwarded_port'] == 12345
+    assert info['qb_port'] == 'timeout'
+
+    pv._print_status(info)
+    out_lines = strip_ansi(capsys.readouterr().out).splitlines()
+    assert out_lines[4] == '✖ qBittorrent port: timeout'
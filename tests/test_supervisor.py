@@ -0,0 +1,98 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import pvpn.monitor as monitor
+import pvpn.natpmp as natpmp
+from pvpn.config import Config
+from pvpn.supervisor import Supervisor
+
+
+@pytest.fixture
+def sup():
+    s = Supervisor(workers=2)
+    yield s
+    s.shutdown()
+
+
+def _wait_for(cond, timeout=2.0):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if cond():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_spawn_replaces_task_of_same_name(sup):
+    cancelled = []
+
+    async def worker(tag):
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.append(tag)
+            raise
+
+    sup.spawn("monitor", worker("old"))
+    assert _wait_for(lambda: sup.running() == ["monitor"])
+    sup.spawn("monitor", worker("new"))
+    assert _wait_for(lambda: cancelled == ["old"])
+    sup.stop_session()
+    assert _wait_for(lambda: sup.running() == [] and cancelled == ["old", "new"])
+
+
+def test_sessions_do_not_leak_threads(sup, monkeypatch):
+    async def fake_monitor(cfg, iface, supervisor, server=None):
+        while True:
+            await asyncio.to_thread(time.sleep, 0.01)
+
+    class FakeForwarder:
+        async def run(self):
+            await asyncio.sleep(60)
+
+    async def fake_tracker(cfg):
+        await asyncio.sleep(60)
+
+    monkeypatch.setattr(monitor, "monitor", fake_monitor)
+    monkeypatch.setattr(natpmp, "current_forwarder", lambda: FakeForwarder())
+    monkeypatch.setattr("pvpn.qbittorrent.track_torrents", fake_tracker)
+    monkeypatch.setattr("pvpn.qbittorrent.reconcile_port", fake_tracker)
+    sup.start_session(Config(), "wgpnl1")
+    time.sleep(0.05)
+    baseline = threading.active_count()
+    for i in range(20):
+        sup.start_session(Config(), f"wgpnl{i}")
+    time.sleep(0.05)
+    assert sorted(sup.running()) == ["monitor", "qb_reconcile", "refresher", "torrents"]
+    # The executor (2 workers) may still be growing; a leak adds one per session
+    assert threading.active_count() <= baseline + 2
+
+
+def test_rotate_survives_failed_reconnect(sup, tmp_path, monkeypatch):
+    calls = []
+    cfg = Config()
+    cfg.config_dir = str(tmp_path)
+
+    def fake_disconnect(cfg, args):
+        calls.append(("disconnect", args.reason))
+
+    def fake_connect(cfg, args, wait=True):
+        calls.append(("connect", args.rotated_from, wait))
+        raise SystemExit(1)
+
+    def failed_swap(cfg, args):
+        calls.append(("swap", args.exclude))
+        raise RuntimeError("no other server to swap to")
+
+    monkeypatch.setattr("pvpn.protonvpn.swap", failed_swap)
+    monkeypatch.setattr("pvpn.protonvpn.disconnect", fake_disconnect)
+    monkeypatch.setattr("pvpn.protonvpn.connect", fake_connect)
+    sup.spawn("rotate", monitor.rotate(cfg, "wgpnl1", "latency", "NL-1"))
+    assert _wait_for(lambda: len(calls) == 3)
+    assert calls == [("swap", ["NL-1"]), ("disconnect", "latency"), ("connect", "NL-1", False)]
+    assert _wait_for(lambda: sup.running() == [])
+    # The loop is still alive
+    sup.spawn("noop", asyncio.sleep(0))
@@ -0,0 +1,120 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+import pvpn.events as events
+import pvpn.protonvpn as pv
+from pvpn.catalog import parse_file
+from pvpn.config import Config
+from pvpn.state import read_state, update_state
+
+
+class DummySupervisor:
+    def __init__(self):
+        self.calls = []
+
+    def stop_session(self):
+        self.calls.append("stop")
+
+    def start_session(self, cfg, iface, server=None):
+        self.calls.append(("start", iface, server))
+
+    def spawn(self, name, coro):
+        self.calls.append(name)
+        asyncio.run(coro)
+
+
+def test_swap_replaces_peer_only(tmp_path, monkeypatch):
+    cfg = Config()
+    cfg.config_dir = str(tmp_path)
+    wg_dir = tmp_path / "wireguard"
+    wg_dir.mkdir()
+    for name, ip in (("NL-1", "192.0.2.1"), ("NL-2", "192.0.2.2")):
+        (wg_dir / f"{name}.conf").write_text(
+            f"[Interface]\nAddress = 10.2.0.2/32\n[Peer]\nEndpoint = {ip}:51820\n"
+        )
+
+    sup = DummySupervisor()
+    swapped, allowed, pushed, seen, routed = [], [], [], [], []
+    monkeypatch.setattr("pvpn.utils.check_root", lambda: None)
+    monkeypatch.setattr(pv, "check_root", lambda: None)
+    monkeypatch.setattr("pvpn.wireguard.swap_peer", lambda iface, path: swapped.append(iface) or parse_file(path))
+    monkeypatch.setattr("pvpn.routing.allow_endpoint", allowed.append)
+    monkeypatch.setattr("pvpn.routing.set_tunnel_route", lambda iface, gw: routed.append((iface, gw)))
+    monkeypatch.setattr("pvpn.natpmp.start_forward", lambda iface: 41000)
+    monkeypatch.setattr("pvpn.qbittorrent.update_port", lambda cfg, port, quiet=False: pushed.append(port) or True)
+    monkeypatch.setattr("pvpn.supervisor.get_supervisor", lambda: sup)
+    monkeypatch.setattr("pvpn.servers._probe", lambda host: (1.0, 0.0))
+    for forbidden in ("bring_down", "bring_up"):
+        monkeypatch.setattr(f"pvpn.wireguard.{forbidden}", lambda *a, **k: (_ for _ in ()).throw(AssertionError))
+    monkeypatch.setattr(events, "emit", lambda kind, **data: seen.append((kind, data)))
+
+    update_state(pid=os.getpid(), interface="NL-1", server="NL-1", killswitch=True)
+    result = pv.swap(cfg, SimpleNamespace(reason="latency"))
+
+    assert result == {"interface": "NL-1", "server": "NL-2", "forwarded_port": 41000}
+    assert swapped == ["NL-1"]
+    assert allowed == ["192.0.2.2:51820"]
+    assert routed == [("NL-1", "10.2.0.1")]  # policy rules untouched, table route redone
+    assert pushed == [41000]
+    assert sup.calls == ["stop", ("start", "NL-1", "NL-2"), "qb_port"]
+    assert read_state()["server"] == "NL-2" and read_state()["interface"] == "NL-1"
+    assert seen[0] == (events.SERVER_ROTATED, {"old": "NL-1", "new": "NL-2", "reason": "latency", "mode": "swap"})
+
+
+def test_candidates_skip_penalised_servers(tmp_path):
+    from pvpn.history import get_history
+
+    cfg = Config()
+    cfg.config_dir = str(tmp_path)
+    wg_dir = tmp_path / "wireguard"
+    wg_dir.mkdir()
+    for name in ("NL-1", "NL-2", "NL-3"):
+        (wg_dir / f"{name}.conf").write_text("[Interface]\nAddress = 10.2.0.2/32\n[Peer]\nEndpoint = 192.0.2.1:51820\n")
+    history = get_history(cfg)
+    history.record_disconnect("NL-1", "unreachable")
+    history.record_disconnect("NL-2", "unreachable")
+    history.record_disconnect("NL-2", "unreachable")
+    assert [s.name for s in pv._candidates(cfg, None)] == ["NL-3"]
+    # With everything penalised, the server that comes out first is retried
+    history.record_disconnect("NL-3", "unreachable")
+    history.record_disconnect("NL-3", "unreachable")
+    assert [s.name for s in pv._candidates(cfg, None)] == ["NL-1"]
+
+
+def test_swap_peer_cli_fallback_drops_old_addresses(tmp_path, monkeypatch):
+    import pvpn.wireguard as wg
+
+    conf = tmp_path / "NL-2.conf"
+    conf.write_text(
+        "[Interface]\nPrivateKey = cHJpdmF0ZQ==\nAddress = 10.2.0.7/32, fd00::7/128\n"
+        "[Peer]\nPublicKey = cHVibGlj\nAllowedIPs = 0.0.0.0/0\nEndpoint = 192.0.2.2:51820\n"
+    )
+    cmds = []
+
+    def fake_run(cmd, capture_output=True, input_text=None):
+        cmds.append(cmd)
+        if cmd[:3] == ["ip", "-o", "address"]:
+            return (
+                "7: wgpnl1    inet 10.2.0.2 peer 10.2.0.1/32 scope global wgpnl1\\       valid_lft forever\n"
+                "7: wgpnl1    inet6 fd00::2/128 scope global \\       valid_lft forever\n"
+                "7: wgpnl1    inet6 fd00::7/128 scope global \\       valid_lft forever\n"
+            )
+        return ""
+
+    def no_netlink():
+        raise OSError("netlink unavailable")
+
+    monkeypatch.setattr(wg, "check_root", lambda: None)
+    monkeypatch.setattr(wg, "run_cmd", fake_run)
+    monkeypatch.setattr(wg.netlink, "wireguard", no_netlink)
+
+    wg.swap_peer("wgpnl1", str(conf))
+
+    assert ["ip", "address", "replace", "10.2.0.7/32", "peer", "10.2.0.1", "dev", "wgpnl1"] in cmds
+    deleted = [cmd for cmd in cmds if cmd[:3] == ["ip", "address", "del"]]
+    # The old server's addresses go; one shared with the new server stays
+    assert deleted == [
+        ["ip", "address", "del", "10.2.0.2", "peer", "10.2.0.1/32", "dev", "wgpnl1"],
+        ["ip", "address", "del", "fd00::2/128", "dev", "wgpnl1"],
+    ]
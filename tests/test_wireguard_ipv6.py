@@ -1,16 +1,17 @@
-import pvpn.wireguard as wg
+import pvpn.catalog as catalog
 
 
 def test_adds_ipv6(tmp_path):
     conf = tmp_path / 'wg.conf'
-    conf.write_text('[Interface]\nAllowedIPs = 0.0.0.0/0\n')
-    wg.ensure_ipv6_allowed(str(conf))
-    assert 'AllowedIPs = 0.0.0.0/0, ::/0' in conf.read_text()
+    original = '[Interface]\nPrivateKey = k\nAddress = 10.2.0.2/32\n[Peer]\nAllowedIPs = 0.0.0.0/0\n'
+    conf.write_text(original)
+    rendered = catalog.wg_config(str(conf))
+    assert 'AllowedIPs = 0.0.0.0/0, ::/0' in rendered
+    assert 'Address' not in rendered
+    assert conf.read_text() == original
 
 
 def test_no_duplicate(tmp_path):
     conf = tmp_path / 'wg.conf'
-    conf.write_text('[Interface]\nAllowedIPs = 0.0.0.0/0, ::/0\n')
-    wg.ensure_ipv6_allowed(str(conf))
-    content = conf.read_text()
-    assert content.count('::/0') == 1
+    conf.write_text('[Interface]\n[Peer]\nAllowedIPs = 0.0.0.0/0, ::/0\n')
+    assert catalog.wg_config(str(conf)).count('::/0') == 1